@@ -1,17 +1,728 @@
 import configparser
+import importlib.util
+import json
 import logging
 import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import Column, Index, MetaData, Table, Text, create_engine, inspect, text
+from sqlalchemy.schema import CreateIndex
 import argparse
 
+# The vehicles_stock column types and search indexes are shared with the Vehicle Search API:
+# its app/stock_schema.py is loaded from the repository (or from STOCK_SCHEMA_FILE) on first use
+STOCK_SCHEMA_FILE = os.getenv('STOCK_SCHEMA_FILE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'vehicle_search_api', 'app', 'stock_schema.py'))
+
+class StockSchemaError(Exception):
+    pass
+
+def load_stock_schema(path):
+    """Imports the shared schema module from its file, raising StockSchemaError with an explanation when it is missing."""
+    if not os.path.isfile(path):
+        raise StockSchemaError(f"Shared vehicles_stock schema not found at {os.path.normpath(path)}. Keep the "
+                               f"vehicle_search_api folder next to mysql_to_sqlite_sync as in the repository, or "
+                               f"set STOCK_SCHEMA_FILE to its app/stock_schema.py.")
+    spec = importlib.util.spec_from_file_location('stock_schema', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+_stock_schema = None
+
+def stock_schema():
+    """The shared schema module, loaded from STOCK_SCHEMA_FILE the first time it is needed."""
+    global _stock_schema
+    if _stock_schema is None:
+        _stock_schema = load_stock_schema(STOCK_SCHEMA_FILE)
+    return _stock_schema
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Rows read from the source per chunk, and chunks read ahead while the previous ones are written
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_PREFETCH_CHUNKS = 2
+# Suffix of the table each sync loads before renaming it over the live one
+STAGING_TABLE_SUFFIX = '_sync_staging'
+# Suffix of the table incremental syncs load the changed rows into before merging them
+DELTA_TABLE_SUFFIX = '_sync_delta'
+# Where incremental syncs keep their watermark, and how often they reload everything to drop deleted rows
+DEFAULT_CHECKPOINT_FILE = 'data/sync_checkpoint.json'
+DEFAULT_FULL_RECONCILE_HOURS = 24
+SYNC_MODES = ('full', 'incremental')
+# How SQLAlchemy stores DATETIME values in SQLite, kept by the direct SQLite load path
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# Page cache of the SQLite load connection, in KiB (negative values of cache_size are KiB)
+SQLITE_LOAD_CACHE_KIB = 65536
+# Key column the source is split on when extraction_partitions > 1
+DEFAULT_PARTITION_COLUMN = 'ficha_id'
+
 # Custom exception for source data fetching issues
 class SourceConnectionError(Exception):
     pass
 
+def add_derived_columns(chunk):
+    """Sets the STOCK_DERIVED_COLUMNS of a chunk from its STOCK_DERIVATION_INPUTS."""
+    schema = stock_schema()
+    inputs = chunk[list(schema.STOCK_DERIVATION_INPUTS)].astype(object)
+    records = inputs.where(inputs.notna(), None).to_dict('records')
+    derived = [schema.derive_stock_fields(record) for record in records]
+    for column in schema.STOCK_DERIVED_COLUMNS:
+        chunk[column] = [fields[column] for fields in derived]
+    return chunk
+
+class SourceData:
+    """
+    A source query result read in DataFrame chunks through an unbuffered cursor, so only
+    `chunk_size` rows are held in memory at a time. The query runs on creation, so
+    connection and query errors surface before anything is written. With `watermark_column`,
+    the highest value of that column among the rows read is kept in `max_watermark`.
+    Results with the STOCK_DERIVATION_INPUTS also get the STOCK_DERIVED_COLUMNS the API's
+    /cars/ reads, computed as its /stock/ ingestion does.
+    """
+
+    def __init__(self, engine, query, chunk_size=DEFAULT_CHUNK_SIZE, params=None, watermark_column=None):
+        self.chunk_size = chunk_size
+        self.rows_read = 0
+        self.watermark_column = watermark_column
+        self.max_watermark = None
+        self.connection = engine.raw_connection()
+        try:
+            # MySQL Connector/Python buffers the whole result unless asked not to
+            # (SQLAlchemy's stream_results is not supported by that driver)
+            if engine.dialect.driver == 'mysqlconnector':
+                self.cursor = self.connection.cursor(buffered=False)
+            else:
+                self.cursor = self.connection.cursor()
+            if params is None:
+                self.cursor.execute(query)
+            else:
+                self.cursor.execute(query, params)
+            self.source_columns = [column[0] for column in self.cursor.description]
+            schema = stock_schema()
+            self.derive = all(column in self.source_columns for column in schema.STOCK_DERIVATION_INPUTS)
+            self.columns = self.source_columns + [column for column in schema.STOCK_DERIVED_COLUMNS
+                                                  if self.derive and column not in self.source_columns]
+            if watermark_column and watermark_column not in self.columns:
+                raise ValueError(f"Watermark column '{watermark_column}' is not returned by the source query.")
+        except Exception:
+            self.connection.close()
+            raise
+
+    def chunks(self):
+        """Yields the rows as DataFrames of at most chunk_size rows (one empty frame if there are none)."""
+        first = True
+        while True:
+            rows = self.cursor.fetchmany(self.chunk_size)
+            if not rows and not first:
+                break
+            first = False
+            self.rows_read += len(rows)
+            chunk = pd.DataFrame.from_records(rows, columns=self.source_columns)
+            if self.derive:
+                chunk = add_derived_columns(chunk)
+            if self.watermark_column:
+                self.track_watermark(chunk[self.watermark_column])
+            yield chunk
+            if len(rows) < self.chunk_size:
+                break
+
+    def track_watermark(self, values):
+        values = values.dropna()
+        if len(values):
+            highest = values.max()
+            if self.max_watermark is None or highest > self.max_watermark:
+                self.max_watermark = highest
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except Exception:
+            pass  # An unbuffered cursor may complain about unread rows after a failed load
+        self.connection.close()
+
+def prefetch(iterable, depth):
+    """Iterates `iterable` in a background thread, keeping up to `depth` items ready for the consumer."""
+    return interleave([iterable], depth)
+
+def interleave(iterables, depth):
+    """
+    Iterates each of `iterables` in its own background thread and yields their items in arrival
+    order, keeping up to `depth` items ready for the consumer. The first error is re-raised.
+    """
+    items = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(iterable):
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    threads = [threading.Thread(target=produce, args=(iterable,), name=f'sync-source-reader-{index}', daemon=True)
+               for index, iterable in enumerate(iterables)]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = len(threads)
+        while remaining:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        # Unblocks the producers if the consumer stopped early
+        stop.set()
+        for thread in threads:
+            while thread.is_alive():
+                try:
+                    items.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+def sync_options(config):
+    """Chunk size and read-ahead depth of the streaming pipeline, from the [general] section."""
+    chunk_size = config.getint('general', 'chunk_size', fallback=DEFAULT_CHUNK_SIZE)
+    prefetch_chunks = config.getint('general', 'prefetch_chunks', fallback=DEFAULT_PREFETCH_CHUNKS)
+    return chunk_size, prefetch_chunks
+
+def incremental_options(config):
+    """Watermark column, merge key, checkpoint file and reconciliation interval, from the [incremental] section."""
+    return {
+        'watermark_column': config.get('incremental', 'watermark_column', fallback='ficha_id'),
+        'merge_key': config.get('incremental', 'merge_key', fallback='ficha_id'),
+        'checkpoint_file': config.get('incremental', 'checkpoint_file', fallback=DEFAULT_CHECKPOINT_FILE),
+        'full_reconcile_hours': config.getfloat('incremental', 'full_reconcile_hours',
+                                                fallback=DEFAULT_FULL_RECONCILE_HOURS),
+    }
+
+class SyncPlan:
+    """
+    What an incremental run of one target does: a full reload (no usable checkpoint yet, or the
+    periodic reconciliation is due) or a merge of the rows at or after the checkpointed watermark.
+    """
+
+    def __init__(self, target, options, checkpoint, full):
+        self.target = target
+        self.watermark_column = options['watermark_column']
+        self.merge_key = options['merge_key']
+        self.checkpoint_file = options['checkpoint_file']
+        self.full = full
+        self.watermark = None if full else checkpoint['watermark']
+        self.last_full_sync = checkpoint.get('last_full_sync') if checkpoint else None
+
+def load_checkpoints(path):
+    """Returns the checkpoints of every target stored in `path` ({} if there are none or they are unreadable)."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoints = json.load(f)
+        return checkpoints if isinstance(checkpoints, dict) else {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable sync checkpoint file '{path}': {e}")
+        return {}
+
+def plan_sync(config, target, mode, now=None):
+    """Returns the SyncPlan of an incremental run for `target`, or None for a plain full sync."""
+    if mode == 'full':
+        return None
+    now = now or datetime.now()
+    options = incremental_options(config)
+    checkpoint = load_checkpoints(options['checkpoint_file']).get(target)
+    reason = None
+    if not checkpoint or checkpoint.get('watermark') is None:
+        reason = "no checkpoint yet"
+    elif checkpoint.get('watermark_column') != options['watermark_column']:
+        reason = "watermark column changed"
+    elif options['full_reconcile_hours'] > 0:
+        last_full_sync = checkpoint.get('last_full_sync')
+        interval = timedelta(hours=options['full_reconcile_hours'])
+        if not last_full_sync or now - datetime.fromisoformat(last_full_sync) >= interval:
+            reason = "periodic full reconciliation due"
+    if reason:
+        logging.info(f"Incremental sync of '{target}' runs a full reload: {reason}.")
+        return SyncPlan(target, options, checkpoint, full=True)
+    logging.info(f"Incremental sync of '{target}': rows with {options['watermark_column']} >= {checkpoint['watermark']}.")
+    return SyncPlan(target, options, checkpoint, full=False)
+
+def align_plans(plans):
+    """
+    Makes the incremental plans of several targets share one extraction: a full reload of all
+    of them if any needs one, otherwise the rows at or after the lowest of their watermarks.
+    """
+    if any(plan.full for plan in plans):
+        for plan in plans:
+            plan.full, plan.watermark = True, None
+    elif plans:
+        lowest = min(plan.watermark for plan in plans)
+        for plan in plans:
+            plan.watermark = lowest
+
+def checkpoint_value(value):
+    """Converts a watermark read from the source to a JSON value that can be bound back into the query."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()  # numpy scalars
+    if isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+def save_checkpoint(plan, max_watermark, now=None):
+    """Records the watermark reached by a successful run of `plan`, replacing the checkpoint file atomically."""
+    now = now or datetime.now()
+    checkpoints = load_checkpoints(plan.checkpoint_file)
+    checkpoints[plan.target] = {
+        'watermark_column': plan.watermark_column,
+        # A merge of no rows keeps the previous watermark
+        'watermark': checkpoint_value(max_watermark) if max_watermark is not None else plan.watermark,
+        'last_full_sync': now.isoformat() if plan.full else plan.last_full_sync,
+        'last_sync': now.isoformat(),
+    }
+    checkpoint_dir = os.path.dirname(plan.checkpoint_file)
+    if checkpoint_dir and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    temporary_file = f"{plan.checkpoint_file}.tmp"
+    with open(temporary_file, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(temporary_file, plan.checkpoint_file)
+    logging.info(f"Saved sync checkpoint of '{plan.target}': {plan.watermark_column} = {checkpoints[plan.target]['watermark']}.")
+
+def wrap_query(engine, query, conditions=(), columns='*'):
+    """
+    Wraps the source query in SELECT `columns` FROM (query) WHERE `conditions`. Conditions
+    write their bound parameters as {marker}, which becomes the driver's placeholder.
+    """
+    query = query.strip().rstrip(';')
+    marker = '?'
+    if engine.dialect.paramstyle in ('format', 'pyformat'):
+        marker = '%s'
+        if any('{marker}' in condition for condition in conditions):
+            # The driver interpolates parameters with %, so literal percent signs must be doubled
+            query = query.replace('%', '%%')
+    wrapped = f"SELECT {columns} FROM ({query}) AS sync_source"
+    if conditions:
+        wrapped += " WHERE " + " AND ".join(condition.format(marker=marker) for condition in conditions)
+    return wrapped
+
+def watermark_condition(engine, column):
+    # Rows equal to the watermark are read again and merged idempotently, so rows
+    # committed later with the same value are not missed
+    return f"{quote_identifier(engine, column)} >= {{marker}}"
+
+def watermark_query(engine, query, column):
+    """Wraps the source query so it only returns the rows whose `column` is at or after one bound parameter."""
+    return wrap_query(engine, query, [watermark_condition(engine, column)])
+
+def partition_options(config):
+    """Number of key ranges the source is read in concurrently, and their key column, from the [general] section."""
+    partitions = config.getint('general', 'extraction_partitions', fallback=1)
+    column = config.get('general', 'partition_column', fallback=DEFAULT_PARTITION_COLUMN)
+    return max(1, partitions), column
+
+class PartitionedSource:
+    """
+    The source query split into `partitions` ranges of an integer key column, each read over
+    its own connection and cursor at the same time. Offers the SourceData interface; chunks
+    arrive in completion order, so they are not sorted by key.
+    """
+
+    def __init__(self, engine, query, partitions, partition_column, chunk_size=DEFAULT_CHUNK_SIZE,
+                 watermark=None, watermark_column=None, prefetch_chunks=DEFAULT_PREFETCH_CHUNKS):
+        self.prefetch_chunks = prefetch_chunks
+        self.parts = []
+        conditions, params = [], ()
+        if watermark_column and watermark is not None:
+            conditions, params = [watermark_condition(engine, watermark_column)], (watermark,)
+        key = quote_identifier(engine, partition_column)
+        key_range = SourceData(engine, wrap_query(engine, query, conditions, f"MIN({key}), MAX({key})"),
+                               params=params or None)
+        try:
+            lowest, highest = key_range.cursor.fetchone()
+        finally:
+            key_range.close()
+        try:
+            bounds = self.split(lowest, highest, partitions)
+        except (TypeError, ValueError):
+            raise ValueError(f"Partition column '{partition_column}' must hold integers to split the source by key ranges.")
+        try:
+            for index, (low, high) in enumerate(bounds):
+                # The first range also takes rows without a key and the last one rows added since MIN/MAX
+                ranges, range_params = [], ()
+                if index > 0:
+                    ranges.append(f"{key} >= {{marker}}")
+                    range_params += (low,)
+                if index < len(bounds) - 1:
+                    ranges.append(f"{key} < {{marker}}")
+                    range_params += (high,)
+                range_condition = " AND ".join(ranges)
+                if index == 0 and range_condition:
+                    range_condition = f"({range_condition} OR {key} IS NULL)"
+                part_conditions = conditions + ([range_condition] if range_condition else [])
+                self.parts.append(SourceData(engine, wrap_query(engine, query, part_conditions), chunk_size,
+                                             params=(params + range_params) or None, watermark_column=watermark_column))
+        except Exception:
+            self.close()
+            raise
+        self.columns = self.parts[0].columns
+        logging.info(f"Reading the source in {len(self.parts)} key ranges of '{partition_column}' at the same time.")
+
+    @staticmethod
+    def split(lowest, highest, partitions):
+        """[(low, high)] integer ranges of about the same width covering lowest..highest (one range if empty)."""
+        if lowest is None:
+            return [(None, None)]
+        lowest, highest = int(lowest), int(highest)
+        width = max(1, -(-(highest - lowest + 1) // partitions))
+        starts = list(range(lowest, highest + 1, width))
+        return [(start, start + width) for start in starts]
+
+    @property
+    def rows_read(self):
+        return sum(part.rows_read for part in self.parts)
+
+    @property
+    def max_watermark(self):
+        watermarks = [part.max_watermark for part in self.parts if part.max_watermark is not None]
+        return max(watermarks) if watermarks else None
+
+    def chunks(self):
+        """Yields the non-empty chunks of every range as they are read (one empty frame if there are none)."""
+        empty = None
+        for chunk in interleave([part.chunks() for part in self.parts], self.prefetch_chunks):
+            if len(chunk):
+                yield chunk
+            elif empty is None:
+                empty = chunk
+        if self.rows_read == 0:
+            yield empty
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+def load_chunks(engine, table_name, source, prefetch_chunks=DEFAULT_PREFETCH_CHUNKS):
+    """
+    Streams the source chunks into a staging table with batched INSERTs, reading the next
+    chunks while the current one is written, then renames the staging table over `table_name`.
+    The live table is left untouched if extraction or loading fails. Returns the rows loaded.
+    """
+    if engine.dialect.name == 'sqlite':
+        rows_loaded = load_chunks_sqlite(engine, table_name, source, prefetch_chunks)
+        record_stock_change(engine)
+        return rows_loaded
+    staging_table = f"{table_name}{STAGING_TABLE_SUFFIX}"
+    rows_loaded = 0
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {quote_identifier(engine, staging_table)}"))
+        for index, chunk in enumerate(prefetch(source.chunks(), prefetch_chunks)):
+            # One executemany per chunk: MySQL Connector/Python sends it as multi-row INSERTs and
+            # SQLite reuses one prepared statement (pandas' method='multi' is far slower on both)
+            chunk.to_sql(staging_table, connection, if_exists='replace' if index == 0 else 'append', index=False,
+                         dtype=stock_schema().stock_column_types(chunk.columns))
+            rows_loaded += len(chunk)
+            if len(chunk):
+                logging.info(f"Loaded {rows_loaded} rows into staging table '{staging_table}'.")
+    create_staging_indexes(engine, table_name, staging_table)
+    swap_staging_table(engine, table_name, staging_table)
+    record_stock_change(engine)
+    return rows_loaded
+
+def merge_chunks(engine, table_name, source, merge_key, prefetch_chunks=DEFAULT_PREFETCH_CHUNKS):
+    """
+    Streams the source chunks into a delta table, then replaces the rows of `table_name` that
+    have the same `merge_key` values with the delta rows in one transaction. Rows missing from
+    the source are kept (the periodic full reload removes them). Returns the rows merged.
+    """
+    delta_table = f"{table_name}{DELTA_TABLE_SUFFIX}"
+    live, delta = quote_identifier(engine, table_name), quote_identifier(engine, delta_table)
+    rows_merged = 0
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {delta}"))
+        for index, chunk in enumerate(prefetch(source.chunks(), prefetch_chunks)):
+            chunk.to_sql(delta_table, connection, if_exists='replace' if index == 0 else 'append', index=False,
+                         dtype=stock_schema().stock_column_types(chunk.columns))
+            rows_merged += len(chunk)
+    try:
+        if not inspect(engine).has_table(table_name):
+            logging.warning(f"Table '{table_name}' does not exist; creating it from the {rows_merged} changed rows.")
+            swap_staging_table(engine, table_name, delta_table)
+            record_stock_change(engine)
+            return rows_merged
+        if rows_merged:
+            # Columns the live table lacks (e.g. derived ones added by a newer sync) wait for the next full reload
+            live_columns = {column['name'] for column in inspect(engine).get_columns(table_name)}
+            columns = ', '.join(quote_identifier(engine, column['name'])
+                                for column in inspect(engine).get_columns(delta_table)
+                                if column['name'] in live_columns)
+            key = quote_identifier(engine, merge_key)
+            with engine.begin() as connection:
+                connection.execute(text(f"DELETE FROM {live} WHERE {key} IN (SELECT {key} FROM {delta})"))
+                connection.execute(text(f"INSERT INTO {live} ({columns}) SELECT {columns} FROM {delta}"))
+            record_stock_change(engine)
+            logging.info(f"Merged {rows_merged} changed rows into table '{table_name}'.")
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {delta}"))
+    return rows_merged
+
+def record_stock_change(engine):
+    """
+    Bumps the stock version row of the target once the new rows are committed, so the API's
+    workers stop serving /cars/ results they cached from the previous rows.
+    """
+    schema = stock_schema()
+    schema.ensure_stock_version_table(engine)
+    with engine.begin() as connection:
+        schema.bump_stock_version(connection)
+
+def create_staging_indexes(engine, table_name, staging_table):
+    """
+    Gives the staging table the STOCK_SEARCH_INDEXES and the other indexes of the live table
+    before it is swapped in, so a sync never leaves the table without them.
+    """
+    staging = Table(staging_table, MetaData(), autoload_with=engine)
+    indexes = {index.name: index for index in stock_schema().stock_search_indexes(staging)}
+    if inspect(engine).has_table(table_name):
+        for reflected in inspect(engine).get_indexes(table_name):
+            column_names = reflected['column_names']
+            if reflected['name'] in indexes or not all(column in staging.c for column in column_names if column):
+                continue
+            if None in column_names:
+                continue  # Expression indexes cannot be rebuilt from their column names
+            indexes[reflected['name']] = Index(reflected['name'], *[staging.c[column] for column in column_names],
+                                               unique=reflected['unique'], **reflected.get('dialect_options', {}))
+    for index in indexes.values():
+        # DDL commits implicitly on MySQL, so each index gets its own statement
+        with engine.begin() as connection:
+            index.create(connection)
+
+def quote_identifier(engine, name):
+    return engine.dialect.identifier_preparer.quote(name)
+
+def swap_staging_table(engine, table_name, staging_table):
+    """Replaces `table_name` with the fully loaded staging table."""
+    live, staging = quote_identifier(engine, table_name), quote_identifier(engine, staging_table)
+    if engine.dialect.name == 'sqlite':
+        with sqlite_transaction(engine) as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {live}")
+            cursor.execute(f"ALTER TABLE {staging} RENAME TO {live}")
+        return
+    exists = inspect(engine).has_table(table_name)
+    with engine.begin() as connection:
+        if engine.dialect.name == 'mysql':
+            # One RENAME TABLE statement swaps both names atomically
+            if exists:
+                retired = quote_identifier(engine, f"{table_name}_sync_old")
+                connection.execute(text(f"DROP TABLE IF EXISTS {retired}"))
+                connection.execute(text(f"RENAME TABLE {live} TO {retired}, {staging} TO {live}"))
+                connection.execute(text(f"DROP TABLE {retired}"))
+            else:
+                connection.execute(text(f"RENAME TABLE {staging} TO {live}"))
+        else:
+            connection.execute(text(f"DROP TABLE IF EXISTS {live}"))
+            connection.execute(text(f"ALTER TABLE {staging} RENAME TO {live}"))
+
+@contextmanager
+def sqlite_transaction(engine):
+    """
+    Yields a raw sqlite3 cursor inside BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error), in WAL
+    mode. The sqlite3 module runs DDL outside of transactions unless one is opened explicitly,
+    which would let readers see the table dropped or half renamed.
+    """
+    connection = engine.raw_connection()
+    sqlite_connection = connection.driver_connection
+    isolation_level = sqlite_connection.isolation_level
+    sqlite_connection.isolation_level = None  # Transactions are managed below
+    cursor = sqlite_connection.cursor()
+    try:
+        # WAL lets readers keep reading the committed tables while the load runs
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_LOAD_CACHE_KIB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            cursor.execute("COMMIT")
+        except BaseException:
+            if sqlite_connection.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+    finally:
+        cursor.close()
+        sqlite_connection.isolation_level = isolation_level
+        connection.close()
+
+def sqlite_value(value):
+    """Converts a value of an object column to one the sqlite3 module binds, as SQLAlchemy would store it."""
+    if isinstance(value, datetime):
+        return value.strftime(SQLITE_DATETIME_FORMAT)
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def sqlite_rows(chunk):
+    """The chunk's rows as tuples of plain Python values, with None for missing values."""
+    columns = []
+    for name in chunk.columns:
+        values = chunk[name]
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            values = values.dt.strftime(SQLITE_DATETIME_FORMAT)
+        values = values.astype(object).where(values.notna(), None)
+        if chunk[name].dtype == object:
+            values = values.map(sqlite_value)
+        columns.append(values.tolist())
+    return zip(*columns)
+
+def load_chunks_sqlite(engine, table_name, source, prefetch_chunks=DEFAULT_PREFETCH_CHUNKS):
+    """
+    The SQLite path of load_chunks. A single transaction creates the staging table with the
+    declared stock column types, inserts every chunk with one prepared statement, renames it
+    over the live table and builds the live table's indexes and the STOCK_SEARCH_INDEXES, so
+    readers only ever see the previous or the new complete table.
+    """
+    staging_table = f"{table_name}{STAGING_TABLE_SUFFIX}"
+    live, staging = quote_identifier(engine, table_name), quote_identifier(engine, staging_table)
+    rows_loaded = 0
+    schema = stock_schema()
+    with sqlite_transaction(engine) as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        insert = None
+        for chunk in prefetch(source.chunks(), prefetch_chunks):
+            if insert is None:
+                cursor.execute(pd.io.sql.get_schema(chunk, staging_table, con=engine,
+                                                    dtype=schema.stock_column_types(chunk.columns)))
+                search_indexes = schema.stock_search_indexes(Table(table_name, MetaData(), *[
+                    Column(str(column), schema.stock_column_type(str(column)) or Text()) for column in chunk.columns]))
+                columns = ', '.join(quote_identifier(engine, str(column)) for column in chunk.columns)
+                markers = ', '.join('?' for _ in chunk.columns)
+                insert = f"INSERT INTO {staging} ({columns}) VALUES ({markers})"
+            cursor.executemany(insert, sqlite_rows(chunk))
+            rows_loaded += len(chunk)
+            if len(chunk):
+                logging.info(f"Loaded {rows_loaded} rows into staging table '{staging_table}'.")
+        # Indexes are built once the rows are in, which is faster than maintaining them per insert
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                       (table_name,))
+        live_indexes = cursor.fetchall()
+        cursor.execute(f"PRAGMA table_info({staging})")
+        staging_columns = {row[1] for row in cursor.fetchall()}
+        index_statements = []
+        for name, sql in live_indexes:
+            # Like create_staging_indexes: only indexes whose columns the new table still has
+            cursor.execute(f"PRAGMA index_info({quote_identifier(engine, name)})")
+            column_names = [row[2] for row in cursor.fetchall()]
+            if None in column_names or not all(column in staging_columns for column in column_names):
+                logging.info(f"Not rebuilding index '{name}': the new '{table_name}' lacks its columns.")
+                continue
+            index_statements.append(sql)
+        index_statements += [str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                             for index in search_indexes]
+        cursor.execute(f"DROP TABLE IF EXISTS {live}")
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO {live}")
+        for statement in index_statements:
+            cursor.execute(statement)
+    return rows_loaded
+
+class TargetFeed:
+    """One target's view of a source read once for several targets: chunks come from fan_out."""
+
+    def __init__(self, source, depth):
+        self.source = source
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.closed = threading.Event()
+        self.done = object()
+
+    @property
+    def columns(self):
+        return self.source.columns
+
+    def put(self, entry):
+        """Queues a chunk unless the target has stopped reading; returns whether it is still reading."""
+        while not self.closed.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def chunks(self):
+        while True:
+            chunk, error = self.queue.get()
+            if error is not None:
+                raise error
+            if chunk is self.done:
+                return
+            yield chunk
+
+def fan_out(source, feeds):
+    """Reads the source once and hands every chunk to each feed, at the pace of the slowest one still reading."""
+    try:
+        for chunk in source.chunks():
+            reading = [feed.put((chunk, None)) for feed in feeds]
+            if not any(reading):
+                return
+        for feed in feeds:
+            feed.put((feed.done, None))
+    except Exception as e:
+        for feed in feeds:
+            feed.put((None, e))
+
+def write_to_targets(source, targets, write, prefetch_chunks=DEFAULT_PREFETCH_CHUNKS):
+    """
+    Writes one read of the source to every target at the same time, calling write(target, feed)
+    in a pool of one thread per target. Returns {target: rows written or the exception raised}.
+    """
+    feeds = {target: TargetFeed(source, prefetch_chunks) for target in targets}
+
+    def run(target):
+        try:
+            return write(target, feeds[target])
+        finally:
+            feeds[target].closed.set()
+
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='sync-target') as pool:
+        futures = {target: pool.submit(run, target) for target in targets}
+        fan_out(source, list(feeds.values()))
+        results = {}
+        for target, future in futures.items():
+            try:
+                results[target] = future.result()
+            except Exception as e:
+                results[target] = e
+    return results
+
 def load_config(config_file='config.ini'):
     """Loads configuration from the specified INI file."""
     config = configparser.ConfigParser()
@@ -22,8 +733,11 @@ def load_config(config_file='config.ini'):
     logging.info(f"Configuration loaded from '{config_file}'.")
     return config
 
-def fetch_data_from_external_db(config):
-    """Fetches data from the primary external database using details from the config."""
+def fetch_data_from_external_db(config, plan=None):
+    """
+    Opens the primary external database query as a chunked SourceData, using details from the config.
+    An incremental `plan` restricts the query to the rows at or after its watermark.
+    """
     try:
         db_type = config.get('external_db', 'type')
         user = config.get('external_db', 'user')
@@ -46,20 +760,31 @@ def fetch_data_from_external_db(config):
         logging.error(f"Unsupported database type in 'external_db': {db_type}")
         raise SourceConnectionError(f"Unsupported database type in 'external_db': {db_type}")
 
+    chunk_size, prefetch_chunks = sync_options(config)
+    partitions, partition_column = partition_options(config)
     try:
         engine = create_engine(engine_url)
-        with engine.connect() as connection:
-            logging.info(f"Successfully connected to primary external {db_type} database at {host}.")
-            df = pd.read_sql_query(text(query), connection)
-            logging.info(f"Successfully fetched {len(df)} rows from the primary external database.")
-            return df
+        if partitions > 1:
+            incremental = plan is not None and not plan.full
+            source = PartitionedSource(engine, query, partitions, partition_column, chunk_size,
+                                       watermark=plan.watermark if incremental else None,
+                                       watermark_column=plan.watermark_column if plan is not None else None,
+                                       prefetch_chunks=prefetch_chunks)
+        elif plan is not None and not plan.full:
+            source = SourceData(engine, watermark_query(engine, query, plan.watermark_column), chunk_size,
+                                params=(plan.watermark,), watermark_column=plan.watermark_column)
+        else:
+            source = SourceData(engine, query, chunk_size,
+                                watermark_column=plan.watermark_column if plan is not None else None)
+        logging.info(f"Successfully connected to primary external {db_type} database at {host}; reading in chunks of {chunk_size} rows.")
+        return source
     except Exception as e:
         logging.error(f"Error connecting to or fetching data from primary external {db_type} database: {e}")
         # Raise a custom exception to be caught by main for fallback logic
         raise SourceConnectionError(f"Failed to fetch from primary external_db: {e}")
 
 def fetch_data_from_sqlite(config):
-    """Fetches data from the local SQLite database to be used as a fallback source."""
+    """Opens the local SQLite table as a chunked SourceData, to be used as a fallback source."""
     try:
         db_path_str = config.get('local_db', 'db_path')
         table_name = config.get('local_db', 'table_name')
@@ -85,16 +810,20 @@ def fetch_data_from_sqlite(config):
             if result.empty:
                 logging.warning(f"Table '{table_name}' not found in local SQLite DB '{db_path_str}'. Cannot use as fallback.")
                 return None
-            
-            df = pd.read_sql_query(text(f"SELECT * FROM {table_name}"), connection)
-            logging.info(f"Successfully fetched {len(df)} rows from local SQLite DB (fallback source).")
-            return df
+
+        chunk_size, _ = sync_options(config)
+        source = SourceData(engine, f"SELECT * FROM {quote_identifier(engine, table_name)}", chunk_size)
+        logging.info(f"Reading local SQLite DB (fallback source) in chunks of {chunk_size} rows.")
+        return source
     except Exception as e:
         logging.error(f"Error reading data from local SQLite DB (fallback source): {e}")
         return None
 
-def write_data_to_sqlite(df, config):
-    """Writes the DataFrame to a local SQLite database."""
+def write_data_to_sqlite(source, config, merge_key=None):
+    """
+    Streams the source data into a local SQLite database and returns the number of rows written.
+    With `merge_key`, the rows are merged into the existing table instead of replacing it.
+    """
     try:
         db_path_str = config.get('local_db', 'db_path')
         table_name = config.get('local_db', 'table_name')
@@ -111,17 +840,24 @@ def write_data_to_sqlite(df, config):
         logging.info(f"Created directory for SQLite database: {db_dir}")
 
     engine_url = f"sqlite:///{db_path_str}"
+    _, prefetch_chunks = sync_options(config)
     try:
         engine = create_engine(engine_url)
-        # Test connection implicitly via to_sql
-        df.to_sql(table_name, engine, if_exists='replace', index=False)
-        logging.info(f"Successfully wrote {len(df)} rows to table '{table_name}' in SQLite database '{db_path_str}'.")
+        if merge_key:
+            rows = merge_chunks(engine, table_name, source, merge_key, prefetch_chunks)
+        else:
+            rows = load_chunks(engine, table_name, source, prefetch_chunks)
+        logging.info(f"Successfully wrote {rows} rows to table '{table_name}' in SQLite database '{db_path_str}'.")
+        return rows
     except Exception as e:
         logging.error(f"Error writing data to SQLite database '{db_path_str}': {e}")
         raise
 
-def write_data_to_azure_mysql(df, config):
-    """Writes the DataFrame to the Azure MySQL database."""
+def write_data_to_azure_mysql(source, config, merge_key=None):
+    """
+    Streams the source data into the Azure MySQL database and returns the number of rows written.
+    With `merge_key`, the rows are merged into the existing table instead of replacing it.
+    """
     try:
         db_type = config.get('azure_mysql_db', 'type')
         user = config.get('azure_mysql_db', 'user')
@@ -171,83 +907,125 @@ def write_data_to_azure_mysql(df, config):
         connect_args['ssl_disabled'] = True
 
     engine_url = f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
+    _, prefetch_chunks = sync_options(config)
     
     try:
         logging.info(f"Attempting to connect to Azure MySQL with connect_args: {connect_args}")
         engine = create_engine(engine_url, connect_args=connect_args)
-        # Test connection by trying to create the table (or replace it)
-        # Pandas to_sql will create the database if it doesn't exist, if the user has perms.
-        # However, it's better if the database 'vehicles_db' already exists.
-        # The table will be replaced.
-        df.to_sql(table_name, engine, if_exists='replace', index=False)
-        logging.info(f"Successfully wrote {len(df)} rows to table '{table_name}' in Azure MySQL database '{database}' at {host}.")
+        # The database 'vehicles_db' must already exist; the table is replaced once fully loaded.
+        if merge_key:
+            rows = merge_chunks(engine, table_name, source, merge_key, prefetch_chunks)
+        else:
+            rows = load_chunks(engine, table_name, source, prefetch_chunks)
+        logging.info(f"Successfully wrote {rows} rows to table '{table_name}' in Azure MySQL database '{database}' at {host}.")
+        return rows
     except Exception as e:
         logging.error(f"Error writing data to Azure MySQL database '{database}' at {host}: {e}")
         raise
 
+# Writers of the targets a run can fan out to
+TARGET_WRITERS = {
+    'azure': write_data_to_azure_mysql,
+    'local_sqlite': write_data_to_sqlite,
+}
+
 def main():
     """Main function to orchestrate the data synchronization."""
     logging.info("Starting database synchronization process...")
     
     parser = argparse.ArgumentParser(description="Synchronize data from a source to a target database.")
-    parser.add_argument('--target', type=str, choices=['azure', 'local_sqlite'], 
-                        help="Specify the target database (azure or local_sqlite). Overrides config default.")
+    parser.add_argument('--target', type=str, nargs='+', choices=list(TARGET_WRITERS),
+                        help="Specify one or more target databases (azure, local_sqlite), all written from a single read of the source. Overrides config default.")
+    parser.add_argument('--mode', type=str, choices=SYNC_MODES,
+                        help="Reload everything (full) or only rows changed since the last checkpoint (incremental). Overrides config sync_mode.")
     args = parser.parse_args()
 
     try:
+        # Fail before touching any database if the shared table schema cannot be loaded
+        stock_schema()
         config = load_config()
 
-        # Determine target
-        cli_target = args.target
-        config_default_target = config.get('general', 'default_target', fallback='azure').lower()
+        # Determine targets (default_target may list several, separated by commas)
+        cli_targets = args.target
+        config_default_targets = [target.strip().lower() for target in
+                                  config.get('general', 'default_target', fallback='azure').split(',') if target.strip()]
         target_argument_enabled = config.getboolean('general', 'target_argument_enabled', fallback=True)
 
-        chosen_target = config_default_target
-        if cli_target and target_argument_enabled:
-            chosen_target = cli_target.lower()
-            logging.info(f"Using command-line specified target: {chosen_target}")
+        chosen_targets = config_default_targets
+        if cli_targets and target_argument_enabled:
+            chosen_targets = [target.lower() for target in cli_targets]
+            logging.info(f"Using command-line specified targets: {', '.join(chosen_targets)}")
         else:
-            logging.info(f"Using default target from config: {chosen_target}")
+            logging.info(f"Using default targets from config: {', '.join(chosen_targets)}")
+        chosen_targets = list(dict.fromkeys(chosen_targets))
+        invalid_targets = [target for target in chosen_targets if target not in TARGET_WRITERS]
+        if invalid_targets or not chosen_targets:
+            logging.error(f"Invalid target specified or determined: {', '.join(invalid_targets) or '(none)'}")
+            return # Exit if a target is not recognized
 
-        # Fetch data (with fallback)
-        data_df = None
+        mode = (args.mode or config.get('general', 'sync_mode', fallback='full')).lower()
+        if mode not in SYNC_MODES:
+            raise ValueError(f"Invalid sync_mode '{mode}' (expected one of: {', '.join(SYNC_MODES)})")
+        plans = {target: plan_sync(config, target, mode) for target in chosen_targets}
+        if mode == 'incremental':
+            align_plans(list(plans.values()))
+        # Every target is written from the same read of the source
+        plan = plans[chosen_targets[0]]
+
+        # Open the source query (with fallback); rows are read while they are written
+        source = None
         try:
             logging.info("Attempting to fetch data from primary external database...")
-            data_df = fetch_data_from_external_db(config)
+            source = fetch_data_from_external_db(config, plan)
         except SourceConnectionError as e:
             logging.warning(f"Failed to fetch from primary external database: {e}")
             fallback_enabled = config.getboolean('general', 'fallback_to_local_source_on_failure', fallback=False)
             if fallback_enabled:
                 logging.info("Attempting to use local SQLite database as fallback source...")
-                data_df = fetch_data_from_sqlite(config)
-                if data_df is None:
+                source = fetch_data_from_sqlite(config)
+                if source is None:
                     logging.error("Fallback from local SQLite also failed or provided no data.")
-                elif data_df.empty:
-                    logging.info("Fallback from local SQLite succeeded but returned no data.")
                 else:
                     logging.info("Successfully used local SQLite as fallback data source.")
+                    if plan is not None:
+                        # The fallback copy is reloaded as a whole and must not move the checkpoints
+                        logging.info("Incremental sync disabled for this run: the fallback source is loaded in full.")
+                        plans, plan = dict.fromkeys(chosen_targets), None
             else:
                 logging.warning("Fallback to local source is disabled in config.")
         
-        if data_df is None:
+        if source is None:
             logging.error("Failed to fetch data from any source. Halting process.")
             return
         
-        # Write data to chosen target
-        if data_df is not None: # This check includes empty DataFrame
-            if chosen_target == 'azure':
-                write_data_to_azure_mysql(data_df, config)
-            elif chosen_target == 'local_sqlite':
-                write_data_to_sqlite(data_df, config)
-            else:
-                logging.error(f"Invalid target specified or determined: {chosen_target}")
-                return # Exit if target is not recognized
+        # Write data to the chosen targets at the same time
+        merge_key = plan.merge_key if plan is not None and not plan.full else None
+        _, prefetch_chunks = sync_options(config)
+        try:
+            results = write_to_targets(source, chosen_targets,
+                                       lambda target, feed: TARGET_WRITERS[target](feed, config, merge_key),
+                                       prefetch_chunks)
+        finally:
+            source.close()
 
-            if data_df.empty:
-                logging.info("Source data was empty. Target table has been updated/created as empty.")
-            
-            logging.info("Database synchronization process completed successfully.")
+        failures = {target: result for target, result in results.items() if isinstance(result, Exception)}
+        for target, rows_written in results.items():
+            if target in failures:
+                logging.error(f"Synchronization of target '{target}' failed: {failures[target]}")
+                continue
+            if plans[target] is not None:
+                save_checkpoint(plans[target], source.max_watermark)
+            if rows_written == 0 and merge_key:
+                logging.info(f"No rows changed since the last checkpoint. Table of target '{target}' is unchanged.")
+            elif rows_written == 0:
+                logging.info(f"Source data was empty. Table of target '{target}' has been updated/created as empty.")
+        if failures:
+            raise next(iter(failures.values()))
+        
+        logging.info("Database synchronization process completed successfully.")
 
+    except StockSchemaError as e:
+        logging.error(f"Halting process: {e}")
     except FileNotFoundError:
         logging.error("Halting process due to missing configuration file.")
     except (configparser.NoSectionError, configparser.NoOptionError) as e:
@@ -1,19 +1,111 @@
 import os
+import re
+import sys
 import json
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Security, Query, Request, UploadFile, File
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import codecs
+import base64
+import hashlib
+import time
+import uuid
+import unicodedata
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple
+from fastapi import FastAPI, HTTPException, Security, Query, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
 from fastapi.security.api_key import APIKeyHeader
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text, Column, BigInteger, String, Float, DateTime
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import create_engine, event, inspect, text, select, bindparam, Table, MetaData, Column, BigInteger, Float, DateTime, Text
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from app.stock_schema import (VEHICLE_STOCK_SCHEMA, STOCK_DERIVED_COLUMNS, derive_stock_fields, derive_workflow_fields,
+                              stock_search_indexes, read_stock_version, ensure_stock_version_table, bump_stock_version)
 from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import asynccontextmanager, contextmanager
+import anyio
+import anyio.to_thread
 import pandas as pd
-import io
+import numpy as np
 
+try:
+    import orjson  # Optional: faster encoding of streamed /cars/ responses
+except ImportError:
+    orjson = None
+
+try:
+    import python_calamine  # noqa: F401  Optional: native XLSX/XLS parser for inventory uploads
+    calamine_installed = True
+except ImportError:
+    calamine_installed = False
+
+try:
+    import pyarrow  # noqa: F401  Parquet uploads and the multithreaded CSV parser
+    pyarrow_installed = True
+except ImportError:
+    pyarrow_installed = False
 
 load_dotenv(dotenv_path="../.env") # Adjusted path to .env
 
+# Logging: records go through a queue to a listener thread that writes them to stdout, so a
+# slow log sink never blocks the event loop
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # 'text' or 'json' (one JSON object per line)
+# Share of ordinary requests logged (0-1); payload pushes and 5xx responses are always logged
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.01"))
+REQUEST_LOG_PREVIEW_ROWS = int(os.getenv("REQUEST_LOG_PREVIEW_ROWS", "3"))  # Payload rows logged per push
+LOG_VALUE_MAX_CHARS = int(os.getenv("LOG_VALUE_MAX_CHARS", "500"))  # Cap of each logged preview value
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record plus its `fields` extra as text (key=value pairs) or as one JSON object."""
+
+    def __init__(self, json_lines: bool):
+        super().__init__("%(asctime)s %(levelname)s %(message)s")
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if self.json_lines:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage(), **fields}
+            return json.dumps(entry, default=str, ensure_ascii=False)
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={json.dumps(value, default=str, ensure_ascii=False)}"
+                                   for key, value in fields.items())
+        return line
+
+def setup_logging() -> logging.Logger:
+    """Sends the API's records through a QueueHandler to a QueueListener thread writing to stdout."""
+    api_logger = logging.getLogger("vehicle_search_api")
+    if not api_logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(StructuredFormatter(LOG_FORMAT == "json"))
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, handler)
+        api_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        api_logger.setLevel(LOG_LEVEL)
+        api_logger.propagate = False
+        listener.start()
+        atexit.register(listener.stop)
+    return api_logger
+
+logger = setup_logging()
+
+def log_preview(value: Any) -> str:
+    """Compact JSON of a value for a log line, cut to LOG_VALUE_MAX_CHARS."""
+    preview = json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":"))
+    return preview if len(preview) <= LOG_VALUE_MAX_CHARS else preview[:LOG_VALUE_MAX_CHARS] + "..."
+
+def payload_log_fields(row_count: int, columns: List[str], preview_rows: List[Any]) -> Dict[str, Any]:
+    """Metadata of a pushed payload for the request log: counts, column names and a few capped rows."""
+    return {"payload_rows": row_count, "payload_columns": log_preview(columns),
+            "payload_preview": [log_preview(row) for row in preview_rows[:REQUEST_LOG_PREVIEW_ROWS]]}
+
 API_KEY = os.getenv("API_KEY")
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
@@ -27,19 +119,29 @@ DB_SSL_MODE = os.getenv("DB_SSL_MODE", "require") # Default to require if not se
 DB_SSL_CA = os.getenv("DB_SSL_CA")
 DB_SSL_CERT = os.getenv("DB_SSL_CERT")
 DB_SSL_KEY = os.getenv("DB_SSL_KEY")
+# Connection pool: pre-ping and recycle drop connections the Azure gateway closed while idle
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds; -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+# Optional full SQLAlchemy URL overriding the DB_* settings (e.g. a local SQLite stand-in)
+DATABASE_URL_OVERRIDE = os.getenv("DATABASE_URL")
 
-if not all([DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME]):
+if not DATABASE_URL_OVERRIDE and not all([DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME]):
     raise RuntimeError("Database credentials are not fully configured in environment variables.")
 
 if not API_KEY:
     raise RuntimeError("API_KEY is not configured in environment variables.")
 
 # Construct the database URL
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DATABASE_URL = DATABASE_URL_OVERRIDE or f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # SSL arguments for SQLAlchemy
 connect_args = {}
-if DB_SSL_MODE and DB_SSL_MODE.lower() == "disabled":
+if DATABASE_URL_OVERRIDE:
+    pass  # SSL settings only apply to the Azure MySQL connection
+elif DB_SSL_MODE and DB_SSL_MODE.lower() == "disabled":
     connect_args['ssl_disabled'] = True
 else:  # Assumes SSL is required or preferred (e.g., "require")
     if DB_SSL_CA:
@@ -52,49 +154,351 @@ else:  # Assumes SSL is required or preferred (e.g., "require")
     # mysql-connector-python attempts SSL by default.
     # An empty connect_args here is fine for that default behavior.
 
+def sqlite_date_format(value, fmt):
+    """SQLite stand-in for MySQL DATE_FORMAT, for the %Y/%m/%d style formats used by the queries."""
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).strftime(fmt)
+    except ValueError:
+        return None
+
+class PoolMetrics:
+    """Connection pool counters, updated from pool events and InstrumentedQueuePool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.connections_invalidated = 0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def increment(self, counter: str):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.wait_count += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def attach(self, database_engine):
+        event.listen(database_engine, "connect", lambda *args: self.increment("connections_created"))
+        event.listen(database_engine, "close", lambda *args: self.increment("connections_closed"))
+        event.listen(database_engine, "invalidate", lambda *args: self.increment("connections_invalidated"))
+        event.listen(database_engine, "checkout", lambda *args: self.increment("checkouts"))
+
+    def stats(self, pool) -> Dict[str, Any]:
+        with self.lock:
+            stats = {
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "connections_invalidated": self.connections_invalidated,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "wait_count": self.wait_count,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.wait_count, 6) if self.wait_count else None,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        return stats
+
+pool_metrics = PoolMetrics()
+
+# Prometheus metrics of this worker process, served by GET /metrics in the text exposition format
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_ROWS_BUCKETS = (0, 1, 10, 25, 50, 100, 250, 500, 1000)
+METRICS_BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+METRICS_PAYLOAD_ROUTES = ('/stock/', '/stock/stream/', '/inventory/upload/')  # Routes whose body sizes are recorded
+
+def prometheus_label_value(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class PrometheusMetric:
+    """A counter, gauge or histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name: str, kind: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Optional[Tuple[float, ...]] = None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets or ()) + (float('inf'),) if kind == 'histogram' else ()
+        self.lock = threading.Lock()
+        # Label values -> value, or for histograms [count per bucket..., sum]
+        self.values: Dict[Tuple[str, ...], Any] = {}
+
+    def label_key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.label_key(labels)] = float(value)
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = sorted((key, list(value) if isinstance(value, list) else value)
+                            for key, value in self.values.items())
+        for key, value in values:
+            pairs = [f'{name}="{prometheus_label_value(label)}"' for name, label in zip(self.labelnames, key)]
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{{{','.join(pairs)}}} {prometheus_number(value)}" if pairs
+                             else f"{self.name} {prometheus_number(value)}")
+                continue
+            for bound, count in zip(self.buckets, value):
+                bucket_labels = ','.join(pairs + [f'le="{prometheus_number(bound)}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {count}")
+            suffix = f"{{{','.join(pairs)}}}" if pairs else ""
+            lines.append(f"{self.name}_sum{suffix} {prometheus_number(value[-1])}")
+            lines.append(f"{self.name}_count{suffix} {value[-2]}")
+        return lines
+
+class MetricsRegistry:
+    """The metrics GET /metrics exposes, in registration order."""
+
+    def __init__(self):
+        self.metrics: List[PrometheusMetric] = []
+
+    def register(self, *args, **kwargs) -> PrometheusMetric:
+        metric = PrometheusMetric(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+metrics_registry = MetricsRegistry()
+HTTP_REQUEST_DURATION = metrics_registry.register(
+    "http_request_duration_seconds", "histogram", "Time from receiving a request to sending its last byte.",
+    ("method", "route", "status"), METRICS_DURATION_BUCKETS)
+HTTP_PAYLOAD_BYTES = metrics_registry.register(
+    "http_payload_bytes", "histogram", "Body sizes of stock pushes and inventory uploads.",
+    ("route", "direction"), METRICS_BYTES_BUCKETS)
+CARS_PHASE_DURATION = metrics_registry.register(
+    "cars_phase_duration_seconds", "histogram",
+    "Time one /cars/ request spent executing and reading the query (db_execute), building the result "
+    "rows (row_processing) and validating and encoding the response (encoding).",
+    ("phase", "source"), METRICS_DURATION_BUCKETS)
+CARS_ROWS_RETURNED = metrics_registry.register(
+    "cars_rows_returned", "histogram", "Vehicles returned per /cars/ response.", ("source",), METRICS_ROWS_BUCKETS)
+INVENTORY_ROWS = metrics_registry.register(
+    "inventory_rows", "gauge", "Rows of the inventory held in memory.")
+INVENTORY_MEMORY_BYTES = metrics_registry.register(
+    "inventory_memory_bytes", "gauge", "Memory used by the inventory table and its typed search arrays.")
+
+class CarsPhaseTimer:
+    """Adds up the time one /cars/ request spends in each phase and records it once, with the row count."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.seconds: Dict[str, float] = {}
+        self.rows = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def record(self, rows: Optional[int] = None):
+        for name, seconds in self.seconds.items():
+            CARS_PHASE_DURATION.observe(seconds, phase=name, source=self.source)
+        if rows is not None:
+            CARS_ROWS_RETURNED.observe(rows, source=self.source)
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited (including connecting) and timeouts."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.increment("checkout_timeouts")
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+def create_database_engine(url: str, connect_args: Optional[Dict[str, Any]] = None, **pool_options):
+    """Creates the engine; SQLite engines get the MySQL functions the queries rely on.
+
+    With pool_options (pool_size, max_overflow, ...) the engine uses an InstrumentedQueuePool
+    reporting to pool_metrics.
+    """
+    if pool_options:
+        pool_options.setdefault("poolclass", InstrumentedQueuePool)
+    database_engine = create_engine(url, connect_args=connect_args or {}, **pool_options)
+    if pool_options:
+        pool_metrics.attach(database_engine)
+    if database_engine.dialect.name == 'sqlite':
+        @event.listens_for(database_engine, "connect")
+        def register_mysql_functions(dbapi_connection, connection_record):
+            dbapi_connection.create_function("DATE_FORMAT", 2, sqlite_date_format, deterministic=True)
+    return database_engine
+
 try:
-    engine = create_engine(DATABASE_URL, connect_args=connect_args)
+    engine = create_database_engine(
+        DATABASE_URL, connect_args=connect_args,
+        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING, pool_timeout=DB_POOL_TIMEOUT)
 except Exception as e:
-    # Log this error appropriately in a real application
-    print(f"Error creating database engine: {e}")
+    logger.error(f"Error creating database engine: {e}")
     # Depending on policy, you might want to exit or let FastAPI start and fail on request
     # For now, we'll let it proceed, and requests will fail if the engine is None or invalid
     engine = None
 
 
-app = FastAPI(title="Vehicle Search API", version="1.0.0")
+# The SQLAlchemy engine is synchronous: endpoints run their database work in this bounded
+# thread pool so queries never block the event loop and concurrent requests overlap.
+# Defaults to the connection pool capacity so threads do not queue on pool checkouts.
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+db_thread_limiter: Optional[anyio.CapacityLimiter] = None
+
+async def run_in_db_threadpool(func, *args):
+    """Runs a blocking database function in the DB_THREADPOOL_SIZE worker threads."""
+    global db_thread_limiter
+    if db_thread_limiter is None:
+        db_thread_limiter = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    return await anyio.to_thread.run_sync(func, *args, limiter=db_thread_limiter)
+
+def prepare_stock_database():
+    ensure_stock_derived_columns()
+    ensure_stock_version_table(engine)
+    if STOCK_ENSURE_INDEXES:
+        ensure_stock_search_indexes()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db_thread_limiter
+    db_thread_limiter = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    # Cache the vehicles_stock metadata once instead of reflecting it on every stock push
+    if engine is not None:
+        try:
+            await run_in_db_threadpool(prepare_stock_database)
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not load vehicles_stock metadata at startup, will retry on first use: {e}")
+        await reload_cars_replica()
+    # Serve the last uploaded inventory right away after a restart
+    try:
+        await sync_inventory_snapshot()
+    except Exception as e:
+        logger.warning(f"Could not load the inventory snapshot at startup: {e}")
+    yield
+
+app = FastAPI(title="Vehicle Search API", version="1.0.0", lifespan=lifespan)
 
 # Global variable to store inventory data in memory
 inventory_data: Optional[pd.DataFrame] = None
 inventory_upload_time: Optional[datetime] = None
+# Typed copies of the numeric/date columns filtered by /inventory/search/,
+# built once per upload so searches only combine boolean masks.
+inventory_arrays: Dict[str, np.ndarray] = {}
+# Trigram indexes over the text columns, so substring filters only touch matching rows
+inventory_text_index: Dict[str, "TextColumnIndex"] = {}
+# Facet value codes and whole-inventory counts, built once per upload
+inventory_facets: Optional["InventoryFacets"] = None
+# Bumped every time this process commits a stock update, to reload its /cars/ read replica
+# (stock changes from any process are tracked by the version row of the database, see stock_schema.py)
+stock_data_version = 0
+
+def mark_stock_changed():
+    global stock_data_version
+    stock_data_version += 1
+
+class RequestLogMiddleware:
+    """
+    Logs one structured line per request (method, path, status, duration, bytes in and out)
+    for a REQUEST_LOG_SAMPLE_RATE share of requests, plus every request whose endpoint stored
+    `log_fields` in request.state (stock and inventory pushes) or that failed with a 5xx.
+    Bodies are only counted while they stream through, never buffered or parsed.
+    Also records every request in the /metrics request-duration and payload-size histograms,
+    and the encoding phase of /cars/ responses whose endpoint stored `cars_encoding`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        sampled = random.random() < REQUEST_LOG_SAMPLE_RATE
+        counters = {"status": 500, "bytes_in": 0, "bytes_out": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counters["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                counters["status"] = message["status"]
+                # The endpoint returned at `started`; FastAPI has since validated and encoded the body
+                encoding = (scope.get("state") or {}).pop("cars_encoding", None)
+                if encoding is not None:
+                    source, started = encoding
+                    CARS_PHASE_DURATION.observe(time.perf_counter() - started, phase="encoding", source=source)
+            elif message["type"] == "http.response.body":
+                counters["bytes_out"] += len(message.get("body", b""))
+            await send(message)
 
-@app.middleware("http")
-async def log_request_body(request: Request, call_next):
-    if request.url.path == "/stock/" and request.method == "POST":
-        # Read the body, which consumes the stream
-        body = await request.body()
-        # Log the raw body for debugging, limited to 10 records
-        print("--- RAW STOCK PAYLOAD RECEIVED TO DEBUG (first 10 records) ---")
         try:
-            data = json.loads(body.decode())
-            if 'datos' in data and isinstance(data['datos'], list):
-                data['datos'] = data['datos'][:10]
-            print(json.dumps(data, indent=2)) # Pretty print
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            # If decoding or parsing fails, print the raw body
-            print(body.decode(errors='ignore'))
-        print("----------------------------------")
-
-        # The stream has been consumed, so we need to pass the body back
-        # to the actual endpoint by recreating the receive channel.
-        async def receive():
-            return {"type": "http.request", "body": body}
-        
-        # Create a new request object with the recreated receive channel
-        request = Request(request.scope, receive)
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            duration = time.perf_counter() - start
+            # Route templates (not raw paths) keep the label set bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.observe(duration, method=scope["method"], route=route, status=counters["status"])
+            if route in METRICS_PAYLOAD_ROUTES:
+                HTTP_PAYLOAD_BYTES.observe(counters["bytes_in"], route=route, direction="in")
+                HTTP_PAYLOAD_BYTES.observe(counters["bytes_out"], route=route, direction="out")
+            endpoint_fields = (scope.get("state") or {}).get("log_fields")
+            if sampled or endpoint_fields or counters["status"] >= 500:
+                fields = {"method": scope["method"], "path": scope["path"], "status": counters["status"],
+                          "duration_ms": round(duration * 1000, 2),
+                          "bytes_in": counters["bytes_in"], "bytes_out": counters["bytes_out"],
+                          **(endpoint_fields or {})}
+                logger.info("request", extra={"fields": fields})
 
-    response = await call_next(request)
-    return response
+app.add_middleware(RequestLogMiddleware)
 
 async def get_api_key(api_key_header: str = Security(api_key_header)):
     if api_key_header == API_KEY:
@@ -127,47 +531,138 @@ class StockPayload(BaseModel):
     campos: List[Any]  # Allow list of anything to handle complex input
     datos: List[List[Any]]
 
-@app.get("/cars/", response_model=List[Vehicle], dependencies=[Security(get_api_key)])
-async def search_cars(
-    make: Optional[str] = Query(None, alias="marca"),
-    model: Optional[str] = Query(None, alias="modelo"),
-    year: Optional[int] = Query(None, alias="year"), # Assuming year of fecha_matriculacion
-    color: Optional[str] = Query(None, alias="color"),
-    vin: Optional[str] = Query(None, alias="vin"),
-    min_kms: Optional[float] = Query(None, alias="min_kms"),
-    max_kms: Optional[float] = Query(None, alias="max_kms"),
-    min_price: Optional[float] = Query(None, alias="min_price"),
-    max_price: Optional[float] = Query(None, alias="max_price"),
-    transmission: Optional[str] = Query(None, alias="tipo_transmision"),
-    tienda: Optional[str] = Query(None),
-    vo_vn: Optional[str] = Query(None, description="Filter for new ('NEW') or used ('VO') vehicles"),
-    limit: int = Query(100, ge=1, le=1000) # Default limit for results, with validation
-):
-    if engine is None:
-        raise HTTPException(status_code=503, detail="Database service is unavailable.")
-
-    query_params = {}
-    conditions = []
+# Low-cardinality columns: substring filters on them are resolved against their distinct
+# values first and sent to MySQL as an IN list, which can use an index unlike LIKE '%x%'.
+CARS_LOOKUP_COLUMNS = ('marca', 'marca_inv', 'tipo_transmision')
+CARS_LOOKUP_MAX_VALUES = int(os.getenv("CARS_LOOKUP_MAX_VALUES", "1000"))  # Above this, keep using LIKE
+LIKE_WILDCARDS = ('%', '_')  # Search text with these keeps LIKE, where they are wildcards
 
-    base_query = """
-    SELECT ficha_id, modelo, descripcion, tipo_transmision, matricula, vin, 
+# modelo, marca, tienda and vo_vn come from the columns derived at ingest (STOCK_DERIVED_COLUMNS)
+CARS_SELECT = """
+    SELECT ficha_id, modelo_efectivo AS modelo, descripcion, tipo_transmision, matricula, vin, 
            DATE_FORMAT(fecha_matriculacion, '%Y-%m-%d') as fecha_matriculacion, 
-           kms, color, pvp_api, marca,
-           modelo_inv, marca_inv, workflow_estado
+           kms, color, pvp_api, marca_efectiva AS marca, tienda, vo_vn
     FROM vehicles_stock
     """
 
+def fold_search_text(value: str) -> str:
+    """Case- and accent-insensitive form of a value, matching MySQL's default *_ai_ci collation."""
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+class DistinctValueLookup:
+    """Caches the distinct values of the lookup columns, per engine and committed stock version."""
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[Any, int, Optional[List[Tuple[str, str]]]]] = {}
+
+    def values(self, connection, column: str, version: int) -> Optional[List[Tuple[str, str]]]:
+        """Returns (value, folded value) pairs, or None when the column has too many values."""
+        entry = self.entries.get(column)
+        if entry is not None and entry[0] is engine and entry[1] == version:
+            return entry[2]
+        rows = connection.execute(
+            text(f"SELECT DISTINCT {column} FROM vehicles_stock WHERE {column} IS NOT NULL LIMIT :cap"),
+            {"cap": CARS_LOOKUP_MAX_VALUES + 1}).scalars().all()
+        values = None
+        if len(rows) <= CARS_LOOKUP_MAX_VALUES:
+            values = [(str(value), fold_search_text(value)) for value in rows]
+        self.entries[column] = (engine, version, values)
+        return values
+
+    def matching(self, connection, column: str, needle: str, version: int) -> Optional[List[str]]:
+        """Distinct values of `column` containing `needle`, or None if the column is not enumerable."""
+        values = self.values(connection, column, version)
+        if values is None:
+            return None
+        folded_needle = fold_search_text(needle)
+        return [value for value, folded in values if folded_needle in folded]
+
+cars_value_lookup = DistinctValueLookup()
+
+def encode_cursor(key: Any) -> str:
+    """Encodes the sort key of the last returned row as an opaque pagination cursor."""
+    return base64.urlsafe_b64encode(json.dumps({"after": key}).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, key_type: type) -> Any:
+    """Decodes a cursor from encode_cursor(); malformed cursors are a 400."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        key = data["after"]
+        if not isinstance(key, (int, float)) or isinstance(key, bool):
+            raise ValueError(key)
+        return key_type(key)
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+
+def year_range(year: int) -> Optional[Tuple[datetime, Optional[datetime]]]:
+    """[start, end) of a registration year (end None for the last one), or None for years no date can have."""
+    if not datetime.min.year <= year <= datetime.max.year:
+        return None
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1) if year < datetime.max.year else None
+
+def build_cars_conditions(
+    connection,
+    make: Optional[str] = None,
+    model: Optional[str] = None,
+    year: Optional[int] = None,
+    color: Optional[str] = None,
+    vin: Optional[str] = None,
+    min_kms: Optional[float] = None,
+    max_kms: Optional[float] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    transmission: Optional[str] = None,
+    tienda: Optional[str] = None,
+    vo_vn: Optional[str] = None,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Builds the /cars/ WHERE conditions and their parameters.
+
+    Predicates are written so MySQL can use the STOCK_SEARCH_INDEXES: the year becomes a
+    fecha_matriculacion range, and substring filters on the lookup columns become IN lists
+    of the matching distinct values.
+    """
+    query_params: Dict[str, Any] = {}
+    conditions = []
+
+    def lookup_condition(name: str, columns: List[str], needle: str, sql_like: str):
+        # One IN list per column. LIKE when the search text has wildcards, when the stock version is
+        # unknown, when a column has too many distinct values, or when nothing matches (so a value
+        # committed after the lookup was read is still found)
+        matches = None
+        if not any(wildcard in needle for wildcard in LIKE_WILDCARDS):
+            version = read_stock_version(connection)
+            if version is not None:
+                matches = [cars_value_lookup.matching(connection, column, needle, version) for column in columns]
+        if matches is None or any(values is None for values in matches) or not any(matches):
+            conditions.append(sql_like)
+            query_params[name] = f"%{needle}%"
+            return
+        alternatives = []
+        for column, values in zip(columns, matches):
+            if values:
+                query_params[f"{name}_{column}"] = values
+                alternatives.append(f"{column} IN :{name}_{column}")
+        conditions.append("(" + " OR ".join(alternatives) + ")")
+
     if make:
         # Search for the make in 'marca' and 'marca_inv' fields
-        conditions.append("(marca LIKE :make OR marca_inv LIKE :make)")
-        query_params["make"] = f"%{make}%"
+        lookup_condition("make", ['marca', 'marca_inv'], make, "(marca LIKE :make OR marca_inv LIKE :make)")
     if model:
         # Search for the model in 'modelo', 'descripcion', and 'modelo_inv' fields
         conditions.append("(modelo LIKE :model OR descripcion LIKE :model OR modelo_inv LIKE :model)")
         query_params["model"] = f"%{model}%"
     if year:
-        conditions.append("YEAR(fecha_matriculacion) = :year")
-        query_params["year"] = year
+        bounds = year_range(year)
+        if bounds is None:
+            conditions.append("1 = 0")
+        else:
+            conditions.append("fecha_matriculacion >= :year_start")
+            query_params["year_start"] = bounds[0]
+            if bounds[1] is not None:
+                conditions.append("fecha_matriculacion < :year_end")
+                query_params["year_end"] = bounds[1]
     if color:
         conditions.append("color LIKE :color")
         query_params["color"] = f"%{color}%"
@@ -187,94 +682,577 @@ async def search_cars(
         conditions.append("pvp_api <= :max_price")
         query_params["max_price"] = max_price
     if transmission:
-        conditions.append("tipo_transmision LIKE :transmission")
-        query_params["transmission"] = f"%{transmission}%"
+        lookup_condition("transmission", ['tipo_transmision'], transmission, "tipo_transmision LIKE :transmission")
 
+    # Case-insensitive exact matches on the uppercase copies of the columns derived from workflow_estado
     if tienda:
-        conditions.append("workflow_estado LIKE :tienda")
-        query_params["tienda"] = f"%{tienda}%"
+        conditions.append("tienda_norm = :tienda")
+        query_params["tienda"] = tienda.strip().upper()
     if vo_vn:
-        conditions.append("workflow_estado LIKE :vo_vn")
-        query_params["vo_vn"] = f"%{vo_vn}%"
+        conditions.append("vo_vn_norm = :vo_vn")
+        query_params["vo_vn"] = vo_vn.strip().upper()
 
+    return conditions, query_params
+
+def build_cars_query(connection, limit: int = 100, after_ficha_id: Optional[int] = None,
+                     **filters) -> Tuple[str, Dict[str, Any]]:
+    """
+    Builds the /cars/ SQL and its parameters: one keyset page of the filtered stock in
+    ficha_id order, starting after `after_ficha_id`. Bind the result with bind_cars_query().
+    """
+    conditions, query_params = build_cars_conditions(connection, **filters)
+    if after_ficha_id is not None:
+        conditions.append("ficha_id > :after_ficha_id")
+        query_params["after_ficha_id"] = after_ficha_id
+
+    sql = CARS_SELECT
     if conditions:
-        base_query += " WHERE " + " AND ".join(conditions)
-    
-    base_query += " LIMIT :limit"
+        sql += " WHERE " + " AND ".join(conditions)
+
+    sql += " ORDER BY ficha_id LIMIT :limit"
     query_params["limit"] = limit
+    return sql, query_params
+
+def build_cars_count_query(connection, **filters) -> Tuple[str, Dict[str, Any]]:
+    """Builds the COUNT(*) of all the stock matching the /cars/ filters, across pages."""
+    conditions, query_params = build_cars_conditions(connection, **filters)
+    sql = "SELECT COUNT(*) FROM vehicles_stock"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql, query_params
+
+def bind_cars_query(sql: str, query_params: Dict[str, Any]):
+    """Wraps a build_cars_query() statement, expanding IN lists and typing the date bounds."""
+    binds = []
+    for name, value in query_params.items():
+        if isinstance(value, list):
+            binds.append(bindparam(name, expanding=True))
+        elif isinstance(value, datetime):
+            binds.append(bindparam(name, type_=DateTime()))
+    return text(sql).bindparams(*binds)
+
+# /cars/ result cache: exact across processes. Each request reads the stock version row, which
+# every stock push and sync bumps, and entries cached under an older version are dropped.
+# The TTL only bounds how long an entry is kept.
+CARS_CACHE_SIZE = int(os.getenv("CARS_CACHE_SIZE", "256"))  # 0 disables the cache
+CARS_CACHE_TTL_SECONDS = float(os.getenv("CARS_CACHE_TTL_SECONDS", "60"))
+
+class CarsResultCache:
+    """LRU + TTL cache of processed /cars/ result pages, tagged with the stock version they were read at."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self.version: Tuple[Any, int] = (None, -1)  # (engine, stock version) of the entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version: Optional[Tuple[Any, int]]) -> bool:
+        """Drops the entries when `version` is newer than theirs; returns whether it is the current one."""
+        if version is None:
+            return False  # Unknown version: nothing can be served or stored safely
+        if version[0] is not self.version[0] or version[1] > self.version[1]:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+        # A request that read the version before the latest change neither resets nor fills the cache
+        return version == self.version
+
+    def get(self, key: Tuple, version: Optional[Tuple[Any, int]]) -> Optional[Any]:
+        with self.lock:
+            if not self._check_version(version):
+                self.misses += 1
+                return None
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] >= self.ttl_seconds:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
 
+    def put(self, key: Tuple, version: Tuple[Any, int], page: Any):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            if not self._check_version(version):
+                return  # The stock changed while this result was being queried
+            self.entries[key] = (time.monotonic(), page)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "stock_data_version": self.version[1] if self.version[0] is not None else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+cars_result_cache = CarsResultCache(CARS_CACHE_SIZE, CARS_CACHE_TTL_SECONDS)
+
+def current_stock_version() -> Optional[Tuple[Any, int]]:
+    """(engine, committed stock version) for the /cars/ cache, or None if the version row cannot be read."""
     try:
         with engine.connect() as connection:
-            result = connection.execute(text(base_query), query_params)
-            cars_data = result.mappings().all() # Fetch all results as list of dict-like objects
-            
-            processed_cars_list = []
-            for row_mapping in cars_data:
-                row_dict = dict(row_mapping)
-                
-                # Fallback logic for modelo
-                modelo_inv = row_dict.get("modelo_inv")
-                if modelo_inv is not None and str(modelo_inv).strip() != "":
-                    row_dict["modelo"] = modelo_inv
-
-                # If 'modelo' is still null or empty, use 'descripcion' as a fallback.
-                # Based on documentation/vehicle_stock_schema.md, the column is 'descripcion'.
-                current_modelo = row_dict.get("modelo")
-                if not current_modelo or not str(current_modelo).strip():
-                    row_dict["modelo"] = row_dict.get("descripcion")
-
-                # Fallback logic for marca
-                marca_inv = row_dict.get("marca_inv")
-                if marca_inv is not None and str(marca_inv).strip() != "":
-                    row_dict["marca"] = marca_inv
-                
-                # Parse tienda and vo_vn from workflow_estado
-                workflow_estado = row_dict.get("workflow_estado")
-                if workflow_estado and isinstance(workflow_estado, str):
-                    parts = workflow_estado.split()
-                    # Expected format: "Stock <TIENDA> <VO_VN>"
-                    if len(parts) >= 3:
-                        row_dict["tienda"] = parts[1]
-                        row_dict["vo_vn"] = parts[2]
-                    elif len(parts) == 2:
-                        if parts[1].upper() in ['NEW', 'VO']:
-                            row_dict["vo_vn"] = parts[1]
-                        else:
-                            row_dict["tienda"] = parts[1]
-                
-                processed_cars_list.append(row_dict)
-            
-            return processed_cars_list
+            version = read_stock_version(connection)
+    except SQLAlchemyError as e:
+        logger.debug(f"Could not read the stock version, /cars/ results are not cached: {e}")
+        return None
+    return (engine, version) if version is not None else None
+
+def cars_cache_key(**filters) -> Tuple:
+    """Normalises the /cars/ filters so equivalent requests share a cache entry."""
+    key = []
+    for name, value in sorted(filters.items()):
+        if isinstance(value, str):
+            value = value.strip()
+            # Text filters match case- and accent-insensitively; the VIN is an exact match
+            value = (value if name == 'vin' else fold_search_text(value)) or None
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and name != 'limit':
+            value = float(value)
+        if name == 'year' and not value:
+            value = None
+        key.append((name, value))
+    return tuple(key)
+
+# Streamed /cars/ output: rows are encoded straight from the DB cursor, without building the
+# full list or validating each row against Vehicle (the SELECT already yields its fields)
+CARS_STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+CARS_STREAM_BATCH_SIZE = int(os.getenv("CARS_STREAM_BATCH_SIZE", "200"))  # Rows fetched per cursor read
+
+def dumps_json_bytes(value: Any) -> bytes:
+    """Encodes compact UTF-8 JSON with orjson when installed, else with the json module."""
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+def iter_cars_chunks(filters: Dict[str, Any], limit: int, after_ficha_id: Optional[int], output_format: str):
+    """
+    Yields one encoded /cars/ page in chunks of CARS_STREAM_BATCH_SIZE rows. The first chunk
+    (the array opening, or nothing for NDJSON) is yielded once the query has run, so
+    database errors surface before the response starts.
+    """
+    ensure_stock_derived_columns()
+    timer = CarsPhaseTimer("database")
+    try:
+        with engine.connect() as connection:
+            sql, query_params = build_cars_query(connection, limit=limit, after_ficha_id=after_ficha_id, **filters)
+            with timer.phase("db_execute"):
+                result = connection.execution_options(stream_results=True, yield_per=CARS_STREAM_BATCH_SIZE).execute(
+                    bind_cars_query(sql, query_params), query_params)
+            yield from encode_cars_chunks(result.mappings().partitions(CARS_STREAM_BATCH_SIZE), output_format, timer)
+    finally:
+        timer.record(timer.rows)
+
+def encode_cars_chunks(partitions, output_format: str, timer: Optional[CarsPhaseTimer] = None):
+    """
+    Encodes batches of /cars/ rows as the chunks of a JSON array or of NDJSON lines. A timer
+    gets the time spent reading each batch (db_execute) and encoding it, and the row count.
+    """
+    timer = timer or CarsPhaseTimer("unrecorded")
+    fields = list(Vehicle.model_fields)
+    as_array = output_format == 'json'
+    yield b'[' if as_array else b''
+    separator = b''
+    partitions = iter(partitions)
+    while True:
+        with timer.phase("db_execute"):
+            partition = next(partitions, None)
+        if partition is None:
+            break
+        with timer.phase("encoding"):
+            encoded = [dumps_json_bytes({field: row[field] for field in fields}) for row in partition]
+        timer.rows += len(encoded)
+        if as_array:
+            yield separator + b','.join(encoded)
+            separator = b','
+        else:
+            yield b'\n'.join(encoded) + b'\n'
+    if as_array:
+        yield b']'
+
+async def stream_cars_page(filters: Dict[str, Any], limit: int, after_ficha_id: Optional[int],
+                           include_total: bool, output_format: str) -> StreamingResponse:
+    """Streams one /cars/ page, reading the cursor in the DB thread pool."""
+    headers = {}
+
+    def start_chunks():
+        chunks = iter_cars_chunks(filters, limit, after_ficha_id, output_format)
+        try:
+            return chunks, next(chunks)
+        except BaseException:
+            chunks.close()
+            raise
+
+    try:
+        if include_total:
+            def count_cars() -> int:
+                with engine.connect() as connection:
+                    count_sql, count_params = build_cars_count_query(connection, **filters)
+                    return connection.execute(bind_cars_query(count_sql, count_params), count_params).scalar()
+            headers["X-Total-Count"] = str(await run_in_db_threadpool(retry_if_stock_derived_columns_lost, count_cars))
+        chunks, first_chunk = await run_in_db_threadpool(retry_if_stock_derived_columns_lost, start_chunks)
+    except SQLAlchemyError as e:
+        logger.error(f"Database query error: {e}")
+        raise HTTPException(status_code=500, detail=f"Database query error: {str(e)}")
+
+    async def body():
+        try:
+            yield first_chunk
+            while True:
+                chunk = await run_in_db_threadpool(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Also runs when the client disconnects, returning the connection to the pool
+            await run_in_db_threadpool(chunks.close)
+
+    return StreamingResponse(body(), media_type=CARS_STREAM_FORMATS[output_format], headers=headers)
+
+# Optional read replica: /cars/ is answered from an in-memory copy of vehicles_stock, reloaded
+# after each stock push in this process and at least every CARS_REPLICA_TTL_SECONDS for pushes
+# handled by other workers. MySQL stays the source of truth.
+CARS_READ_REPLICA = os.getenv("CARS_READ_REPLICA", "false").lower() == "true"
+CARS_REPLICA_TTL_SECONDS = float(os.getenv("CARS_REPLICA_TTL_SECONDS", "60"))
+# Columns only needed to evaluate the filters, besides the Vehicle fields
+CARS_REPLICA_FILTER_COLUMNS = ('marca', 'marca_inv', 'modelo', 'modelo_inv')
+# Text columns the replica indexes, with folded (case- and accent-insensitive) values like MySQL compares them
+CARS_REPLICA_TEXT_COLUMNS = ('marca', 'marca_inv', 'modelo', 'descripcion', 'modelo_inv', 'color',
+                             'tipo_transmision', 'vin', 'tienda', 'vo_vn')
+
+class CarsReplica:
+    """
+    The /cars/ columns of vehicles_stock in ficha_id order, filtered in memory with the
+    semantics of build_cars_conditions(): substring and equality filters through a
+    TextColumnIndex per text column, ranges on NumPy arrays.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], version: Tuple[Any, int]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.rows = [{
+            **{field: row[field] for field in Vehicle.model_fields
+               if field not in ('modelo', 'marca', 'fecha_matriculacion')},
+            'modelo': row['modelo_efectivo'],
+            'marca': row['marca_efectiva'],
+            'fecha_matriculacion': (row['fecha_matriculacion'].strftime('%Y-%m-%d')
+                                    if row['fecha_matriculacion'] is not None else None),
+        } for row in rows]
+        self.ficha_id = np.array([row['ficha_id'] for row in rows], dtype='float64')
+        self.kms = np.array([row['kms'] for row in rows], dtype='float64')
+        self.pvp_api = np.array([row['pvp_api'] for row in rows], dtype='float64')
+        self.fecha = np.array([row['fecha_matriculacion'] for row in rows], dtype='datetime64[us]')
+        self.text_index = {
+            column: TextColumnIndex(pd.Series(
+                [fold_search_text(row[column]) if row[column] is not None else None for row in rows], dtype=object))
+            for column in CARS_REPLICA_TEXT_COLUMNS}
+
+    def is_current(self) -> bool:
+        return (self.version == (engine, stock_data_version)
+                and time.monotonic() - self.loaded_at < CARS_REPLICA_TTL_SECONDS)
+
+    def _containing(self, columns: List[str], needle: str) -> np.ndarray:
+        # LIKE '%needle%' on any of the columns; the needle is matched literally
+        folded = fold_search_text(needle)
+        if any(ch in REGEX_SPECIAL_CHARS for ch in folded):
+            folded = re.escape(folded)
+        rows = [self.text_index[column].rows_containing(folded) for column in columns]
+        return rows[0] if len(rows) == 1 else np.union1d(rows[0], np.concatenate(rows[1:]))
+
+    def _equal(self, column: str, value: str) -> np.ndarray:
+        return self.text_index[column].rows_equal(fold_search_text(value))
+
+    def match(
+        self,
+        make: Optional[str] = None,
+        model: Optional[str] = None,
+        year: Optional[int] = None,
+        color: Optional[str] = None,
+        vin: Optional[str] = None,
+        min_kms: Optional[float] = None,
+        max_kms: Optional[float] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        transmission: Optional[str] = None,
+        tienda: Optional[str] = None,
+        vo_vn: Optional[str] = None,
+    ) -> np.ndarray:
+        """Ascending row positions matching the /cars/ filters."""
+        candidates = []
+        if make:
+            candidates.append(self._containing(['marca', 'marca_inv'], make))
+        if model:
+            candidates.append(self._containing(['modelo', 'descripcion', 'modelo_inv'], model))
+        if color:
+            candidates.append(self._containing(['color'], color))
+        if vin:
+            candidates.append(self._equal('vin', vin))
+        if transmission:
+            candidates.append(self._containing(['tipo_transmision'], transmission))
+        if tienda:
+            candidates.append(self._equal('tienda', tienda.strip()))
+        if vo_vn:
+            candidates.append(self._equal('vo_vn', vo_vn.strip()))
+        positions = np.arange(len(self.rows))
+        for rows in candidates:
+            positions = np.intersect1d(positions, rows, assume_unique=True)
+
+        # NULLs never satisfy a range, as in SQL (NaN/NaT comparisons are False)
+        mask = np.ones(len(positions), dtype=bool)
+        if year:
+            bounds = year_range(year)
+            if bounds is None:
+                mask[:] = False
+            else:
+                mask &= self.fecha[positions] >= np.datetime64(bounds[0])
+                if bounds[1] is not None:
+                    mask &= self.fecha[positions] < np.datetime64(bounds[1])
+        if min_kms is not None:
+            mask &= self.kms[positions] >= min_kms
+        if max_kms is not None:
+            mask &= self.kms[positions] <= max_kms
+        if min_price is not None:
+            mask &= self.pvp_api[positions] >= min_price
+        if max_price is not None:
+            mask &= self.pvp_api[positions] <= max_price
+        return positions[mask]
+
+    def page(self, filters: Dict[str, Any], limit: int, after_ficha_id: Optional[int],
+             include_total: bool) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+        """Same result as fetch_cars_page(): (vehicles, next page cursor, total matching count)."""
+        matched = self.match(**filters)
+        total_count = len(matched) if include_total else None
+        if after_ficha_id is not None:
+            matched = matched[self.ficha_id[matched] > after_ficha_id]
+        page = matched[:limit]
+        next_cursor = encode_cursor(self.rows[page[-1]]['ficha_id']) if len(matched) > limit else None
+        return [dict(self.rows[i]) for i in page], next_cursor, total_count
+
+cars_replica: Optional[CarsReplica] = None
+cars_replica_lock = threading.Lock()
+
+def refresh_cars_replica(force: bool = False) -> CarsReplica:
+    """Returns the current replica, reloading it from vehicles_stock when stale (or `force`)."""
+    global cars_replica
+    with cars_replica_lock:
+        if force or cars_replica is None or not cars_replica.is_current():
+            version = (engine, stock_data_version)
+            ensure_stock_derived_columns()
+            table = get_vehicles_stock_table()
+            columns = [column for column in Vehicle.model_fields if column not in ('modelo', 'marca')]
+            columns += ['modelo_efectivo', 'marca_efectiva', *CARS_REPLICA_FILTER_COLUMNS]
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select(*[table.c[column] for column in columns]).order_by(table.c.ficha_id)).mappings().all()
+            cars_replica = CarsReplica(rows, version)
+        return cars_replica
+
+async def reload_cars_replica():
+    """Loads the committed stock into the replica (at startup and after a push), if enabled."""
+    if not CARS_READ_REPLICA or engine is None:
+        return
+    try:
+        replica = await run_in_db_threadpool(retry_if_stock_derived_columns_lost, refresh_cars_replica, True)
+        logger.info(f"Loaded /cars/ read replica: {len(replica.rows)} vehicles")
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not load the /cars/ read replica, will retry on the next search: {e}")
+
+async def replica_cars_page(filters: Dict[str, Any], limit: int, after_ficha_id: Optional[int],
+                            include_total: bool) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+    replica = cars_replica
+    try:
+        if replica is None or not replica.is_current():
+            replica = await run_in_db_threadpool(retry_if_stock_derived_columns_lost, refresh_cars_replica)
+        return replica.page(filters, limit, after_ficha_id, include_total)
+    except SQLAlchemyError as e:
+        logger.error(f"Database query error: {e}")
+        raise HTTPException(status_code=500, detail=f"Database query error: {str(e)}")
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred: {e}")
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.get("/db/pool/", dependencies=[Security(get_api_key)])
+async def get_db_pool_stats():
+    """Returns the database connection pool state and counters of this worker process."""
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Database service is unavailable.")
+    return pool_metrics.stats(engine.pool)
+
+# Inventory last measured by update_inventory_metrics() and its size, so scrapes only measure new uploads
+inventory_metrics_source: Tuple[Any, int] = (None, 0)
+
+def update_inventory_metrics():
+    """Sets the inventory gauges from the inventory this process serves."""
+    global inventory_metrics_source
+    df = inventory_data
+    if df is None:
+        INVENTORY_ROWS.set(0)
+        INVENTORY_MEMORY_BYTES.set(0)
+        return
+    if inventory_metrics_source[0] is not df:
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        size += sum(array.nbytes for array in inventory_arrays.values())
+        inventory_metrics_source = (df, size)
+    INVENTORY_ROWS.set(len(df))
+    INVENTORY_MEMORY_BYTES.set(inventory_metrics_source[1])
+
+@app.get("/metrics", dependencies=[Security(get_api_key)])
+async def get_metrics():
+    """Returns the request, /cars/ phase, payload and inventory metrics of this worker process in the Prometheus text format."""
+    await anyio.to_thread.run_sync(update_inventory_metrics)
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cars/cache/", dependencies=[Security(get_api_key)])
+async def get_cars_cache_stats():
+    """Returns the /cars/ result cache statistics of this worker process."""
+    return cars_result_cache.stats()
+
+@app.get("/cars/", response_model=List[Vehicle], dependencies=[Security(get_api_key)])
+async def search_cars(
+    request: Request,
+    response: Response,
+    make: Optional[str] = Query(None, alias="marca"),
+    model: Optional[str] = Query(None, alias="modelo"),
+    year: Optional[int] = Query(None, alias="year"), # Assuming year of fecha_matriculacion
+    color: Optional[str] = Query(None, alias="color"),
+    vin: Optional[str] = Query(None, alias="vin"),
+    min_kms: Optional[float] = Query(None, alias="min_kms"),
+    max_kms: Optional[float] = Query(None, alias="max_kms"),
+    min_price: Optional[float] = Query(None, alias="min_price"),
+    max_price: Optional[float] = Query(None, alias="max_price"),
+    transmission: Optional[str] = Query(None, alias="tipo_transmision"),
+    tienda: Optional[str] = Query(None),
+    vo_vn: Optional[str] = Query(None, description="Filter for new ('NEW') or used ('VO') vehicles"),
+    limit: int = Query(100, ge=1, le=1000), # Default limit for results, with validation
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page, to fetch the next one"),
+    include_total: bool = Query(False, description="Also return the number of matching vehicles in X-Total-Count"),
+    output_format: Optional[str] = Query(None, alias="format", description="'ndjson' or 'json' streams the rows as they are read, uncached and without X-Next-Cursor")
+):
+    """
+    Searches the stock. Results are ordered by ficha_id and paginated by keyset: when more
+    vehicles match, the X-Next-Cursor header holds the cursor for the next page.
+    """
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Database service is unavailable.")
+    if output_format is not None and output_format not in CARS_STREAM_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(CARS_STREAM_FORMATS)}")
+
+    after_ficha_id = decode_cursor(cursor, int) if cursor else None
+    filters = dict(
+        make=make, model=model, year=year, color=color, vin=vin,
+        min_kms=min_kms, max_kms=max_kms, min_price=min_price, max_price=max_price,
+        transmission=transmission, tienda=tienda, vo_vn=vo_vn)
+    if CARS_READ_REPLICA:
+        timer = CarsPhaseTimer("replica")
+        with timer.phase("row_processing"):
+            processed_cars_list, next_cursor, total_count = await replica_cars_page(filters, limit, after_ficha_id, include_total)
+        if output_format is not None:
+            # Same output as stream_cars_page(): no X-Next-Cursor
+            headers = {"X-Total-Count": str(total_count)} if total_count is not None else {}
+            batches = [processed_cars_list[i:i + CARS_STREAM_BATCH_SIZE]
+                       for i in range(0, len(processed_cars_list), CARS_STREAM_BATCH_SIZE)]
+
+            def replica_chunks():
+                try:
+                    yield from encode_cars_chunks(batches, output_format, timer)
+                finally:
+                    timer.record(timer.rows)
+
+            return StreamingResponse(replica_chunks(), media_type=CARS_STREAM_FORMATS[output_format], headers=headers)
+        timer.record(len(processed_cars_list))
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        if total_count is not None:
+            response.headers["X-Total-Count"] = str(total_count)
+        request.state.cars_encoding = ("replica", time.perf_counter())
+        return processed_cars_list
+    if output_format is not None:
+        return await stream_cars_page(filters, limit, after_ficha_id, include_total, output_format)
+
+    cache_key = cars_cache_key(limit=limit, after_ficha_id=after_ficha_id, include_total=include_total, **filters)
+    # Read before the query, so a result is never cached under a version newer than its rows
+    cache_version = await run_in_db_threadpool(current_stock_version) if cars_result_cache.max_entries > 0 else None
+    page = cars_result_cache.get(cache_key, cache_version)
+    source = "cache"
+    if page is None:
+        page = await fetch_cars_page(filters, limit, after_ficha_id, include_total)
+        cars_result_cache.put(cache_key, cache_version, page)
+        source = "database"
+
+    processed_cars_list, next_cursor, total_count = page
+    if source == "cache":
+        CARS_ROWS_RETURNED.observe(len(processed_cars_list), source=source)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total_count is not None:
+        response.headers["X-Total-Count"] = str(total_count)
+    request.state.cars_encoding = (source, time.perf_counter())
+    return processed_cars_list
+
+async def fetch_cars_page(filters: Dict[str, Any], limit: int, after_ficha_id: Optional[int],
+                          include_total: bool) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+    """Queries one /cars/ page; returns (vehicles, next page cursor, total matching count)."""
+
+    def fetch_cars():
+        ensure_stock_derived_columns()
+        timer = CarsPhaseTimer("database")
+        with engine.connect() as connection:
+            # One extra row tells whether there is a next page
+            sql, query_params = build_cars_query(connection, limit=limit + 1, after_ficha_id=after_ficha_id, **filters)
+            with timer.phase("db_execute"):
+                result = connection.execute(bind_cars_query(sql, query_params), query_params)
+                cars_data = result.mappings().all() # Fetch all results as list of dict-like objects
+
+            next_cursor = None
+            if len(cars_data) > limit:
+                cars_data = cars_data[:limit]
+                next_cursor = encode_cursor(cars_data[-1]["ficha_id"])
+
+            total_count = None
+            if include_total:
+                count_sql, count_params = build_cars_count_query(connection, **filters)
+                with timer.phase("db_execute"):
+                    total_count = connection.execute(bind_cars_query(count_sql, count_params), count_params).scalar()
+
+            with timer.phase("row_processing"):
+                processed_cars_list = [dict(row_mapping) for row_mapping in cars_data]
+            timer.record(len(processed_cars_list))
+            return processed_cars_list, next_cursor, total_count
+
+    try:
+        return await run_in_db_threadpool(retry_if_stock_derived_columns_lost, fetch_cars)
             
     except SQLAlchemyError as e:
         # Log the error e
-        print(f"Database query error: {e}")
+        logger.error(f"Database query error: {e}")
         raise HTTPException(status_code=500, detail=f"Database query error: {str(e)}")
     except Exception as e:
         # Log the error e
-        print(f"An unexpected error occurred: {e}")
+        logger.exception(f"An unexpected error occurred: {e}")
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
-# Schema definition for type conversion
-VEHICLE_STOCK_SCHEMA = {
-    'ficha_id': BigInteger, 'workflow_nombre': String, 'workflow_id': BigInteger,
-    'workflow_estado': String, 'workflow_estado_id': BigInteger, 'workflow_subestado': String,
-    'workflow_subestado_id': BigInteger, 'modelo': String, 'origen_custom': String,
-    'descripcion': String, 'tipo_transmision': String, 'matricula': String, 'vin': String,
-    'fecha_matriculacion': DateTime, 'fecha_matriculacion_JAWA': DateTime,
-    'kms_vehiculo': Float, 'kms': Float, 'kms_manual': String, 'color': String,
-    'interior': String, 'color_interior': String, 'equipamiento': String,
-    'fiscalidad': Float, 'pvp': String, 'garantia': String, 'comercial': String,
-    'fecha_reserva': String, 'observaciones': String, 'color_registro': String,
-    'fiscalidad_GO': String, 'marca': String, 'color_api': String, 'interior_api': String,
-    'fiscalidad_api': Float, 'pvp_api': Float, 'precio_base_api': Float, 'origen': String,
-    'marca_inv': String, 'modelo_inv': String, 'version_inv': String,
-    'codigo_jato_inv': String, 'publicar_inv': String, 'fecha_publicado_inv': String,
-    'codigo_progresion': String, 'tipo_venta': String, 'clase_vehiculo': String,
-    'grossvalue': Float, 'ubicacion': String, 'fecha_factura_compra': String,
-    'vehicle_stock_id': String
-}
-
 def convert_value(value, target_type):
     """Converts a string value to a specified SQLAlchemy type, handling errors."""
     if value is None or value == '':
@@ -298,56 +1276,1163 @@ def convert_value(value, target_type):
     except (ValueError, TypeError):
         return None
 
+def stock_field_name(campo: Any) -> str:
+    """Extracts the column name from a `campos` entry (a plain name or a schema tuple/list)."""
+    if isinstance(campo, (list, tuple)) and campo:
+        return str(campo[0])
+    return str(campo)
+
+def convert_stock_row(row: List[Any], fields: List[str]) -> Dict[str, Any]:
+    """Converts one `datos` row into a record for the columns known to VEHICLE_STOCK_SCHEMA."""
+    record = {}
+    for i, field in enumerate(fields):
+        if field in VEHICLE_STOCK_SCHEMA:
+            target_type = VEHICLE_STOCK_SCHEMA[field]
+            raw_value = row[i] if i < len(row) else None
+            record[field] = convert_value(raw_value, target_type)
+    return record
+
+# Column-wise equivalents of convert_value. JSON numbers and repeated strings take
+# fast paths; anything unusual falls back to convert_value so the semantics are identical.
+
+def convert_integer_column(values: Tuple[Any, ...]) -> List[Any]:
+    cache = {}
+    result = []
+    append = result.append
+    for value in values:
+        kind = type(value)
+        if kind is int:
+            append(int(float(value)))
+        elif value is None:
+            append(None)
+        elif kind is str:
+            if value not in cache:
+                cache[value] = convert_value(value, BigInteger)
+            append(cache[value])
+        else:
+            append(convert_value(value, BigInteger))
+    return result
+
+def convert_float_column(values: Tuple[Any, ...]) -> List[Any]:
+    cache = {}
+    result = []
+    append = result.append
+    for value in values:
+        kind = type(value)
+        if kind is float:
+            append(value)
+        elif value is None:
+            append(None)
+        elif kind is int:
+            append(float(value))
+        elif kind is str:
+            if value not in cache:
+                cache[value] = convert_value(value, Float)
+            append(cache[value])
+        else:
+            append(convert_value(value, Float))
+    return result
+
+def convert_datetime_column(values: Tuple[Any, ...]) -> List[Any]:
+    # Parse each distinct string once, vectorised; strptime only sees what pandas rejects
+    distinct = list({value for value in values if type(value) is str and value != ''})
+    cache = {}
+    if distinct:
+        as_series = pd.Series(distinct, dtype=object)
+        parsed = pd.to_datetime(as_series, format="%Y-%m-%d %H:%M:%S", errors='coerce')
+        parsed = parsed.fillna(pd.to_datetime(as_series, format="%Y-%m-%d", errors='coerce'))
+        for value, timestamp in zip(distinct, parsed):
+            cache[value] = convert_value(value, DateTime) if pd.isna(timestamp) else timestamp.to_pydatetime()
+    return [cache[value] if type(value) is str and value in cache else convert_value(value, DateTime)
+            for value in values]
+
+def convert_string_column(values: Tuple[Any, ...]) -> List[Any]:
+    return [(value if value != '' else None) if type(value) is str else (None if value is None else str(value))
+            for value in values]
+
+STOCK_COLUMN_CONVERTERS = {
+    BigInteger: convert_integer_column,
+    Float: convert_float_column,
+    DateTime: convert_datetime_column,
+    Text: convert_string_column,
+}
+
+class StockColumnConverter:
+    """
+    Converts `datos` rows column by column instead of cell by cell.
+
+    Compiled once per `campos` list from VEHICLE_STOCK_SCHEMA: rows are transposed into
+    columns, each column is converted in bulk by the converter for its type, and the
+    result is zipped back into the same records convert_stock_row would produce.
+    """
+
+    def __init__(self, fields: List[str]):
+        self.width = len(fields)
+        # Later duplicates of a field win, as in convert_stock_row
+        positions = {field: i for i, field in enumerate(fields) if field in VEHICLE_STOCK_SCHEMA}
+        self.names = list(positions)
+        self.plan = [(positions[field], STOCK_COLUMN_CONVERTERS[VEHICLE_STOCK_SCHEMA[field]]) for field in self.names]
+
+    def convert(self, rows: List[List[Any]]) -> List[Dict[str, Any]]:
+        if not self.plan:
+            return [{} for _ in rows]
+        width = self.width
+        rows = [row if len(row) >= width else list(row) + [None] * (width - len(row)) for row in rows]
+        columns = list(zip(*rows))
+        converted = [converter(columns[i]) for i, converter in self.plan]
+        names = self.names
+        return [dict(zip(names, values)) for values in zip(*converted)]
+
+# Reflected vehicles_stock metadata, cached per engine (loaded at startup)
+stock_table_cache: Dict[Any, Table] = {}
+
+def get_vehicles_stock_table(refresh: bool = False) -> Table:
+    """Returns the vehicles_stock table metadata, reflecting it only once per engine."""
+    table = stock_table_cache.get(engine)
+    if table is None or refresh:
+        table = Table('vehicles_stock', MetaData(), autoload_with=engine)
+        stock_table_cache.clear()
+        stock_table_cache[engine] = table
+    return table
+
+# STOCK_SEARCH_INDEXES (app/stock_schema.py) are created at startup when missing
+STOCK_ENSURE_INDEXES = os.getenv("STOCK_ENSURE_INDEXES", "true").lower() == "true"
+
+def ensure_stock_search_indexes():
+    """Creates the STOCK_SEARCH_INDEXES missing from vehicles_stock."""
+    table = get_vehicles_stock_table()
+    existing = {index['name'] for index in inspect(engine).get_indexes('vehicles_stock')}
+    created = []
+    for index in stock_search_indexes(table):
+        if index.name in existing:
+            continue
+        # DDL commits implicitly on MySQL, so each index gets its own statement
+        with engine.begin() as connection:
+            index.create(connection)
+        created.append(index.name)
+    if created:
+        logger.info(f"Created vehicles_stock search indexes: {', '.join(created)}")
+        get_vehicles_stock_table(refresh=True)
+
+# Rows written per executemany call by the stock ingestion
+STOCK_INSERT_BATCH_SIZE = int(os.getenv("STOCK_INSERT_BATCH_SIZE", "500"))
+
+# Stock load modes: 'replace' deletes everything and re-inserts every row,
+# 'diff' inserts new, updates changed and deletes vanished rows keyed on ficha_id,
+# 'swap' bulk loads a staging table of its own and renames it over the live one.
+STOCK_LOAD_MODES = ('replace', 'diff', 'swap')
+STOCK_LOAD_MODE = os.getenv("STOCK_LOAD_MODE", "replace")  # Used when a push does not pass ?mode=
+STOCK_KEY_COLUMN = 'ficha_id'
+STOCK_HASH_COLUMN = 'row_hash'
+# Prefixes of the tables of a swap load; each load appends its own suffix so concurrent pushes do not collide
+STOCK_STAGING_TABLE = 'vehicles_stock_staging'
+STOCK_RETIRED_TABLE = 'vehicles_stock_old'
+# Upper bound of bound parameters per multi-row INSERT (SQLite builds may cap at 999)
+MULTI_ROW_INSERT_MAX_PARAMS = {'mysql': 60000, 'sqlite': 999}
+
+class StockDiffError(ValueError):
+    """Raised when a payload cannot be applied in diff mode (missing or repeated ficha_id)."""
+
+def ensure_stock_hash_column():
+    """Adds the row_hash column used by diff mode to vehicles_stock if it is missing."""
+    columns = {column['name'] for column in inspect(engine).get_columns('vehicles_stock')}
+    if STOCK_HASH_COLUMN not in columns:
+        # Run as its own statement: DDL would implicitly commit a MySQL transaction
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE vehicles_stock ADD COLUMN {STOCK_HASH_COLUMN} CHAR(32) NULL"))
+        logger.info(f"Added column '{STOCK_HASH_COLUMN}' to vehicles_stock for differential stock updates.")
+        get_vehicles_stock_table(refresh=True)
+
+def ensure_stock_derived_columns():
+    """Adds the STOCK_DERIVED_COLUMNS missing from vehicles_stock and backfills them."""
+    table = get_vehicles_stock_table()
+    if all(column in table.c for column in STOCK_DERIVED_COLUMNS):
+        return
+    # Another worker may have added them since the metadata was cached
+    table = get_vehicles_stock_table(refresh=True)
+    missing = [column for column in STOCK_DERIVED_COLUMNS if column not in table.c]
+    if not missing:
+        return
+    # DDL commits implicitly on MySQL, so the columns are added before the backfill transaction
+    for column in missing:
+        column_type = STOCK_DERIVED_COLUMNS[column].compile(dialect=engine.dialect)
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE vehicles_stock ADD COLUMN {column} {column_type} NULL"))
+    with engine.begin() as connection:
+        connection.execute(text("""
+            UPDATE vehicles_stock SET
+                marca_efectiva = CASE WHEN TRIM(COALESCE(marca_inv, '')) <> '' THEN marca_inv ELSE marca END,
+                modelo_efectivo = CASE WHEN TRIM(COALESCE(modelo_inv, '')) <> '' THEN modelo_inv
+                                       WHEN TRIM(COALESCE(modelo, '')) <> '' THEN modelo
+                                       ELSE descripcion END
+        """))
+        estados = connection.execute(text(
+            "SELECT DISTINCT workflow_estado FROM vehicles_stock WHERE workflow_estado IS NOT NULL")).scalars().all()
+        if estados:
+            connection.execute(
+                text("UPDATE vehicles_stock SET tienda = :tienda, vo_vn = :vo_vn, tienda_norm = :tienda_norm, "
+                     "vo_vn_norm = :vo_vn_norm WHERE workflow_estado = :workflow_estado"),
+                [{"workflow_estado": estado, **derive_workflow_fields(estado)} for estado in estados])
+    logger.info(f"Added and backfilled derived vehicles_stock columns: {', '.join(missing)}")
+    get_vehicles_stock_table(refresh=True)
+
+def restore_stock_derived_columns() -> bool:
+    """
+    Re-adds the STOCK_DERIVED_COLUMNS (and search indexes) when vehicles_stock was replaced by
+    a load that does not write them, which the cached metadata cannot tell. Returns whether
+    they were missing.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text(f"SELECT {', '.join(STOCK_DERIVED_COLUMNS)} FROM vehicles_stock WHERE 1 = 0"))
+        return False
+    except SQLAlchemyError:
+        pass
+    get_vehicles_stock_table(refresh=True)
+    prepare_stock_database()
+    return True
+
+def retry_if_stock_derived_columns_lost(func, *args):
+    """Runs a vehicles_stock read, once more if it failed because the derived columns had to be restored."""
+    try:
+        return func(*args)
+    except SQLAlchemyError:
+        if not restore_stock_derived_columns():
+            raise
+    return func(*args)
+
+def stock_row_hash(record: Dict[str, Any]) -> str:
+    """Content hash of a converted stock record, stable across pushes."""
+    content = json.dumps([record[field] for field in sorted(record)], default=str, ensure_ascii=False)
+    return hashlib.md5(content.encode('utf-8'), usedforsecurity=False).hexdigest()
+
+class StockLoader:
+    """
+    Applies converted stock records to vehicles_stock, batch by batch, on one connection
+    inside the caller's transaction.
+
+    In 'replace' mode the table is emptied and every record inserted. In 'diff' mode the
+    existing (ficha_id, row_hash) pairs are loaded first; records are then inserted, updated
+    or left untouched depending on their key and content hash, and rows whose ficha_id was
+    not pushed are deleted in finish(). In 'swap' mode records are bulk loaded into an empty
+    staging copy of the table with multi-row INSERTs and finish() renames it over the live
+    table, so /cars/ readers keep seeing the previous complete stock until the swap.
+
+    'swap' is not transactional on MySQL: CREATE TABLE, RENAME and DROP commit implicitly,
+    so a failed load is not rolled back there. Callers run discard() once the load is over,
+    which drops the staging table this load left behind.
+    """
+
+    def __init__(self, connection, table, mode: str = 'replace'):
+        self.connection = connection
+        self.table = table
+        self.mode = mode
+        # Every record carries all schema columns so both modes leave unpushed columns NULL
+        self.columns = [c.name for c in table.columns if c.name in VEHICLE_STOCK_SCHEMA]
+        self.derived = [c for c in STOCK_DERIVED_COLUMNS if c in table.columns]
+        self.has_hash = STOCK_HASH_COLUMN in table.columns
+        self.counts = {"records_added": 0, "records_updated": 0, "records_deleted": 0, "records_unchanged": 0}
+        self.existing: Dict[Any, Optional[str]] = {}
+        self.seen = set()
+        suffix = uuid.uuid4().hex[:12]
+        self.staging_name = f"{STOCK_STAGING_TABLE}_{suffix}"
+        self.retired_name = f"{STOCK_RETIRED_TABLE}_{suffix}"
+
+    def start(self):
+        if self.mode == 'replace':
+            self.connection.execute(text("DELETE FROM vehicles_stock"))
+            return
+        if self.mode == 'swap':
+            self._create_staging_table()
+            return
+        key = self.table.c[STOCK_KEY_COLUMN]
+        rows = self.connection.execute(select(key, self.table.c[STOCK_HASH_COLUMN])).all()
+        duplicated = set()
+        for ficha_id, row_hash in rows:
+            # Rows without a ficha_id can never match a pushed row; finish() deletes them all
+            if ficha_id in self.existing and ficha_id is not None:
+                duplicated.add(ficha_id)
+            self.existing[ficha_id] = row_hash
+        if duplicated:
+            # Repeated keys cannot be updated one-to-one; reload them as new rows
+            self._delete_keys(list(duplicated))
+            for ficha_id in duplicated:
+                del self.existing[ficha_id]
+
+    def _complete(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        full = dict.fromkeys(self.columns)
+        full.update((k, v) for k, v in record.items() if k in full)
+        if self.derived:
+            derived = derive_stock_fields(full)
+            full.update((column, derived[column]) for column in self.derived)
+        if self.has_hash:
+            full[STOCK_HASH_COLUMN] = stock_row_hash(full)
+        return full
+
+    def _delete_keys(self, keys: List[Any]) -> int:
+        """Deletes the rows with the given ficha_id values and returns how many were deleted."""
+        key = self.table.c[STOCK_KEY_COLUMN]
+        deleted = 0
+        if None in keys:
+            # IN (NULL) matches nothing, so keyless rows need their own predicate
+            deleted += self.connection.execute(self.table.delete().where(key.is_(None))).rowcount
+            keys = [k for k in keys if k is not None]
+        for start in range(0, len(keys), STOCK_INSERT_BATCH_SIZE):
+            deleted += self.connection.execute(
+                self.table.delete().where(key.in_(keys[start:start + STOCK_INSERT_BATCH_SIZE]))).rowcount
+        return deleted
+
+    def _create_staging_table(self):
+        connection = self.connection
+        if connection.dialect.name == 'mysql':
+            # Same columns, types and indexes as the live table
+            connection.execute(text(f"CREATE TABLE {self.staging_name} LIKE vehicles_stock"))
+        else:
+            # Index names are global in SQLite; indexes are recreated after the swap instead
+            Table(self.staging_name, MetaData(),
+                  *[Column(c.name, c.type) for c in self.table.columns]).create(connection)
+        self.staging = Table(self.staging_name, MetaData(),
+                             *[Column(c.name, c.type) for c in self.table.columns])
+
+    def _multi_row_insert(self, table: Table, records: List[Dict[str, Any]]):
+        max_params = MULTI_ROW_INSERT_MAX_PARAMS.get(self.connection.dialect.name, 999)
+        rows_per_statement = max(1, max_params // max(1, len(records[0])))
+        for start in range(0, len(records), rows_per_statement):
+            self.connection.execute(table.insert().values(records[start:start + rows_per_statement]))
+
+    def _swap_staging_table(self):
+        connection = self.connection
+        if connection.dialect.name == 'mysql':
+            # A multi-table RENAME switches both names at once: readers see either the old or the new stock
+            connection.execute(text(
+                f"RENAME TABLE vehicles_stock TO {self.retired_name}, {self.staging_name} TO vehicles_stock"))
+            connection.execute(text(f"DROP TABLE {self.retired_name}"))
+        else:
+            # SQLite DDL is transactional, so the renames become visible together at commit
+            connection.execute(text(f"ALTER TABLE vehicles_stock RENAME TO {self.retired_name}"))
+            connection.execute(text(f"ALTER TABLE {self.staging_name} RENAME TO vehicles_stock"))
+            connection.execute(text(f"DROP TABLE {self.retired_name}"))
+            for index in self.table.indexes:
+                index.create(connection)
+
+    def write(self, records: List[Dict[str, Any]]):
+        records = [self._complete(record) for record in records]
+        if self.mode == 'swap':
+            if records:
+                self._multi_row_insert(self.staging, records)
+            self.counts["records_added"] += len(records)
+            return
+        if self.mode == 'replace':
+            if records:
+                self.connection.execute(self.table.insert(), records)
+            self.counts["records_added"] += len(records)
+            return
+
+        inserts, updates = [], []
+        for record in records:
+            ficha_id = record[STOCK_KEY_COLUMN]
+            if ficha_id is None:
+                raise StockDiffError(f"Every row needs a '{STOCK_KEY_COLUMN}' in diff mode")
+            if ficha_id in self.seen:
+                raise StockDiffError(f"Duplicated {STOCK_KEY_COLUMN} {ficha_id} in payload; use mode=replace")
+            self.seen.add(ficha_id)
+            if ficha_id not in self.existing:
+                inserts.append(record)
+            elif self.existing[ficha_id] != record[STOCK_HASH_COLUMN]:
+                updates.append(dict(record, b_key=ficha_id))
+            else:
+                self.counts["records_unchanged"] += 1
+        if inserts:
+            self.connection.execute(self.table.insert(), inserts)
+        if updates:
+            statement = self.table.update().where(self.table.c[STOCK_KEY_COLUMN] == bindparam('b_key'))
+            self.connection.execute(statement, updates)
+        self.counts["records_added"] += len(inserts)
+        self.counts["records_updated"] += len(updates)
+
+    def finish(self) -> Dict[str, int]:
+        if self.mode == 'diff':
+            vanished = [ficha_id for ficha_id in self.existing if ficha_id not in self.seen]
+            self.counts["records_deleted"] = self._delete_keys(vanished)
+            return dict(self.counts)
+        if self.mode == 'swap':
+            self._swap_staging_table()
+        return {"records_added": self.counts["records_added"]}
+
+    def discard(self):
+        """Drops the tables a swap load left behind; after a successful swap there are none."""
+        if self.mode != 'swap':
+            return
+        try:
+            with self.connection.engine.begin() as connection:
+                for name in (self.staging_name, self.retired_name):
+                    connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not drop the staging tables of a failed stock swap: {e}")
+
+def stock_load_mode(mode: Optional[str]) -> str:
+    """Validates the load mode, defaulting to STOCK_LOAD_MODE."""
+    mode = mode or STOCK_LOAD_MODE
+    if mode not in STOCK_LOAD_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(STOCK_LOAD_MODES)}")
+    return mode
+
+def prepare_stock_load(mode: str) -> Table:
+    """Brings the stock table's columns up to date for `mode` and returns the table to load into."""
+    # One cheap probe per push: the table may have been replaced without the derived columns
+    restore_stock_derived_columns()
+    ensure_stock_derived_columns()
+    ensure_stock_version_table(engine)
+    if mode == 'diff':
+        ensure_stock_hash_column()
+    return get_vehicles_stock_table()
+
 @app.post("/stock/", status_code=200, dependencies=[Security(get_api_key)])
-async def update_stock(payload: StockPayload):
+async def update_stock(
+    request: Request,
+    payload: StockPayload,
+    mode: Optional[str] = Query(None, description="'replace' reloads the whole table, 'diff' only applies changes keyed on ficha_id, 'swap' loads a staging table and renames it over the live one (default: STOCK_LOAD_MODE)")
+):
+    # The body is already parsed: its metadata is logged with the request, not parsed again
+    request.state.log_fields = payload_log_fields(
+        len(payload.datos), [stock_field_name(c) for c in payload.campos], payload.datos[:REQUEST_LOG_PREVIEW_ROWS])
+
     if engine is None:
         raise HTTPException(status_code=503, detail="Database service is unavailable.")
 
     if not payload.datos:
         return {"message": "No data provided to update. Stock remains unchanged."}
 
-    processed_campos = [str(c) for c in payload.campos]
-    
-    list_of_dicts = []
-    for row in payload.datos:
-        record = {}
-        for i, field in enumerate(processed_campos):
-            if field in VEHICLE_STOCK_SCHEMA:
-                target_type = VEHICLE_STOCK_SCHEMA[field]
-                raw_value = row[i] if i < len(row) else None
-                record[field] = convert_value(raw_value, target_type)
-        list_of_dicts.append(record)
-
-    # Begin a transaction
-    with engine.begin() as connection:
+    def load_stock() -> Dict[str, int]:
+        processed_campos = [stock_field_name(c) for c in payload.campos]
+        
+        list_of_dicts = StockColumnConverter(processed_campos).convert(payload.datos)
+
+        load_mode = stock_load_mode(mode)
+        loader: Optional[StockLoader] = None
+
         try:
-            # 1. Delete all existing data from the table
-            connection.execute(text("DELETE FROM vehicles_stock"))
+            vehicles_stock_table = prepare_stock_load(load_mode)
 
-            # 2. Bulk insert the new data
-            if list_of_dicts:
-                # Get the table object from metadata (or define it)
-                from sqlalchemy import Table, MetaData
-                metadata = MetaData()
-                vehicles_stock_table = Table('vehicles_stock', metadata, autoload_with=engine)
-                
-                connection.execute(vehicles_stock_table.insert(), list_of_dicts)
+            # Begin a transaction
+            with engine.begin() as connection:
+                # 1. Delete (replace), load the current keys and hashes (diff) or create the staging table (swap)
+                loader = StockLoader(connection, vehicles_stock_table, load_mode)
+                loader.start()
 
-            return {"message": "Stock updated successfully", "records_added": len(list_of_dicts)}
+                # 2. Bulk write the new data
+                loader.write(list_of_dicts)
 
+                counts = loader.finish()
+                # 3. Let every worker's /cars/ cache know, in the same transaction
+                bump_stock_version(connection)
+                return counts
+
+        except StockDiffError as e:
+            raise HTTPException(status_code=422, detail=str(e))
         except SQLAlchemyError as e:
             # The 'with engine.begin()' context manager will automatically roll back the transaction on exception.
-            print(f"Database transaction error: {e}")
+            logger.error(f"Database transaction error: {e}")
             raise HTTPException(status_code=500, detail=f"Database transaction failed: {str(e)}")
         except Exception as e:
-            print(f"An unexpected error occurred during stock update: {e}")
+            logger.exception(f"An unexpected error occurred during stock update: {e}")
             raise HTTPException(status_code=500, detail=f"An unexpected error occurred during stock update: {str(e)}")
+        finally:
+            if loader is not None:
+                loader.discard()
+
+    counts = await run_in_db_threadpool(load_stock)
+    mark_stock_changed()
+    await reload_cars_replica()
+    return {"message": "Stock updated successfully", **counts}
+
+class StockPayloadError(ValueError):
+    """Raised when a streamed /stock/ body is not a valid {"campos": [...], "datos": [[...]]} object."""
+
+class StockPayloadStreamParser:
+    """
+    Incremental parser for the /stock/ JSON body.
+
+    Bytes are fed as they arrive from the socket. `campos` is emitted as soon as it is
+    complete and every `datos` row is emitted on its own, so only the unparsed tail of
+    the body is kept in memory. Other top-level keys are parsed and ignored.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._final = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Tuple[str, Any]]:
+        """Consumes a chunk and returns the ('campos', list) / ('row', list) events it completed."""
+        try:
+            self._buffer = self._buffer[self._pos:] + self._utf8.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise StockPayloadError(f"Request body is not valid UTF-8: {e}")
+        self._pos = 0
+        self._final = final
+        events = []
+        while self._step(events):
+            pass
+        if final and self._state != 'done':
+            raise StockPayloadError("Unexpected end of JSON body")
+        return events
+
+    def _skip_whitespace(self) -> bool:
+        """Advances past whitespace; returns False when the buffer is exhausted."""
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+            pos += 1
+        self._pos = pos
+        return pos < len(buffer)
+
+    def _expect(self, allowed: str) -> str:
+        char = self._buffer[self._pos]
+        if char not in allowed:
+            raise StockPayloadError(f"Expected one of {allowed!r}, got {char!r}")
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        """Decodes the next JSON value, or returns (False, None) if more bytes are needed."""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError as e:
+            if self._final:
+                raise StockPayloadError(f"Invalid JSON: {e.msg}")
+            return False, None
+        # A number at the very end of the buffer may still be missing digits
+        if end == len(self._buffer) and not self._final:
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _step(self, events: List[Tuple[str, Any]]) -> bool:
+        if not self._skip_whitespace():
+            return False
+        state = self._state
+        if state == 'start':
+            self._expect('{')
+            self._state = 'first_key'
+        elif state in ('first_key', 'key'):
+            if state == 'first_key' and self._buffer[self._pos] == '}':
+                self._pos += 1
+                self._state = 'done'
+                return True
+            complete, key = self._decode_value()
+            if not complete:
+                return False
+            if not isinstance(key, str):
+                raise StockPayloadError("Object keys must be strings")
+            self._key = key
+            self._state = 'colon'
+        elif state == 'colon':
+            self._expect(':')
+            self._state = 'datos_open' if self._key == 'datos' else 'value'
+        elif state == 'value':
+            complete, value = self._decode_value()
+            if not complete:
+                return False
+            if self._key == 'campos':
+                if not isinstance(value, list):
+                    raise StockPayloadError("'campos' must be a list")
+                events.append(('campos', value))
+            self._state = 'next_key'
+        elif state == 'next_key':
+            self._state = 'key' if self._expect(',}') == ',' else 'done'
+        elif state == 'datos_open':
+            self._expect('[')
+            self._state = 'datos_first'
+        elif state == 'datos_first':
+            if self._buffer[self._pos] == ']':
+                self._pos += 1
+                self._state = 'next_key'
+            else:
+                self._state = 'datos_row'
+        elif state == 'datos_row':
+            complete, row = self._decode_value()
+            if not complete:
+                return False
+            if not isinstance(row, list):
+                raise StockPayloadError("Every 'datos' entry must be a list")
+            events.append(('row', row))
+            self._state = 'datos_next'
+        elif state == 'datos_next':
+            self._state = 'datos_row' if self._expect(',]') == ',' else 'next_key'
+        else:  # done: only trailing whitespace is allowed
+            raise StockPayloadError("Unexpected data after the JSON body")
+        return True
+
+@app.post("/stock/stream/", status_code=200, dependencies=[Security(get_api_key)])
+async def update_stock_stream(
+    request: Request,
+    mode: Optional[str] = Query(None, description="'replace' reloads the whole table, 'diff' only applies changes keyed on ficha_id, 'swap' loads a staging table and renames it over the live one (default: STOCK_LOAD_MODE)")
+):
+    """
+    Streaming variant of POST /stock/ for large pushes, with the same body and response.
+    `campos` is parsed first and `datos` rows are converted and inserted in batches of
+    STOCK_INSERT_BATCH_SIZE as they arrive, inside a single transaction, so peak memory
+    does not grow with the number of rows.
+    """
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Database service is unavailable.")
+
+    mode = stock_load_mode(mode)
+    vehicles_stock_table: Optional[Table] = None
+    parser = StockPayloadStreamParser()
+    converter: Optional[StockColumnConverter] = None
+    batch: List[List[Any]] = []  # Raw rows, converted column-wise when flushed
+    campos: List[str] = []
+    row_count = 0
+    preview_rows: List[List[Any]] = []  # First rows, logged with the request
+    connection = None
+    transaction = None
+    loader: Optional[StockLoader] = None
+
+    def flush():
+        nonlocal vehicles_stock_table, connection, transaction, loader
+        if not batch:
+            return
+        if connection is None:
+            # The stock (and its schema) is only touched once there is at least one row to load
+            vehicles_stock_table = prepare_stock_load(mode)
+            connection = engine.connect()
+            transaction = connection.begin()
+            loader = StockLoader(connection, vehicles_stock_table, mode)
+            loader.start()
+        loader.write(converter.convert(batch))
+        batch.clear()
+
+    def handle(events: List[Tuple[str, Any]]):
+        nonlocal converter, campos, row_count
+        for kind, value in events:
+            if kind == 'campos':
+                campos = [stock_field_name(c) for c in value]
+                converter = StockColumnConverter(campos)
+            else:
+                batch.append(value)
+                row_count += 1
+                if len(preview_rows) < REQUEST_LOG_PREVIEW_ROWS:
+                    preview_rows.append(value)
+
+    def finish() -> Dict[str, int]:
+        counts = loader.finish()
+        bump_stock_version(connection)
+        transaction.commit()
+        return counts
+
+    def close():
+        if transaction.is_active:
+            transaction.rollback()
+        connection.close()
+        if loader is not None:
+            loader.discard()
+
+    try:
+        async for chunk in request.stream():
+            handle(parser.feed(chunk))
+            # Rows received before 'campos' stay buffered until it arrives
+            if converter is not None and len(batch) >= STOCK_INSERT_BATCH_SIZE:
+                await run_in_db_threadpool(flush)
+        handle(parser.feed(b'', final=True))
+        if converter is None:
+            raise StockPayloadError("'campos' is missing from the request body")
+        await run_in_db_threadpool(flush)
+        if connection is None:
+            return {"message": "No data provided to update. Stock remains unchanged."}
+        counts = await run_in_db_threadpool(finish)
+        mark_stock_changed()
+        await reload_cars_replica()
+        return {"message": "Stock updated successfully", **counts}
+
+    except StockPayloadError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed stock payload: {str(e)}")
+    except StockDiffError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except SQLAlchemyError as e:
+        logger.error(f"Database transaction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Database transaction failed: {str(e)}")
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred during stock update: {e}")
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred during stock update: {str(e)}")
+    finally:
+        request.state.log_fields = payload_log_fields(row_count, campos, preview_rows)
+        if connection is not None:
+            await run_in_db_threadpool(close)
+
+# Inventory columns normalised to typed arrays at upload time
+INVENTORY_NUMERIC_COLUMNS = ['Kms']
+INVENTORY_DECIMAL_COMMA_COLUMNS = ['Precio', 'Precio financiado']
+INVENTORY_DATE_COLUMN = 'Fecha de Matriculación'
+# Keyset pagination key of /inventory/search/; rows are stored in this order
+INVENTORY_KEY_COLUMN = 'Adid'
+
+def inventory_keys(df: pd.DataFrame) -> Optional[pd.Series]:
+    """Numeric Adid values, or None when they cannot serve as a unique sort key."""
+    if INVENTORY_KEY_COLUMN not in df.columns:
+        return None
+    keys = pd.to_numeric(df[INVENTORY_KEY_COLUMN], errors='coerce')
+    if keys.isna().any() or not keys.is_unique:
+        return None
+    return keys
+
+def sort_inventory_by_key(df: pd.DataFrame) -> pd.DataFrame:
+    """Orders the rows by Adid, so row positions follow the pagination key."""
+    keys = inventory_keys(df)
+    if keys is None or keys.is_monotonic_increasing:
+        return df
+    return df.iloc[np.argsort(keys.to_numpy(), kind='stable')].reset_index(drop=True)
+
+def build_inventory_arrays(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Converts the filterable inventory columns once into float64/datetime64 NumPy arrays."""
+    arrays = {}
+    keys = inventory_keys(df)
+    # Without a usable Adid, cursors fall back to row positions within the current upload
+    arrays[INVENTORY_KEY_COLUMN] = (keys.to_numpy(dtype='float64') if keys is not None
+                                    else np.arange(len(df), dtype='float64'))
+    for column in INVENTORY_NUMERIC_COLUMNS:
+        if column in df.columns:
+            arrays[column] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    for column in INVENTORY_DECIMAL_COMMA_COLUMNS:
+        if column in df.columns:
+            # Prices come as strings with a comma as decimal separator (e.g. "20700,00")
+            numeric = pd.to_numeric(df[column].astype(str).str.replace(',', '.'), errors='coerce')
+            arrays[column] = numeric.to_numpy(dtype='float64', na_value=np.nan)
+    if INVENTORY_DATE_COLUMN in df.columns:
+        fecha_col = pd.to_datetime(df[INVENTORY_DATE_COLUMN], format='%m/%Y', errors='coerce')
+        # If that fails, try other common formats
+        if fecha_col.isna().all():
+            fecha_col = pd.to_datetime(df[INVENTORY_DATE_COLUMN], errors='coerce')
+        arrays[INVENTORY_DATE_COLUMN] = fecha_col.to_numpy(dtype='datetime64[ns]')
+    return arrays
+
+def parse_inventory_date_bound(value: str, end_of_period: bool) -> Optional[np.datetime64]:
+    """Parses a MM/YYYY or YYYY search bound. Returns None for invalid formats."""
+    try:
+        if '/' in value:
+            bound = pd.to_datetime(value, format='%m/%Y')
+        elif end_of_period:
+            bound = pd.to_datetime(f"31/12/{value}", format='%d/%m/%Y')
+        else:
+            bound = pd.to_datetime(f"01/01/{value}", format='%d/%m/%Y')
+        return np.datetime64(bound.to_datetime64(), 'ns')
+    except (ValueError, TypeError):
+        return None
+
+# Text columns searched with case-insensitive substring filters (plus Tienda, matched exactly)
+INVENTORY_TEXT_COLUMNS = [
+    'Marca', 'Versión', 'Matrícula', 'Carroceria', 'Combustible',
+    'Color', 'Cambio', 'Tipo', 'Estado', 'Tienda'
+]
+NGRAM_SIZE = 3
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+
+class TextColumnIndex:
+    """
+    Inverted trigram index over the distinct values of one text column.
+
+    Rows are grouped by distinct value, so a substring query only verifies the
+    distinct values sharing all of the query's trigrams and returns the row
+    positions of the ones that really contain it.
+    """
+
+    def __init__(self, series: pd.Series):
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        self.values = list(uniques)
+        # Non-string cells never match, the same as str.contains(na=False)
+        self.lowered = [v.lower() if isinstance(v, str) else None for v in self.values]
+        self.text_ids = [i for i, v in enumerate(self.lowered) if v is not None]
+
+        # Row positions of every distinct value, in ascending order
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.values))
+        offsets = np.concatenate(([0], np.cumsum(counts))) + int((codes < 0).sum())
+        self.rows_by_value = [order[offsets[i]:offsets[i + 1]] for i in range(len(self.values))]
+
+        self.ids_by_lowered: Dict[str, List[int]] = {}
+        self.ngrams: Dict[str, set] = {}
+        for value_id in self.text_ids:
+            lowered = self.lowered[value_id]
+            self.ids_by_lowered.setdefault(lowered, []).append(value_id)
+            for start in range(len(lowered) - NGRAM_SIZE + 1):
+                self.ngrams.setdefault(lowered[start:start + NGRAM_SIZE], set()).add(value_id)
+
+    def _rows(self, value_ids: List[int]) -> np.ndarray:
+        if not value_ids:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate([self.rows_by_value[i] for i in value_ids]))
+
+    def rows_containing(self, needle: str) -> np.ndarray:
+        """Row positions whose value contains `needle`, case-insensitively (str.contains semantics)."""
+        if any(ch in REGEX_SPECIAL_CHARS for ch in needle):
+            # str.contains treats the filter as a regular expression; keep that behaviour
+            pattern = re.compile(needle, re.IGNORECASE)
+            return self._rows([i for i in self.text_ids if pattern.search(self.values[i])])
+
+        needle = needle.lower()
+        if len(needle) < NGRAM_SIZE:
+            candidates = self.text_ids
+        else:
+            postings = [self.ngrams.get(needle[start:start + NGRAM_SIZE], set())
+                        for start in range(len(needle) - NGRAM_SIZE + 1)]
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        # Verify pass: shared trigrams do not guarantee a contiguous match
+        return self._rows([i for i in candidates if needle in self.lowered[i]])
+
+    def rows_equal(self, value: str) -> np.ndarray:
+        """Row positions whose value equals `value`, case-insensitively."""
+        return self._rows(self.ids_by_lowered.get(value.lower(), []))
+
+def build_inventory_text_index(df: pd.DataFrame) -> Dict[str, TextColumnIndex]:
+    """Builds one TextColumnIndex per searchable text column present in the upload."""
+    return {column: TextColumnIndex(df[column]) for column in INVENTORY_TEXT_COLUMNS if column in df.columns}
+
+# Columns counted by /inventory/facets/, and bucket widths of the numeric histograms
+INVENTORY_FACET_COLUMNS = ['Marca', 'Modelo', 'Combustible', 'Cambio', 'Tienda', 'Estado']
+INVENTORY_HISTOGRAM_STEPS = {'Precio': 5000.0, 'Kms': 25000.0}
+INVENTORY_HISTOGRAM_MAX_BUCKETS = 100  # Values beyond fall into an open-ended last bucket
+
+def json_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+class InventoryFacets:
+    """
+    Facet codes of one upload: every row's value code per facet column and bucket per
+    histogram, so the counts of any set of rows take one bincount per facet.
+    """
+
+    def __init__(self, df: pd.DataFrame, arrays: Dict[str, np.ndarray]):
+        self.codes: Dict[str, np.ndarray] = {}
+        self.values: Dict[str, list] = {}
+        for column in INVENTORY_FACET_COLUMNS:
+            if column in df.columns:
+                codes, uniques = pd.factorize(df[column], use_na_sentinel=True)
+                self.codes[column] = codes
+                self.values[column] = [json_scalar(value) for value in uniques]
+
+        self.bucket_edges: Dict[str, List[Tuple[float, Optional[float]]]] = {}
+        for column, step in INVENTORY_HISTOGRAM_STEPS.items():
+            if column not in arrays:
+                continue
+            values = arrays[column]
+            finite = np.isfinite(values)
+            codes = np.full(len(values), -1, dtype=np.intp)
+            if finite.any():
+                first = np.floor(values[finite].min() / step)
+                codes[finite] = np.minimum(np.floor(values[finite] / step) - first,
+                                           INVENTORY_HISTOGRAM_MAX_BUCKETS - 1).astype(np.intp)
+            buckets = int(codes.max()) + 1 if len(codes) else 0
+            self.codes[column] = codes
+            self.bucket_edges[column] = [
+                ((first + i) * step, (first + i + 1) * step if i < INVENTORY_HISTOGRAM_MAX_BUCKETS - 1 else None)
+                for i in range(buckets)]
+
+        # Whole-inventory counts, served by /inventory/info/ and the upload response
+        self.totals = self.counts(None)
+
+    def _bincount(self, column: str, positions: Optional[np.ndarray]) -> np.ndarray:
+        codes = self.codes[column] if positions is None else self.codes[column][positions]
+        size = len(self.values[column]) if column in self.values else len(self.bucket_edges[column])
+        return np.bincount(codes[codes >= 0], minlength=size)
+
+    def counts(self, positions: Optional[np.ndarray]) -> Dict[str, Dict[str, Any]]:
+        """Value counts (largest first, zeros omitted) and histograms of the rows at `positions` (None: all)."""
+        facets = {}
+        for column, values in self.values.items():
+            counts = self._bincount(column, positions)
+            order = np.argsort(-counts, kind='stable')
+            facets[column] = {values[i]: int(counts[i]) for i in order if counts[i]}
+        histograms = {}
+        for column, edges in self.bucket_edges.items():
+            counts = self._bincount(column, positions)
+            histograms[column] = [{"from": low, "to": high, "count": int(count)}
+                                  for (low, high), count in zip(edges, counts)]
+        return {"facets": facets, "histograms": histograms}
+
+    def top_values(self, column: str, n: int) -> Dict[Any, int]:
+        return dict(list(self.totals["facets"].get(column, {}).items())[:n])
+
+# Spreadsheet parser: openpyxl (xlrd for .xls) by default. 'calamine' needs python-calamine and is
+# several times faster, but it trims the surrounding whitespace of text cells, so searches and
+# exports can differ from openpyxl's: opt in once that is acceptable for the inventory files
+INVENTORY_EXCEL_ENGINE = os.getenv("INVENTORY_EXCEL_ENGINE", "openpyxl").lower()
+INVENTORY_CSV_DELIMITERS = (';', ',', '\t', '|')
+
+def sniff_csv_delimiter(header_line: bytes) -> str:
+    """Picks the most frequent candidate delimiter of the header row (';' in Spanish exports)."""
+    counts = {delimiter: header_line.count(delimiter.encode()) for delimiter in INVENTORY_CSV_DELIMITERS}
+    delimiter = max(counts, key=counts.get)
+    return delimiter if counts[delimiter] else ','
+
+def read_excel_inventory(source, filename: str) -> pd.DataFrame:
+    engine = INVENTORY_EXCEL_ENGINE
+    if engine == 'openpyxl' and filename.endswith('.xls'):
+        engine = 'xlrd'  # openpyxl only reads .xlsx
+    return pd.read_excel(source, engine=engine)
+
+# Text cells an export writes for cells Excel stores as numbers or dates, see align_with_excel_types()
+EXCEL_INTEGER_TEXT = r'-?(?:0|[1-9][0-9]*)'
+EXCEL_FLOAT_TEXT = r'-?(?:0|[1-9][0-9]*)\.[0-9]+'
+EXCEL_DATETIME_TEXT = r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}'
+
+def align_with_excel_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Gives a CSV or Parquet inventory the cell types read_excel() gives the same sheet, so every
+    format searches alike. A text column can hold cells Excel stores as numbers or dates (a Modelo
+    of 2008, a Versión of 1.5), which an export writes out as text: those cells become numbers and
+    datetimes again, and the column is re-inferred. Datetime columns get read_excel's unit.
+    """
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            if values.dtype != 'datetime64[us]':
+                df[column] = values.astype('datetime64[us]')
+            continue
+        if not (values.dtype == object or pd.api.types.is_string_dtype(values.dtype)):
+            continue
+        integers = values.str.fullmatch(EXCEL_INTEGER_TEXT, na=False)
+        floats = values.str.fullmatch(EXCEL_FLOAT_TEXT, na=False)
+        datetimes = values.str.fullmatch(EXCEL_DATETIME_TEXT, na=False)
+        if not (integers.any() or floats.any() or datetimes.any()):
+            continue
+        cells = values.astype(object).where(values.notna(), np.nan)
+        cells[integers] = [int(value) for value in values[integers]]
+        cells[floats] = [float(value) for value in values[floats]]
+        cells[datetimes] = [datetime.strptime(value, '%Y-%m-%d %H:%M:%S') for value in values[datetimes]]
+        df[column] = cells.infer_objects()
+    return df
+
+def read_csv_inventory(source, filename: str) -> pd.DataFrame:
+    delimiter = sniff_csv_delimiter(source.readline())
+    source.seek(0)
+    # pyarrow's multithreaded CSV parser when available; its type inference differs from the C
+    # parser's (e.g. it parses timestamps), and align_with_excel_types() evens both out
+    df = pd.read_csv(source, sep=delimiter, encoding='utf-8-sig', engine='pyarrow' if pyarrow_installed else 'c')
+    return align_with_excel_types(df)
+
+def read_parquet_inventory(source, filename: str) -> pd.DataFrame:
+    return align_with_excel_types(pd.read_parquet(source))
+
+# Accepted upload extensions and their readers; every format must carry the Excel column layout
+INVENTORY_READERS = {
+    '.xlsx': read_excel_inventory,
+    '.xls': read_excel_inventory,
+    '.csv': read_csv_inventory,
+    '.parquet': read_parquet_inventory,
+}
+
+def inventory_reader(filename: str):
+    """Returns the reader for the upload's extension, or None when the format is not supported."""
+    return INVENTORY_READERS.get(os.path.splitext(filename.lower())[1])
+
+def read_inventory_file(source, filename: str) -> pd.DataFrame:
+    """Parses an inventory upload from its (spooled) file object without copying it into memory first."""
+    source.seek(0)
+    return inventory_reader(filename)(source, filename.lower())
+
+# Directory shared by all uvicorn workers (e.g. under /home on App Service) where every upload is
+# kept as a versioned Arrow IPC file; empty keeps the inventory private to the uploading process
+INVENTORY_SNAPSHOT_DIR = os.getenv("INVENTORY_SNAPSHOT_DIR", "")
+INVENTORY_SNAPSHOT_POINTER = "CURRENT"  # Holds the file name of the published snapshot
+INVENTORY_SNAPSHOTS_KEPT = 2  # The previous one may still be read by workers that have not switched yet
+
+if INVENTORY_SNAPSHOT_DIR and not pyarrow_installed:
+    raise RuntimeError("INVENTORY_SNAPSHOT_DIR requires pyarrow to be installed.")
+
+# File name of the snapshot this process has loaded, and the lock serialising snapshot loads
+inventory_snapshot_version: Optional[str] = None
+inventory_snapshot_lock = threading.Lock()
+
+def publish_inventory(df: pd.DataFrame, upload_time: datetime, snapshot_version: Optional[str] = None):
+    """Builds the search structures of a sorted inventory and makes it the one served by this process."""
+    global inventory_data, inventory_upload_time, inventory_arrays, inventory_text_index, inventory_facets
+    global inventory_snapshot_version
+    arrays = build_inventory_arrays(df)
+    text_index = build_inventory_text_index(df)
+    facets = InventoryFacets(df, arrays)
+    inventory_data = df
+    inventory_arrays = arrays
+    inventory_text_index = text_index
+    inventory_facets = facets
+    inventory_upload_time = upload_time
+    inventory_snapshot_version = snapshot_version
+
+def arrow_compatible_inventory(df: pd.DataFrame) -> pd.DataFrame:
+    """Stores the cells of columns mixing text with numbers or dates (e.g. Modelo "2008") as text."""
+    mixed = [column for column in df.columns if df[column].dtype == object
+             and not df[column].dropna().map(lambda value: isinstance(value, str)).all()]
+    if not mixed:
+        return df
+    df = df.copy()
+    for column in mixed:
+        df[column] = df[column].map(lambda value: value if pd.isna(value) or isinstance(value, str) else str(value))
+    return df
+
+def replace_file_atomically(path: str, write):
+    """Writes through `write(file)` to a temporary file and renames it over `path` in one step."""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def write_inventory_snapshot(df: pd.DataFrame, upload_time: datetime) -> str:
+    """Saves the inventory as a new Arrow IPC snapshot, points CURRENT at it and returns its file name."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'upload_time': upload_time.isoformat().encode()})
+    os.makedirs(INVENTORY_SNAPSHOT_DIR, exist_ok=True)
+    version = f"inventory-{upload_time.strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}.arrow"
+
+    def write_table(f):
+        with pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+
+    replace_file_atomically(os.path.join(INVENTORY_SNAPSHOT_DIR, version), write_table)
+    replace_file_atomically(os.path.join(INVENTORY_SNAPSHOT_DIR, INVENTORY_SNAPSHOT_POINTER),
+                            lambda f: f.write(version.encode()))
+    prune_inventory_snapshots(version)
+    return version
+
+def prune_inventory_snapshots(current: str):
+    # Names sort by upload time; unlinking a file other workers are still reading is safe on Linux
+    snapshots = sorted(name for name in os.listdir(INVENTORY_SNAPSHOT_DIR)
+                       if name.startswith('inventory-') and name.endswith('.arrow') and name != current)
+    for name in snapshots[:max(0, len(snapshots) - (INVENTORY_SNAPSHOTS_KEPT - 1))]:
+        try:
+            os.remove(os.path.join(INVENTORY_SNAPSHOT_DIR, name))
+        except OSError:
+            pass
+
+def current_inventory_snapshot() -> Optional[str]:
+    try:
+        with open(os.path.join(INVENTORY_SNAPSHOT_DIR, INVENTORY_SNAPSHOT_POINTER), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def read_inventory_snapshot(version: str) -> Tuple[pd.DataFrame, datetime]:
+    """Reads a snapshot into this worker's memory; each worker holds its own copy of the inventory."""
+    import pyarrow as pa
+
+    with pa.OSFile(os.path.join(INVENTORY_SNAPSHOT_DIR, version), 'rb') as source:
+        table = pa.ipc.open_file(source).read_all()
+    upload_time = datetime.fromisoformat((table.schema.metadata or {})[b'upload_time'].decode())
+    return table.to_pandas(), upload_time
+
+def load_inventory_snapshot(version: str):
+    with inventory_snapshot_lock:
+        if version != inventory_snapshot_version:
+            df, upload_time = read_inventory_snapshot(version)
+            publish_inventory(df, upload_time, version)
+            logger.info(f"Loaded inventory snapshot {version}: {len(df)} rows")
+
+def store_inventory(df: pd.DataFrame, upload_time: datetime) -> pd.DataFrame:
+    """Sorts and publishes an upload; with a snapshot directory every worker picks it up too."""
+    # Converted with or without snapshots, so the cell types served never depend on the setting
+    df = arrow_compatible_inventory(sort_inventory_by_key(df))
+    if not INVENTORY_SNAPSHOT_DIR:
+        publish_inventory(df, upload_time)
+        return df
+    version = write_inventory_snapshot(df, upload_time)
+    # Serve the mapped copy here as well, so every worker returns identical data
+    load_inventory_snapshot(version)
+    return inventory_data
+
+async def sync_inventory_snapshot():
+    """Switches to the published snapshot if another worker (or a previous run) stored a newer one."""
+    if not INVENTORY_SNAPSHOT_DIR:
+        return
+    version = current_inventory_snapshot()
+    if version is not None and version != inventory_snapshot_version:
+        await anyio.to_thread.run_sync(load_inventory_snapshot, version)
+
+def match_inventory_rows(
+    row_count: int, arrays: Dict[str, np.ndarray], text_index: Dict[str, TextColumnIndex],
+    marca: Optional[str] = None, version: Optional[str] = None,
+    min_kms: Optional[float] = None, max_kms: Optional[float] = None,
+    min_precio: Optional[float] = None, max_precio: Optional[float] = None,
+    min_precio_financiado: Optional[float] = None, max_precio_financiado: Optional[float] = None,
+    matricula: Optional[str] = None, carroceria: Optional[str] = None, combustible: Optional[str] = None,
+    fecha_matriculacion_desde: Optional[str] = None, fecha_matriculacion_hasta: Optional[str] = None,
+    color: Optional[str] = None, cambio: Optional[str] = None, tipo: Optional[str] = None,
+    estado: Optional[str] = None, tienda: Optional[str] = None,
+) -> np.ndarray:
+    """Ascending row positions of the inventory rows matching every given /inventory/search/ filter."""
+    # Text filters resolve to candidate row positions through the trigram index
+    # and are intersected; None means no text filter narrowed the rows yet.
+    text_filters = [
+        ('Marca', marca), ('Versión', version), ('Matrícula', matricula),
+        ('Carroceria', carroceria), ('Combustible', combustible), ('Color', color),
+        ('Cambio', cambio), ('Tipo', tipo), ('Estado', estado)
+    ]
+    positions: Optional[np.ndarray] = None
+    for column, value in text_filters:
+        if value:
+            rows = text_index[column].rows_containing(value)
+            positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+    
+    if tienda:
+        # Exact match, case-insensitive
+        rows = text_index['Tienda'].rows_equal(tienda)
+        positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+    
+    if positions is None:
+        positions = np.arange(row_count)
+    
+    # Range filters only look at the candidate rows left by the text filters
+    def values(column: str) -> np.ndarray:
+        return arrays[column][positions]
+    
+    mask = np.ones(len(positions), dtype=bool)
+    
+    # Kms range filter
+    if min_kms is not None:
+        mask &= values('Kms') >= min_kms
+    if max_kms is not None:
+        mask &= values('Kms') <= max_kms
+    
+    # Precio range filter (already converted from comma decimal strings at upload time)
+    if min_precio is not None:
+        mask &= values('Precio') >= min_precio
+    if max_precio is not None:
+        mask &= values('Precio') <= max_precio
+    
+    # Precio financiado range filter
+    if min_precio_financiado is not None:
+        mask &= values('Precio financiado') >= min_precio_financiado
+    if max_precio_financiado is not None:
+        mask &= values('Precio financiado') <= max_precio_financiado
+    
+    # Fecha de Matriculación range filter
+    if fecha_matriculacion_desde or fecha_matriculacion_hasta:
+        fecha_col = values(INVENTORY_DATE_COLUMN)
+        
+        if fecha_matriculacion_desde:
+            fecha_desde = parse_inventory_date_bound(fecha_matriculacion_desde, end_of_period=False)
+            if fecha_desde is not None:  # Ignore invalid date format
+                mask &= fecha_col >= fecha_desde
+        
+        if fecha_matriculacion_hasta:
+            fecha_hasta = parse_inventory_date_bound(fecha_matriculacion_hasta, end_of_period=True)
+            if fecha_hasta is not None:  # Ignore invalid date format
+                mask &= fecha_col <= fecha_hasta
+    
+    return positions[mask]
 
 @app.post("/inventory/upload/", status_code=200, dependencies=[Security(get_api_key)])
-async def upload_inventory_excel(file: UploadFile = File(...)):
+async def upload_inventory_excel(request: Request, file: UploadFile = File(...)):
     """
-    Upload Excel inventory stock data to be stored in server memory.
-    Expected Excel headers: Adid, Marca, Modelo, Versión, Kms, Precio, Precio anterior, 
+    Upload inventory stock data (Excel, CSV or Parquet) to be stored in server memory.
+    Expected headers: Adid, Marca, Modelo, Versión, Kms, Precio, Precio anterior, 
     Cuota Mensual Financiación, Precio financiado, Precio profesional, 
     Marketplace Profesionales, Matrícula, Bastidor, Carroceria, Puertas, Combustible, 
     Distintivo Ambiental, Fecha de Matriculación, Potencia, Color, Asientos, Marchas, 
@@ -358,42 +2443,30 @@ async def upload_inventory_excel(file: UploadFile = File(...)):
     Material interior, Tienda, Comentarios Internos, Disponibilidad, Destacado web, 
     Garantía, Más Información
     """
-    global inventory_data, inventory_upload_time
+    global inventory_upload_time, inventory_facets
     
     # Validate file type
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
-    
+    if not file.filename or inventory_reader(file.filename) is None:
+        raise HTTPException(status_code=400, detail="File must be an Excel (.xlsx or .xls), CSV (.csv) or Parquet (.parquet) file")
+
     try:
-        # Read the file content
-        content = await file.read()
-        
-        # Create a BytesIO object from the content
-        excel_file = io.BytesIO(content)
-        
-        # Read Excel file using pandas
-        df = pd.read_excel(excel_file, engine='openpyxl' if file.filename.endswith('.xlsx') else 'xlrd')
-        
-        # Log the first few rows for debugging (first 3 records)
-        print("--- EXCEL INVENTORY DATA UPLOADED (first 3 records) ---")
-        print(f"Total rows: {len(df)}")
-        print(f"Columns: {list(df.columns)}")
-        if len(df) > 0:
-            print("Sample data:")
-            print(df.head(3).to_string())
-        print("----------------------------------")
+        # Parse in a worker thread so other requests are served meanwhile
+        df = await anyio.to_thread.run_sync(read_inventory_file, file.file, file.filename)
+
+        # Logged with the request: row count, columns and the first few rows
+        request.state.log_fields = {"filename": file.filename, **payload_log_fields(
+            len(df), list(df.columns), df.head(REQUEST_LOG_PREVIEW_ROWS).to_dict('records'))}
         
-        # Store data in global variable
-        inventory_data = df
-        inventory_upload_time = datetime.now()
+        # Normalise the filterable columns, save the snapshot when configured, then publish
+        df = await anyio.to_thread.run_sync(store_inventory, df, datetime.now())
         
         # Prepare response with statistics
         column_count = len(df.columns)
         row_count = len(df)
         
-        # Get basic statistics about the data
-        marca_counts = df['Marca'].value_counts().head(5).to_dict() if 'Marca' in df.columns else {}
-        modelo_counts = df['Modelo'].value_counts().head(5).to_dict() if 'Modelo' in df.columns else {}
+        # Get basic statistics about the data (precomputed with the facets)
+        marca_counts = inventory_facets.top_values('Marca', 5)
+        modelo_counts = inventory_facets.top_values('Modelo', 5)
         
         response = {
             "message": "Inventory Excel file uploaded successfully",
@@ -410,14 +2483,15 @@ async def upload_inventory_excel(file: UploadFile = File(...)):
         return response
         
     except Exception as e:
-        print(f"Error processing Excel file: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing Excel file: {str(e)}")
+        logger.exception(f"Error processing inventory file: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing inventory file: {str(e)}")
 
 @app.get("/inventory/info/", dependencies=[Security(get_api_key)])
 async def get_inventory_info():
     """Get information about the currently loaded inventory data."""
-    global inventory_data, inventory_upload_time
+    global inventory_data, inventory_upload_time, inventory_facets
     
+    await sync_inventory_snapshot()
     if inventory_data is None:
         return {
             "message": "No inventory data loaded",
@@ -427,13 +2501,14 @@ async def get_inventory_info():
         }
     
     # Get statistics about current data
-    marca_counts = inventory_data['Marca'].value_counts().head(10).to_dict() if 'Marca' in inventory_data.columns else {}
-    modelo_counts = inventory_data['Modelo'].value_counts().head(10).to_dict() if 'Modelo' in inventory_data.columns else {}
+    marca_counts = inventory_facets.top_values('Marca', 10)
+    modelo_counts = inventory_facets.top_values('Modelo', 10)
     
     return {
         "message": "Inventory data is loaded",
         "data_loaded": True,
         "upload_time": inventory_upload_time.isoformat() if inventory_upload_time else None,
+        "snapshot_version": inventory_snapshot_version,
         "statistics": {
             "total_records": len(inventory_data),
             "total_columns": len(inventory_data.columns),
@@ -463,106 +2538,49 @@ async def search_inventory_vehicles(
     tipo: Optional[str] = Query(None, description="Filter by Tipo"),
     estado: Optional[str] = Query(None, description="Filter by Estado"),
     tienda: Optional[str] = Query(None, description="Filter by Tienda"),
-    limit: int = Query(100, ge=1, le=1000, description="Maximum number of results to return")
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of results to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page, to fetch the next one")
 ):
     """
     Search vehicles in the uploaded inventory data stored in memory.
-    All filters are optional and can be combined.
+    All filters are optional and can be combined. Results are ordered by Adid; when more
+    vehicles match, `next_cursor` continues after the returned page.
     """
-    global inventory_data
+    global inventory_data, inventory_arrays, inventory_text_index
     
+    await sync_inventory_snapshot()
     if inventory_data is None or inventory_data.empty:
-        raise HTTPException(status_code=404, detail="No inventory data loaded. Please upload an Excel file first using /inventory/upload/")
+        raise HTTPException(status_code=404, detail="No inventory data loaded. Please upload an inventory file first using /inventory/upload/")
+    
+    after_key = decode_cursor(cursor, float) if cursor else None
     
     try:
-        # Start with all data
-        filtered_data = inventory_data.copy()
-        
-        # Apply filters
-        if marca:
-            filtered_data = filtered_data[filtered_data['Marca'].str.contains(marca, case=False, na=False)]
-        
-        if version:
-            filtered_data = filtered_data[filtered_data['Versión'].str.contains(version, case=False, na=False)]
-        
-        # Kms range filter
-        if min_kms is not None:
-            filtered_data = filtered_data[pd.to_numeric(filtered_data['Kms'], errors='coerce') >= min_kms]
-        if max_kms is not None:
-            filtered_data = filtered_data[pd.to_numeric(filtered_data['Kms'], errors='coerce') <= max_kms]
-        
-        # Precio range filter
-        if min_precio is not None:
-            # Convert price string to numeric (handle commas as decimal separators)
-            precio_numeric = pd.to_numeric(filtered_data['Precio'].astype(str).str.replace(',', '.'), errors='coerce')
-            filtered_data = filtered_data[precio_numeric >= min_precio]
-        if max_precio is not None:
-            precio_numeric = pd.to_numeric(filtered_data['Precio'].astype(str).str.replace(',', '.'), errors='coerce')
-            filtered_data = filtered_data[precio_numeric <= max_precio]
-        
-        # Precio financiado range filter
-        if min_precio_financiado is not None:
-            precio_fin_numeric = pd.to_numeric(filtered_data['Precio financiado'].astype(str).str.replace(',', '.'), errors='coerce')
-            filtered_data = filtered_data[precio_fin_numeric >= min_precio_financiado]
-        if max_precio_financiado is not None:
-            precio_fin_numeric = pd.to_numeric(filtered_data['Precio financiado'].astype(str).str.replace(',', '.'), errors='coerce')
-            filtered_data = filtered_data[precio_fin_numeric <= max_precio_financiado]
-        
-        if matricula:
-            filtered_data = filtered_data[filtered_data['Matrícula'].str.contains(matricula, case=False, na=False)]
-        
-        if carroceria:
-            filtered_data = filtered_data[filtered_data['Carroceria'].str.contains(carroceria, case=False, na=False)]
+        # Work on local references so a concurrent upload cannot mix two datasets
+        df = inventory_data
+        arrays = inventory_arrays
+        text_index = inventory_text_index
         
-        if combustible:
-            filtered_data = filtered_data[filtered_data['Combustible'].str.contains(combustible, case=False, na=False)]
+        matched = match_inventory_rows(
+            len(df), arrays, text_index, marca=marca, version=version, min_kms=min_kms, max_kms=max_kms,
+            min_precio=min_precio, max_precio=max_precio, min_precio_financiado=min_precio_financiado,
+            max_precio_financiado=max_precio_financiado, matricula=matricula, carroceria=carroceria,
+            combustible=combustible, fecha_matriculacion_desde=fecha_matriculacion_desde,
+            fecha_matriculacion_hasta=fecha_matriculacion_hasta, color=color, cambio=cambio, tipo=tipo,
+            estado=estado, tienda=tienda)
         
-        # Fecha de Matriculación range filter
-        if fecha_matriculacion_desde or fecha_matriculacion_hasta:
-            # Convert the date column to datetime, handling different formats
-            fecha_col = pd.to_datetime(filtered_data['Fecha de Matriculación'], format='%m/%Y', errors='coerce')
-            # If that fails, try other common formats
-            if fecha_col.isna().all():
-                fecha_col = pd.to_datetime(filtered_data['Fecha de Matriculación'], errors='coerce')
-            
-            if fecha_matriculacion_desde:
-                try:
-                    if '/' in fecha_matriculacion_desde:
-                        fecha_desde = pd.to_datetime(fecha_matriculacion_desde, format='%m/%Y')
-                    else:
-                        fecha_desde = pd.to_datetime(f"01/01/{fecha_matriculacion_desde}", format='%d/%m/%Y')
-                    filtered_data = filtered_data[fecha_col >= fecha_desde]
-                except:
-                    pass  # Ignore invalid date format
-            
-            if fecha_matriculacion_hasta:
-                try:
-                    if '/' in fecha_matriculacion_hasta:
-                        fecha_hasta = pd.to_datetime(fecha_matriculacion_hasta, format='%m/%Y')
-                    else:
-                        fecha_hasta = pd.to_datetime(f"31/12/{fecha_matriculacion_hasta}", format='%d/%m/%Y')
-                    filtered_data = filtered_data[fecha_col <= fecha_hasta]
-                except:
-                    pass  # Ignore invalid date format
-        
-        if color:
-            filtered_data = filtered_data[filtered_data['Color'].str.contains(color, case=False, na=False)]
-        
-        if cambio:
-            filtered_data = filtered_data[filtered_data['Cambio'].str.contains(cambio, case=False, na=False)]
+        # Positions are ascending, which is Adid order; the cursor skips to the first key after it
+        total_count = len(matched)
+        if after_key is not None:
+            start = np.searchsorted(arrays[INVENTORY_KEY_COLUMN], after_key, side='right')
+            matched = matched[np.searchsorted(matched, start):]
+        page = matched[:limit]
+        next_cursor = None
+        if len(matched) > limit:
+            last_key = float(arrays[INVENTORY_KEY_COLUMN][page[-1]])
+            next_cursor = encode_cursor(int(last_key) if last_key.is_integer() else last_key)
         
-        if tipo:
-            filtered_data = filtered_data[filtered_data['Tipo'].str.contains(tipo, case=False, na=False)]
-        
-        if estado:
-            filtered_data = filtered_data[filtered_data['Estado'].str.contains(estado, case=False, na=False)]
-        
-        if tienda:
-            # Exact match, case-insensitive
-            filtered_data = filtered_data[filtered_data['Tienda'].str.lower() == tienda.lower()]
-        
-        # Apply limit
-        filtered_data = filtered_data.head(limit)
+        # Apply limit, materialising only the rows that are returned
+        filtered_data = df.iloc[page]
         
         # Define essential columns for a concise response
         essential_columns = [
@@ -577,15 +2595,15 @@ async def search_inventory_vehicles(
         # Convert to list of dictionaries for JSON response
         results = filtered_data[existing_essential_columns].fillna('').to_dict('records')
         
-        # Log the search operation
-        print(f"--- INVENTORY SEARCH PERFORMED ---")
-        print(f"Search filters applied: marca={marca}, version={version}, min_kms={min_kms}, max_kms={max_kms}")
-        print(f"Results found: {len(results)} out of {len(inventory_data)} total records")
-        print("----------------------------------")
+        logger.debug("inventory search", extra={"fields": {
+            "marca": marca, "version": version, "min_kms": min_kms, "max_kms": max_kms,
+            "results": len(results), "total_inventory_records": len(inventory_data)}})
         
         return {
             "message": "Inventory search completed",
             "total_found": len(results),
+            "total_count": total_count,
+            "next_cursor": next_cursor,
             "total_inventory_records": len(inventory_data),
             "search_filters": {
                 "marca": marca,
@@ -611,14 +2629,77 @@ async def search_inventory_vehicles(
         }
         
     except Exception as e:
-        print(f"Error searching inventory data: {e}")
+        logger.exception(f"Error searching inventory data: {e}")
         raise HTTPException(status_code=500, detail=f"Error searching inventory data: {str(e)}")
 
+@app.get("/inventory/facets/", dependencies=[Security(get_api_key)])
+async def get_inventory_facets(
+    marca: Optional[str] = Query(None, description="Filter by Marca (brand)"),
+    version: Optional[str] = Query(None, alias="version", description="Filter by Versión (version)"),
+    min_kms: Optional[float] = Query(None, description="Minimum Kms"),
+    max_kms: Optional[float] = Query(None, description="Maximum Kms"),
+    min_precio: Optional[float] = Query(None, description="Minimum Precio"),
+    max_precio: Optional[float] = Query(None, description="Maximum Precio"),
+    min_precio_financiado: Optional[float] = Query(None, description="Minimum Precio financiado"),
+    max_precio_financiado: Optional[float] = Query(None, description="Maximum Precio financiado"),
+    matricula: Optional[str] = Query(None, alias="matricula", description="Filter by Matrícula"),
+    carroceria: Optional[str] = Query(None, alias="carroceria", description="Filter by Carrocería"),
+    combustible: Optional[str] = Query(None, description="Filter by Combustible"),
+    fecha_matriculacion_desde: Optional[str] = Query(None, description="Fecha de Matriculación from (MM/YYYY or YYYY)"),
+    fecha_matriculacion_hasta: Optional[str] = Query(None, description="Fecha de Matriculación to (MM/YYYY or YYYY)"),
+    color: Optional[str] = Query(None, description="Filter by Color"),
+    cambio: Optional[str] = Query(None, description="Filter by Cambio (transmission)"),
+    tipo: Optional[str] = Query(None, description="Filter by Tipo"),
+    estado: Optional[str] = Query(None, description="Filter by Estado"),
+    tienda: Optional[str] = Query(None, description="Filter by Tienda")
+):
+    """
+    Count the vehicles matching the /inventory/search/ filters per Marca, Modelo, Combustible,
+    Cambio, Tienda and Estado value, plus Precio and Kms histograms, to show refinement options.
+    """
+    global inventory_data, inventory_arrays, inventory_text_index, inventory_facets
+
+    await sync_inventory_snapshot()
+    if inventory_data is None or inventory_data.empty:
+        raise HTTPException(status_code=404, detail="No inventory data loaded. Please upload an inventory file first using /inventory/upload/")
+
+    # Work on local references so a concurrent upload cannot mix two datasets
+    df = inventory_data
+    arrays = inventory_arrays
+    text_index = inventory_text_index
+    facets = inventory_facets
+    filters = {
+        "marca": marca, "version": version, "min_kms": min_kms, "max_kms": max_kms,
+        "min_precio": min_precio, "max_precio": max_precio,
+        "min_precio_financiado": min_precio_financiado, "max_precio_financiado": max_precio_financiado,
+        "matricula": matricula, "carroceria": carroceria, "combustible": combustible,
+        "fecha_matriculacion_desde": fecha_matriculacion_desde,
+        "fecha_matriculacion_hasta": fecha_matriculacion_hasta,
+        "color": color, "cambio": cambio, "tipo": tipo, "estado": estado, "tienda": tienda
+    }
+
+    try:
+        if any(value is not None and value != "" for value in filters.values()):
+            matched = match_inventory_rows(len(df), arrays, text_index, **filters)
+            total_count, counts = len(matched), facets.counts(matched)
+        else:
+            total_count, counts = len(df), facets.totals
+    except Exception as e:
+        logger.exception(f"Error computing inventory facets: {e}")
+        raise HTTPException(status_code=500, detail=f"Error computing inventory facets: {str(e)}")
+
+    return {
+        "message": "Inventory facets computed",
+        "total_count": total_count,
+        "total_inventory_records": len(df),
+        "search_filters": filters,
+        **counts
+    }
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Vehicle Search API. Access car data at /cars/ endpoint."}
 
-# For local development, if you run this file directly:
-# uvicorn vehicle_search_api.app.main:app --reload --port 8000 --host 0.0.0.0
+# For local development, run from vehicle_search_api/ so the `app` package imports as in the container:
+# uvicorn app.main:app --reload --port 8000 --host 0.0.0.0 --env-file .env
 # Ensure .env is in vehicle_search_api/
-# To run from vehicle_search_api/app: uvicorn main:app --reload --port 8000 --host 0.0.0.0 --env-file ../.env
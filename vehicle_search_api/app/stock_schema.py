@@ -0,0 +1,150 @@
+"""
+Declared schema of the vehicles_stock table (documentation/vehicle_stock_schema.md), shared by
+the Vehicle Search API and mysql_to_sqlite_sync/sync_script.py, so that a synchronized table
+keeps its column types and search indexes.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer, MetaData, String, Table, Text, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.types import TypeEngine
+
+# Documented columns, as pushed to /stock/ and read from the external view
+VEHICLE_STOCK_SCHEMA = {
+    'ficha_id': BigInteger, 'workflow_nombre': Text, 'workflow_id': BigInteger,
+    'workflow_estado': Text, 'workflow_estado_id': BigInteger, 'workflow_subestado': Text,
+    'workflow_subestado_id': BigInteger, 'modelo': Text, 'origen_custom': Text,
+    'descripcion': Text, 'tipo_transmision': Text, 'matricula': Text, 'vin': Text,
+    'fecha_matriculacion': DateTime, 'fecha_matriculacion_JAWA': DateTime,
+    'kms_vehiculo': Float, 'kms': Float, 'kms_manual': Text, 'color': Text,
+    'interior': Text, 'color_interior': Text, 'equipamiento': Text,
+    'fiscalidad': Float, 'pvp': Text, 'garantia': Text, 'comercial': Text,
+    'fecha_reserva': Text, 'observaciones': Text, 'color_registro': Text,
+    'fiscalidad_GO': Text, 'marca': Text, 'color_api': Text, 'interior_api': Text,
+    'fiscalidad_api': Float, 'pvp_api': Float, 'precio_base_api': Float, 'origen': Text,
+    'marca_inv': Text, 'modelo_inv': Text, 'version_inv': Text,
+    'codigo_jato_inv': Text, 'publicar_inv': Text, 'fecha_publicado_inv': Text,
+    'codigo_progresion': Text, 'tipo_venta': Text, 'clase_vehiculo': Text,
+    'grossvalue': Float, 'ubicacion': Text, 'fecha_factura_compra': Text,
+    'vehicle_stock_id': Text
+}
+
+# Columns computed from each row when it is loaded (by the API's /stock/ ingestion and by the
+# sync), so /cars/ neither post-processes rows nor filters tienda/vo_vn with LIKE on workflow_estado.
+# tienda and vo_vn keep the case of workflow_estado for the response; the uppercase *_norm copies
+# back the case-insensitive filters and their indexes.
+STOCK_DERIVED_COLUMNS = {
+    'tienda': String(32),
+    'vo_vn': String(16),
+    'tienda_norm': String(32),
+    'vo_vn_norm': String(16),
+    'marca_efectiva': Text(),
+    'modelo_efectivo': Text(),
+}
+
+# Documented columns the derived ones are computed from
+STOCK_DERIVATION_INPUTS = ('workflow_estado', 'marca', 'marca_inv', 'modelo', 'modelo_inv', 'descripcion')
+
+def derive_workflow_fields(workflow_estado: Any) -> Dict[str, Optional[str]]:
+    """Splits workflow_estado ("Stock <TIENDA> <VO_VN>") into tienda and vo_vn, and their uppercase *_norm forms."""
+    tienda = vo_vn = None
+    if workflow_estado and isinstance(workflow_estado, str):
+        parts = workflow_estado.split()
+        if len(parts) >= 3:
+            tienda, vo_vn = parts[1], parts[2]
+        elif len(parts) == 2:
+            if parts[1].upper() in ['NEW', 'VO']:
+                vo_vn = parts[1]
+            else:
+                tienda = parts[1]
+    return {'tienda': tienda, 'vo_vn': vo_vn,
+            'tienda_norm': tienda.upper() if tienda else None, 'vo_vn_norm': vo_vn.upper() if vo_vn else None}
+
+def derive_stock_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Computes the STOCK_DERIVED_COLUMNS of a stock record from its STOCK_DERIVATION_INPUTS."""
+    def present(value: Any) -> bool:
+        return value is not None and str(value).strip() != ""
+
+    # marca_inv/modelo_inv override the stock values; descripcion is the last modelo fallback
+    marca = record.get('marca_inv') if present(record.get('marca_inv')) else record.get('marca')
+    modelo = record.get('modelo_inv') if present(record.get('modelo_inv')) else record.get('modelo')
+    if not present(modelo):
+        modelo = record.get('descripcion')
+    return {'marca_efectiva': marca, 'modelo_efectivo': modelo,
+            **derive_workflow_fields(record.get('workflow_estado'))}
+
+# Indexes backing the API's /cars/ predicates (see build_cars_query() in main.py)
+STOCK_SEARCH_INDEXES = {
+    'ix_vehicles_stock_ficha_id': ('ficha_id',),  # Keyset pagination order
+    'ix_vehicles_stock_vin': ('vin',),
+    'ix_vehicles_stock_fecha_matriculacion': ('fecha_matriculacion',),
+    'ix_vehicles_stock_marca_fecha': ('marca', 'fecha_matriculacion'),
+    'ix_vehicles_stock_marca_inv_fecha': ('marca_inv', 'fecha_matriculacion'),
+    'ix_vehicles_stock_transmision_fecha': ('tipo_transmision', 'fecha_matriculacion'),
+    'ix_vehicles_stock_tienda_vo_vn_norm': ('tienda_norm', 'vo_vn_norm', 'pvp_api'),
+    'ix_vehicles_stock_vo_vn_norm': ('vo_vn_norm', 'pvp_api'),
+}
+STOCK_INDEX_PREFIX_LENGTH = 64  # MySQL can only index a prefix of TEXT columns
+
+def stock_column_type(name: str) -> Optional[TypeEngine]:
+    """Declared type of a documented or derived column, or None for columns outside the schema."""
+    if name in STOCK_DERIVED_COLUMNS:
+        return STOCK_DERIVED_COLUMNS[name]
+    column_type = VEHICLE_STOCK_SCHEMA.get(name)
+    if column_type is None:
+        return None
+    # A bare FLOAT is single precision on MySQL; FLOAT(53) stores doubles like the source
+    return Float(precision=53) if column_type is Float else column_type()
+
+def stock_column_types(columns: Iterable[str]) -> Dict[str, TypeEngine]:
+    """Declared types of the given columns that belong to the schema, e.g. for pandas' to_sql(dtype=)."""
+    types = {}
+    for column in columns:
+        column_type = stock_column_type(str(column))
+        if column_type is not None:
+            types[str(column)] = column_type
+    return types
+
+def stock_search_indexes(table: Table) -> List[Index]:
+    """The STOCK_SEARCH_INDEXES whose columns all exist in `table`, with MySQL prefixes for TEXT columns."""
+    indexes = []
+    for name, column_names in STOCK_SEARCH_INDEXES.items():
+        if not all(column in table.c for column in column_names):
+            continue
+        columns = [table.c[column] for column in column_names]
+        prefix_lengths = {c.name: STOCK_INDEX_PREFIX_LENGTH for c in columns if isinstance(c.type, Text)}
+        indexes.append(Index(name, *columns, mysql_length=prefix_lengths))
+    return indexes
+
+# Single-row table whose version every load of vehicles_stock bumps once its rows are committed
+# (the API's /stock/ pushes and the sync alike), so an API worker can tell with one primary-key
+# read whether results it cached are still current
+STOCK_VERSION_TABLE = Table(
+    'vehicles_stock_version', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('version', BigInteger, nullable=False),
+)
+STOCK_VERSION_ROW_ID = 1
+
+def read_stock_version(connection) -> Optional[int]:
+    """The committed stock version, or None if its row does not exist yet."""
+    table = STOCK_VERSION_TABLE
+    return connection.execute(select(table.c.version).where(table.c.id == STOCK_VERSION_ROW_ID)).scalar()
+
+def ensure_stock_version_table(engine) -> None:
+    """Creates the STOCK_VERSION_TABLE and its row unless they exist."""
+    # DDL commits implicitly on MySQL, so the table is created before the row's transaction
+    with engine.begin() as connection:
+        connection.execute(CreateTable(STOCK_VERSION_TABLE, if_not_exists=True))
+    try:
+        with engine.begin() as connection:
+            if read_stock_version(connection) is None:
+                connection.execute(STOCK_VERSION_TABLE.insert().values(id=STOCK_VERSION_ROW_ID, version=0))
+    except IntegrityError:
+        pass  # Another process inserted it first
+
+def bump_stock_version(connection) -> None:
+    """Increments the stock version inside the connection's transaction."""
+    table = STOCK_VERSION_TABLE
+    connection.execute(update(table).where(table.c.id == STOCK_VERSION_ROW_ID).values(version=table.c.version + 1))
@@ -0,0 +1,103 @@
+"""
+Measures GET /cars/ throughput at several numbers of parallel clients against a local
+SQLite stand-in, with database work offloaded to the DB thread pool ('threadpool') and
+run directly on the event loop as before ('inline').
+
+    python benchmarks/bench_cars_concurrency.py [--clients 1 10 100] [--requests 400]
+                                                [--rows 20000] [--latency-ms 2]
+
+--latency-ms adds a sleep before every statement to stand in for the network round
+trip to Azure MySQL, which is what the event loop was blocked on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import MetaData, Table, Column, event
+
+from common import BENCH_API_KEY, TEST_PAYLOAD_JSON, import_app
+
+FILTERS = ["", "marca=land", "tipo_transmision=auto", "year=2024", "tienda=m1&vo_vn=new",
+           "min_price=20000&max_price=60000", "modelo=evoque", "color=blanco"]
+
+
+def load_stock(app_main, row_count):
+    with open(TEST_PAYLOAD_JSON, encoding='utf-8') as f:
+        payload = json.load(f)
+    fields = [app_main.stock_field_name(c) for c in payload['campos']]
+    fecha = fields.index('fecha_matriculacion')
+    rows = []
+    for i in range(row_count):
+        row = list(payload['datos'][i % len(payload['datos'])])
+        row[0] = i + 1
+        if row[fecha]:
+            row[fecha] = row[fecha].replace('T', ' ')
+        rows.append(row)
+
+    metadata = MetaData()
+    table = Table('vehicles_stock', metadata,
+                  *[Column(name, type_) for name, type_ in app_main.VEHICLE_STOCK_SCHEMA.items()])
+    metadata.create_all(app_main.engine)
+    with app_main.engine.begin() as connection:
+        connection.execute(table.insert(), app_main.StockColumnConverter(fields).convert(rows))
+    app_main.prepare_stock_database()
+
+
+async def run_clients(app, clients, total_requests):
+    transport = httpx.ASGITransport(app=app)
+    urls = [f"/cars/?{FILTERS[i % len(FILTERS)]}" for i in range(total_requests)]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 headers={"X-API-Key": BENCH_API_KEY}) as client:
+        async def worker(worker_urls):
+            for url in worker_urls:
+                response = await client.get(url)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(urls[i::clients]) for i in range(clients)])
+        return time.perf_counter() - start
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_main = import_app({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'vehicles.db')}",
+            "CARS_CACHE_SIZE": "0",
+        })
+        load_stock(app_main, args.rows)
+        if args.latency_ms:
+            event.listen(app_main.engine, "before_cursor_execute",
+                         lambda *a: time.sleep(args.latency_ms / 1000))
+
+        threadpool = app_main.run_in_db_threadpool
+        print(f"{args.rows} rows, {args.requests} requests per run, "
+              f"{args.latency_ms} ms latency, DB_THREADPOOL_SIZE={app_main.DB_THREADPOOL_SIZE}")
+        print(f"{'clients':>8} {'inline req/s':>13} {'threadpool req/s':>17} {'speed-up':>9}")
+        for clients in args.clients:
+            app_main.run_in_db_threadpool = run_inline
+            inline = asyncio.run(run_clients(app_main.app, clients, args.requests))
+            app_main.run_in_db_threadpool = threadpool
+            app_main.db_thread_limiter = None  # Bound to the previous event loop
+            offloaded = asyncio.run(run_clients(app_main.app, clients, args.requests))
+            print(f"{clients:>8} {args.requests / inline:>13.1f} {args.requests / offloaded:>17.1f} "
+                  f"{inline / offloaded:>8.1f}x")
+        app_main.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
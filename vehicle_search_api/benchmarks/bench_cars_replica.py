@@ -0,0 +1,62 @@
+"""
+Compares the latency of single GET /cars/ requests served by the database with the
+CARS_READ_REPLICA in-memory copy, against a local SQLite stand-in.
+
+    python benchmarks/bench_cars_replica.py [--rows 5000] [--repeat 200] [--latency-ms 2]
+
+--latency-ms adds a sleep before every statement to stand in for the round trip to Azure MySQL.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from bench_cars_concurrency import FILTERS, load_stock
+from common import BENCH_API_KEY, import_app
+
+
+def median_ms(client, query, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(f"/cars/?{query}")
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_main = import_app({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'vehicles.db')}",
+            "CARS_CACHE_SIZE": "0",
+        })
+        load_stock(app_main, args.rows)
+        if args.latency_ms:
+            event.listen(app_main.engine, "before_cursor_execute",
+                         lambda *a: time.sleep(args.latency_ms / 1000))
+
+        print(f"{args.rows} rows, {args.latency_ms} ms latency, median of {args.repeat} requests")
+        print(f"{'filters':<34} {'database ms':>12} {'replica ms':>11} {'speed-up':>9}")
+        with TestClient(app_main.app, headers={"X-API-Key": BENCH_API_KEY}) as client:
+            for query in FILTERS:
+                app_main.CARS_READ_REPLICA = False
+                database = median_ms(client, query, args.repeat)
+                app_main.CARS_READ_REPLICA = True
+                replica = median_ms(client, query, args.repeat)
+                print(f"{query or '(none)':<34} {database:>12.2f} {replica:>11.2f} {database / replica:>8.1f}x")
+        app_main.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
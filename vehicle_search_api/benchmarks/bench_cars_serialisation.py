@@ -0,0 +1,48 @@
+"""
+Compares the CPU cost of a large GET /cars/ page in the default validated JSON response
+with the streamed 'json' and 'ndjson' formats, against a local SQLite stand-in.
+
+    python benchmarks/bench_cars_serialisation.py [--rows 5000] [--limit 100 1000] [--repeat 5]
+"""
+import argparse
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from bench_cars_concurrency import load_stock
+from common import BENCH_API_KEY, best_of, import_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--limit', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_main = import_app({
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'vehicles.db')}",
+            "CARS_CACHE_SIZE": "0",
+        })
+        load_stock(app_main, args.rows)
+        print(f"orjson {'installed' if app_main.orjson is not None else 'not installed (json module fallback)'}")
+        print(f"{'limit':>6} {'default s':>10} {'json s':>8} {'ndjson s':>9} {'speed-up':>9}")
+        with TestClient(app_main.app, headers={"X-API-Key": BENCH_API_KEY}) as client:
+            for limit in args.limit:
+                def fetch(query):
+                    response = client.get(f"/cars/?limit={limit}{query}")
+                    assert response.status_code == 200, response.text
+                    return response.content
+
+                default, _ = best_of(args.repeat, fetch, "")
+                streamed_json, _ = best_of(args.repeat, fetch, "&format=json")
+                ndjson, _ = best_of(args.repeat, fetch, "&format=ndjson")
+                print(f"{limit:>6} {default:>10.4f} {streamed_json:>8.4f} {ndjson:>9.4f} "
+                      f"{default / min(streamed_json, ndjson):>8.1f}x")
+        app_main.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Measures POST /inventory/upload/ ingestion (parse + typed arrays + text index) of the sample
+inventory and 10x/100x enlargements as XLSX (openpyxl and calamine), CSV and Parquet, with
+wall time, peak traced Python memory and peak process RSS.
+
+    python benchmarks/bench_inventory_ingest.py [--scales 1 10 100] [--repeat 3]
+
+Every case runs in its own subprocess so the RSS peaks, which include the native
+allocations of calamine and pyarrow that tracemalloc cannot see, do not add up.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import SAMPLE_INVENTORY_XLSX, best_of, import_app
+
+CASES = [('xlsx', 'openpyxl'), ('xlsx', 'calamine'), ('csv', None), ('parquet', None)]
+
+
+def enlarge(df, scale):
+    import pandas as pd
+
+    step = int(df['Adid'].max()) + 1
+    copies = [df.assign(Adid=df['Adid'] + i * step) for i in range(scale)]
+    return pd.concat(copies, ignore_index=True)
+
+
+def write_inputs(app_main, directory, scale):
+    import pandas as pd
+
+    df = enlarge(pd.read_excel(SAMPLE_INVENTORY_XLSX), scale)
+    paths = {extension: os.path.join(directory, f"inventory_{scale}x.{extension}")
+             for extension in ('xlsx', 'csv', 'parquet')}
+    df.to_excel(paths['xlsx'], index=False)
+    df.to_csv(paths['csv'], sep=';', index=False)
+    typed = df.apply(lambda column: column.astype(str).where(column.notna()) if column.dtype == object else column)
+    typed.to_parquet(paths['parquet'], index=False)
+    return len(df), paths
+
+
+def ingest(app_main, path):
+    with open(path, 'rb') as f:
+        df = app_main.read_inventory_file(f, path)
+    df = app_main.sort_inventory_by_key(df)
+    app_main.build_inventory_arrays(df)
+    app_main.build_inventory_text_index(df)
+    return df
+
+
+def peak_rss_kib():
+    # VmHWM is reset by exec; ru_maxrss would report the parent's peak inherited through fork
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_worker(path, engine, repeat):
+    app_main = import_app({"INVENTORY_EXCEL_ENGINE": engine} if engine else {})
+    rss_before = peak_rss_kib()
+    seconds, _ = best_of(repeat, ingest, app_main, path)
+    rss_peak = peak_rss_kib()
+    tracemalloc.start()
+    ingest(app_main, path)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(json.dumps({"seconds": seconds, "traced_mib": traced_peak / 2**20,
+                      "rss_peak_mib": rss_peak / 1024, "rss_growth_mib": (rss_peak - rss_before) / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--worker', nargs=2, metavar=('PATH', 'ENGINE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        path, engine = args.worker
+        return run_worker(path, engine if engine != '-' else None, args.repeat)
+
+    app_main = import_app()
+    if not app_main.calamine_installed:
+        print("python-calamine not installed: the calamine case is skipped")
+    print(f"{'rows':>8} {'format':>16} {'file MiB':>9} {'ingest s':>9} {'traced MiB':>11} {'RSS growth MiB':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            start = time.perf_counter()
+            rows, paths = write_inputs(app_main, tmp, scale)
+            print(f"# {scale}x inputs written in {time.perf_counter() - start:.1f}s")
+            for extension, engine in CASES:
+                if engine == 'calamine' and not app_main.calamine_installed:
+                    continue
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--repeat', str(args.repeat),
+                     '--worker', paths[extension], engine or '-'],
+                    check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                label = f"{extension}/{engine}" if engine else extension
+                print(f"{rows:>8} {label:>16} {os.path.getsize(paths[extension]) / 2**20:>9.1f} "
+                      f"{result['seconds']:>9.3f} {result['traced_mib']:>11.1f} {result['rss_growth_mib']:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
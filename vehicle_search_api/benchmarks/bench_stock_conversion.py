@@ -0,0 +1,36 @@
+"""
+Compares the per-cell stock conversion (convert_stock_row) with the column-wise
+StockColumnConverter on the documented test payload scaled to several row counts.
+
+    python benchmarks/bench_stock_conversion.py [--rows 1000 10000 50000] [--repeat 5]
+"""
+import argparse
+import json
+
+from common import TEST_PAYLOAD_JSON, best_of, import_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app_main = import_app()
+    with open(TEST_PAYLOAD_JSON, encoding='utf-8') as f:
+        payload = json.load(f)
+    fields = [app_main.stock_field_name(c) for c in payload['campos']]
+
+    print(f"{'rows':>8} {'per-cell s':>12} {'column-wise s':>14} {'speed-up':>9}")
+    for row_count in args.rows:
+        rows = [payload['datos'][i % len(payload['datos'])] for i in range(row_count)]
+
+        per_cell, expected = best_of(args.repeat, lambda: [app_main.convert_stock_row(row, fields) for row in rows])
+        column_wise, actual = best_of(args.repeat, lambda: app_main.StockColumnConverter(fields).convert(rows))
+        assert actual == expected, "column-wise conversion differs from convert_stock_row"
+
+        print(f"{row_count:>8} {per_cell:>12.4f} {column_wise:>14.4f} {per_cell / column_wise:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
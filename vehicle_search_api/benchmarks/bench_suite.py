@@ -0,0 +1,191 @@
+"""
+Runs the offline benchmark suite: POST /stock/ ingest, GET /cars/ searches, POST /inventory/upload/
+and GET /inventory/search/ on synthetic data (synthetic_data.py) of several sizes, against a local
+SQLite stand-in or a throwaway MySQL given with --database-url, and saves the timings as JSON.
+
+    python benchmarks/bench_suite.py [--rows 1000 10000 100000] [--repeat 3] [--searches 20]
+                                     [--database-url URL] [--data-dir DIR]
+                                     [--output FILE] [--baseline FILE] [--threshold 0.25]
+    python benchmarks/bench_suite.py --compare OLD.json NEW.json [--threshold 0.25]
+
+Ingest and upload timings are the best of --repeat pushes; search timings are the median of
+--searches requests per query, with the /cars/ result cache off. --baseline (or --compare)
+prints each timing against another run and exits with status 1 when any is more than
+--threshold slower. The suite replaces the whole vehicles_stock table: never point
+--database-url at a database whose stock matters.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+from sqlalchemy import MetaData, Table, Column
+from sqlalchemy.engine import make_url
+
+from bench_cars_concurrency import FILTERS as CARS_QUERIES
+from common import BENCH_API_KEY, REPO_DIR, best_of, import_app
+from synthetic_data import BENCH_DATA_DIR, dataset_paths
+
+INVENTORY_QUERIES = ["", "marca=peugeot", "version=gt", "combustible=diesel&cambio=automatico",
+                     "min_precio=15000&max_precio=30000", "min_kms=10000&max_kms=60000",
+                     "fecha_matriculacion_desde=2020&fecha_matriculacion_hasta=2023", "tienda=spoticar&tipo=ocasion"]
+
+
+def create_stock_table(app_main):
+    metadata = MetaData()
+    Table('vehicles_stock', metadata,
+          *[Column(name, type_) for name, type_ in app_main.VEHICLE_STOCK_SCHEMA.items()])
+    metadata.create_all(app_main.engine)
+    app_main.prepare_stock_database()
+
+
+def post_ok(client, url, **kwargs):
+    response = client.post(url, **kwargs)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def median_get(client, url, searches):
+    timings = []
+    for _ in range(searches):
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+    return statistics.median(timings)
+
+
+def run_size(client, stock_path, inventory_path, repeat, searches):
+    """Yields (benchmark, case, seconds) for one data size."""
+    with open(stock_path, 'rb') as f:
+        stock_body = f.read()
+    with open(inventory_path, 'rb') as f:
+        inventory_body = f.read()
+    headers = {"Content-Type": "application/json"}
+
+    seconds, _ = best_of(repeat, lambda: post_ok(client, "/stock/", content=stock_body, headers=headers))
+    yield "stock_ingest", "replace", seconds
+    for query in CARS_QUERIES:
+        yield "cars_search", query or "(none)", median_get(client, f"/cars/?{query}", searches)
+
+    files = {"file": (os.path.basename(inventory_path), inventory_body)}
+    seconds, _ = best_of(repeat, lambda: post_ok(client, "/inventory/upload/", files=files))
+    yield "inventory_upload", "xlsx", seconds
+    for query in INVENTORY_QUERIES:
+        yield "inventory_search", query or "(none)", median_get(client, f"/inventory/search/?{query}", searches)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result["benchmark"], result["case"], result["rows"]
+
+
+def compare(baseline, current, threshold):
+    """Prints current timings against the baseline's; returns the number of regressions."""
+    previous = {result_key(result): result["seconds"] for result in baseline["results"]}
+    print(f"\nagainst {baseline['meta'].get('git_commit')} ({baseline['meta'].get('created')})")
+    print(f"{'benchmark':<17} {'case':<62} {'rows':>7} {'before s':>9} {'now s':>9} {'change':>8}")
+    regressions = 0
+    for result in current["results"]:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        change = result["seconds"] / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{result['benchmark']:<17} {result['case']:<62} {result['rows']:>7} "
+              f"{before:>9.4f} {result['seconds']:>9.4f} {change:>+7.0%}{flag}")
+    print(f"{regressions} timing(s) more than {threshold:.0%} slower")
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--searches', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', help="SQLAlchemy URL of a throwaway database (default: a temporary SQLite file)")
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR,
+                        help="Where generated payloads and inventories are written and reused")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="Results file of an earlier run to compare against")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Only compare two results files")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Slowdown reported as a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(load_results(args.compare[0]), load_results(args.compare[1]), args.threshold) else 0)
+    if args.database_url and (make_url(args.database_url).host or '').endswith('.azure.com'):
+        sys.exit("Refusing to run against an Azure database: the suite replaces the whole stock table.")
+
+    created = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp:
+        app_main = import_app({
+            "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(tmp, 'vehicles.db')}",
+            "CARS_CACHE_SIZE": "0",
+            "INVENTORY_SNAPSHOT_DIR": "",
+            "REQUEST_LOG_SAMPLE_RATE": "0",
+            "LOG_LEVEL": "WARNING",
+        })
+        create_stock_table(app_main)
+        results = []
+        print(f"{'benchmark':<17} {'case':<62} {'rows':>7} {'seconds':>9}")
+        with TestClient(app_main.app, headers={"X-API-Key": BENCH_API_KEY}) as client:
+            for rows in args.rows:
+                stock_path, inventory_path = dataset_paths(args.data_dir, rows, args.seed)
+                for benchmark, case, seconds in run_size(client, stock_path, inventory_path,
+                                                         args.repeat, args.searches):
+                    results.append({"benchmark": benchmark, "case": case, "rows": rows, "seconds": seconds})
+                    print(f"{benchmark:<17} {case:<62} {rows:>7} {seconds:>9.4f}")
+        database = app_main.engine.dialect.name
+        app_main.engine.dispose()
+
+    run = {
+        "meta": {
+            "created": created.isoformat(timespec='seconds'),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": database,
+            "orjson": app_main.orjson is not None,
+            "excel_engine": app_main.INVENTORY_EXCEL_ENGINE,
+            "repeat": args.repeat,
+            "searches": args.searches,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         f"{created.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+    print(f"results written to {output}")
+    if args.baseline and compare(load_results(args.baseline), run, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
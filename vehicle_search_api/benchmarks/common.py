@@ -0,0 +1,43 @@
+"""Shared helpers for the offline benchmarks in this directory."""
+import importlib
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCHMARKS_DIR)
+REPO_DIR = os.path.dirname(API_DIR)
+TEST_PAYLOAD_JSON = os.path.join(REPO_DIR, 'documentation', 'test_payload.json')
+SAMPLE_INVENTORY_XLSX = os.path.join(REPO_DIR, 'tests', 'inventario.pro', 'stock_inventario.xlsx')
+
+BENCH_API_KEY = "bench-api-key"
+
+# Benchmarks never talk to the real Azure database: placeholder credentials only.
+OFFLINE_ENV = {
+    "API_KEY": BENCH_API_KEY,
+    "DB_HOST": "127.0.0.1",
+    "DB_PORT": "1",
+    "DB_USER": "offline",
+    "DB_PASSWORD": "offline",
+    "DB_NAME": "vehicles_db",
+}
+
+
+def import_app(extra_env=None):
+    """Imports app.main (as uvicorn does in the container) with offline settings."""
+    os.environ.update(OFFLINE_ENV)
+    os.environ.update(extra_env or {})
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    return importlib.import_module("app.main")
+
+
+def best_of(repeat, func, *args):
+    """Runs func `repeat` times and returns (best wall time in seconds, last result)."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
@@ -0,0 +1,147 @@
+"""
+Generates synthetic stock pushes and inventory files of any size for the offline benchmarks:
+`campos`/`datos` payloads modelled on documentation/test_payload.json and Excel inventories
+modelled on tests/inventario.pro/stock_inventario.xlsx. The same rows and seed always give
+the same data.
+
+    python benchmarks/synthetic_data.py [--rows 1000 10000 100000] [--seed 0] [--out DIR]
+
+Files go to a vehicle_search_api_bench_data directory under the system temp dir by default,
+where bench_suite.py looks for them, so nothing large is written inside the repository.
+
+Stock rows cycle through the sample rows (so makes, models and descriptions stay real) with
+unique ficha_id, VIN, plate and stock id, and random store, condition, registration date,
+kilometres, price and colour. Inventory rows are drawn from the sample inventory with unique
+Adid, VIN and plate, and random kilometres, prices and registration month.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+
+from common import SAMPLE_INVENTORY_XLSX, TEST_PAYLOAD_JSON
+
+STOCK_TIENDAS = ('A1', 'A2', 'M1', 'M2', 'S1', 'J1')
+STOCK_COLORS = ('Blanco Fuji', 'Santorini Black', 'Eiger Grey', 'Seoul Pearl Silver', 'Plata Mojave metalizado',
+                'Azul Portofino', 'Rojo Firenze', 'Gris Carpathian', 'Negro Obsidiana', 'Blanco Polar')
+VIN_CHARACTERS = ''.join(c for c in string.ascii_uppercase + string.digits if c not in 'IOQ')
+PLATE_LETTERS = 'BCDFGHJKLMNPRSTVWXYZ'  # Spanish plates use consonants only
+FIRST_FICHA_ID = 600000
+FIRST_ADID = 3000000
+BENCH_DATA_DIR = os.path.join(tempfile.gettempdir(), 'vehicle_search_api_bench_data')
+
+
+def plate(i):
+    """A unique Spanish-style plate (4 digits and 3 consonants) for each i below 80 million."""
+    letters = ''
+    n = i // 10000
+    for _ in range(3):
+        n, digit = divmod(n, len(PLATE_LETTERS))
+        letters = PLATE_LETTERS[digit] + letters
+    return f"{i % 10000:04d}{letters}"
+
+
+def vin(rng, i, wmi):
+    """A unique 17-character VIN: manufacturer code, six random characters and the serial i."""
+    return wmi[:3] + ''.join(rng.choice(VIN_CHARACTERS) for _ in range(6)) + f"{i:08d}"
+
+
+def stock_payload(rows, seed=0):
+    """A /stock/ body of `rows` vehicles with the sample's `campos`."""
+    with open(TEST_PAYLOAD_JSON, encoding='utf-8') as f:
+        sample = json.load(f)
+    fields = [campo[0] if isinstance(campo, (list, tuple)) else campo for campo in sample['campos']]
+    column = {name: index for index, name in enumerate(fields)}
+    rng = random.Random(seed)
+    datos = []
+    for i in range(rows):
+        row = list(sample['datos'][i % len(sample['datos'])])
+        tienda = rng.choice(STOCK_TIENDAS)
+        new = rng.random() < 0.6
+        estado = f"Stock {tienda} {'NEW' if new else 'VO'}"
+        year = rng.randint(2024, 2025) if new else rng.randint(2015, 2024)
+        kms = 0 if new else rng.randint(5000, 150000)
+        price = round(rng.uniform(15000, 160000), 2)
+        values = {
+            'ficha_id': FIRST_FICHA_ID + i,
+            'workflow_estado': estado,
+            'workflow_subestado': estado,
+            'vin': vin(rng, i, row[column['vin']] or 'VSS'),
+            'matricula': plate(i),
+            'vehicle_stock_id': f"{tienda}-{'N' if new else 'O'}{i}",
+            'fecha_matriculacion': f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 00:00:00",
+            'kms': kms,
+            'kms_vehiculo': kms,
+            'pvp_api': price,
+            'grossvalue': round(price * 1.21, 2),
+            'pvp': f"{price * 1.21:.2f}",
+            'color': rng.choice(STOCK_COLORS),
+        }
+        for name, value in values.items():
+            if name in column:
+                row[column[name]] = value
+        datos.append(row)
+    return {'campos': sample['campos'], 'datos': datos}
+
+
+def inventory_frame(rows, seed=0):
+    """An inventory DataFrame of `rows` vehicles with the sample inventory's columns."""
+    import numpy as np
+    import pandas as pd
+
+    sample = pd.read_excel(SAMPLE_INVENTORY_XLSX)
+    np_rng = np.random.default_rng(seed)
+    rng = random.Random(seed)
+    df = sample.iloc[np_rng.integers(0, len(sample), rows)].reset_index(drop=True)
+    df['Adid'] = FIRST_ADID + np.arange(rows)
+    df['Kms'] = (df['Kms'] * np_rng.uniform(0.5, 1.5, rows)).round().astype('int64')
+    for name in ('Precio', 'Precio financiado'):
+        prices = pd.to_numeric(df[name].str.replace(',', '.'), errors='coerce') * np_rng.uniform(0.8, 1.2, rows)
+        df[name] = [f"{price:.0f},00" if pd.notna(price) else None for price in prices]
+    df['Matrícula'] = [plate(i) for i in range(rows)]
+    df['Bastidor'] = [vin(rng, i, str(wmi) if isinstance(wmi, str) else 'VR3') for i, wmi in enumerate(df['Bastidor'])]
+    df['Fecha de Matriculación'] = [f"{month}/{year}" for month, year
+                                    in zip(np_rng.integers(1, 13, rows), np_rng.integers(2015, 2026, rows))]
+    return df
+
+
+def write_stock_payload(path, rows, seed=0):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stock_payload(rows, seed), f, ensure_ascii=False)
+    return path
+
+
+def write_inventory_xlsx(path, rows, seed=0):
+    inventory_frame(rows, seed).to_excel(path, index=False)
+    return path
+
+
+def dataset_paths(directory, rows, seed=0):
+    """Writes (once) and returns the stock payload and inventory paths for `rows` in `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    stock = os.path.join(directory, f"stock_{rows}_seed{seed}.json")
+    inventory = os.path.join(directory, f"inventory_{rows}_seed{seed}.xlsx")
+    if not os.path.exists(stock):
+        write_stock_payload(stock + '.tmp', rows, seed)
+        os.replace(stock + '.tmp', stock)
+    if not os.path.exists(inventory):
+        write_inventory_xlsx(inventory + '.tmp.xlsx', rows, seed)
+        os.replace(inventory + '.tmp.xlsx', inventory)
+    return stock, inventory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=BENCH_DATA_DIR)
+    args = parser.parse_args()
+    for rows in args.rows:
+        for path in dataset_paths(args.out, rows, args.seed):
+            print(f"{path} {os.path.getsize(path) / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
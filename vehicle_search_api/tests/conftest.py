@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import importlib
+
+import pytest
+
+# Make the `app` package importable the same way uvicorn does inside the container (app.main:app)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+PAYLOAD_PATH = os.path.join(os.path.dirname(__file__), '../../documentation/test_payload.json')
+
+SAMPLE_INVENTORY_XLSX = os.path.join(os.path.dirname(__file__), '../../tests/inventario.pro/stock_inventario.xlsx')
+
+TEST_API_KEY = "test-api-key"
+
+# Placeholder settings for offline tests. The host is unroutable on purpose:
+# nothing in these tests may talk to the real Azure database.
+OFFLINE_ENV = {
+    "API_KEY": TEST_API_KEY,
+    "DB_HOST": "127.0.0.1",
+    "DB_PORT": "1",
+    "DB_USER": "offline",
+    "DB_PASSWORD": "offline",
+    "DB_NAME": "vehicles_db",
+}
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    """Imports app.main with offline settings, restoring the environment afterwards."""
+    saved = {key: os.environ.get(key) for key in OFFLINE_ENV}
+    os.environ.update(OFFLINE_ENV)
+    try:
+        module = importlib.import_module("app.main")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module
+
+
+@pytest.fixture
+def stock_db(main_module, tmp_path, monkeypatch):
+    """Points the app at a throwaway SQLite vehicles_stock table instead of Azure MySQL."""
+    from sqlalchemy import MetaData, Table, Column
+
+    engine = main_module.create_database_engine(f"sqlite:///{tmp_path / 'vehicles.db'}")
+    metadata = MetaData()
+    Table('vehicles_stock', metadata,
+          *[Column(name, type_) for name, type_ in main_module.VEHICLE_STOCK_SCHEMA.items()])
+    metadata.create_all(engine)
+    monkeypatch.setattr(main_module, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def client(main_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main_module.app, headers={"X-API-Key": TEST_API_KEY}) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def loaded_stock(stock_db, client):
+    """Pushes the documented sample payload through /stock/ and returns its rows as dicts."""
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        payload = json.load(f)
+    campos = [c[0] for c in payload['campos']]
+    # /stock/ parses "YYYY-MM-DD HH:MM:SS" dates; the sample file uses ISO "T" separators
+    fecha = campos.index('fecha_matriculacion')
+    for row in payload['datos']:
+        if row[fecha]:
+            row[fecha] = row[fecha].replace('T', ' ')
+    assert client.post("/stock/", json=payload).status_code == 200
+    return [dict(zip(campos, row)) for row in payload['datos']]
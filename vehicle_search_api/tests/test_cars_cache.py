@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from conftest import PAYLOAD_PATH
+
+
+@pytest.fixture
+def cars_cache(main_module, monkeypatch):
+    cache = main_module.CarsResultCache(max_entries=2, ttl_seconds=60)
+    monkeypatch.setattr(main_module, "cars_result_cache", cache)
+    return cache
+
+
+def count_queries(engine):
+    from sqlalchemy import event
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_repeated_filters_are_served_from_cache(stock_db, loaded_stock, client, cars_cache):
+    statements = count_queries(stock_db)
+    first = client.get("/cars/?marca=Land&limit=5").json()
+    assert statements
+
+    statements.clear()
+    assert client.get("/cars/?limit=5&marca=%20land").json() == first
+    # Only the stock version is read
+    assert len(statements) == 1 and "vehicles_stock_version" in statements[0]
+    stats = client.get("/cars/cache/").json()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_stock_push_invalidates_cached_results(stock_db, loaded_stock, client, cars_cache):
+    assert client.get("/cars/?marca=porsche").json() == []
+
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        payload = json.load(f)
+    payload['datos'][0][[c[0] for c in payload['campos']].index('marca')] = 'PORSCHE'
+    client.post("/stock/", json=payload)
+
+    assert [car['marca'] for car in client.get("/cars/?marca=porsche").json()] == ['PORSCHE']
+    assert cars_cache.stats()["invalidations"] == 1
+
+
+def test_changes_committed_by_other_processes_invalidate_cached_results(main_module, stock_db, loaded_stock,
+                                                                        client, cars_cache):
+    assert client.get("/cars/?color=amarillo").json() == []
+
+    # Another worker's push or a sync: new rows and a bumped version row, nothing in this process
+    with stock_db.begin() as connection:
+        connection.execute(text("UPDATE vehicles_stock SET color = 'Amarillo' "
+                                "WHERE ficha_id = (SELECT MIN(ficha_id) FROM vehicles_stock)"))
+        main_module.bump_stock_version(connection)
+
+    assert [car['color'] for car in client.get("/cars/?color=amarillo").json()] == ['Amarillo']
+    assert cars_cache.stats()["invalidations"] == 1
+
+
+def test_results_read_at_an_older_version_are_not_cached(main_module, cars_cache):
+    key = main_module.cars_cache_key(make="a")
+    cars_cache.put(key, (main_module.engine, 2), [{"marca": "new"}])
+    cars_cache.put(key, (main_module.engine, 1), [{"marca": "old"}])
+    assert cars_cache.get(key, (main_module.engine, 1)) is None
+    assert cars_cache.get(key, (main_module.engine, 2)) == [{"marca": "new"}]
+    assert cars_cache.get(key, None) is None
+
+
+def test_least_recently_used_entry_is_evicted(main_module, cars_cache):
+    version = (main_module.engine, 0)
+    for make in ("a", "b", "c"):
+        cars_cache.put(main_module.cars_cache_key(make=make), version, [{"marca": make}])
+    assert cars_cache.get(main_module.cars_cache_key(make="a"), version) is None
+    assert cars_cache.get(main_module.cars_cache_key(make="c"), version) == [{"marca": "c"}]
+    assert cars_cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_not_served(main_module):
+    cache = main_module.CarsResultCache(max_entries=2, ttl_seconds=0)
+    key = main_module.cars_cache_key(make="a")
+    cache.put(key, (main_module.engine, 0), [])
+    assert cache.get(key, (main_module.engine, 0)) is None
+    assert cache.stats()["expirations"] == 1
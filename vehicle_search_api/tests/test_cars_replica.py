@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from conftest import PAYLOAD_PATH
+from test_cars_cache import count_queries
+
+
+@pytest.fixture
+def use_replica(main_module, monkeypatch):
+    monkeypatch.setattr(main_module, "cars_result_cache", main_module.CarsResultCache(0, 0))
+    monkeypatch.setattr(main_module, "cars_replica", None)
+
+    def enable():
+        monkeypatch.setattr(main_module, "CARS_READ_REPLICA", True)
+    return enable
+
+
+def fetch(client, query):
+    response = client.get(f"/cars/?{query}")
+    assert response.status_code == 200, response.text
+    return response.json(), response.headers.get("X-Next-Cursor"), response.headers.get("X-Total-Count")
+
+
+@pytest.mark.parametrize("query", [
+    "", "marca=land", "marca=LAND&year=2024", "marca=zzz", "modelo=evoque", "modelo=.", "color=black",
+    "tipo_transmision=man", "tienda=m1&vo_vn=new", "tienda=a1", "min_price=20000&max_price=60000",
+    "max_kms=0", "vin=W1KAF0DB3RR231262", "year=2014&include_total=true", "year=9999", "year=-5",
+    "limit=3&include_total=true", "marca=land&limit=2",
+])
+def test_replica_matches_database_results(client, loaded_stock, use_replica, query):
+    expected = fetch(client, query)
+    use_replica()
+    assert fetch(client, query) == expected
+
+
+def test_replica_pages_follow_the_database_cursor(client, loaded_stock, use_replica):
+    first_page = fetch(client, "limit=4&include_total=true")
+    second_page = fetch(client, f"limit=4&include_total=true&cursor={first_page[1]}")
+    use_replica()
+    assert fetch(client, "limit=4&include_total=true") == first_page
+    assert fetch(client, f"limit=4&include_total=true&cursor={first_page[1]}") == second_page
+
+
+def test_replica_serves_searches_without_queries(main_module, stock_db, client, loaded_stock, use_replica):
+    use_replica()
+    fetch(client, "marca=land")
+    statements = count_queries(stock_db)
+    fetch(client, "tipo_transmision=auto&year=2024")
+    assert client.get("/cars/?format=ndjson&marca=land").status_code == 200
+    assert statements == []
+
+
+def test_stock_push_reloads_the_replica(main_module, client, loaded_stock, use_replica):
+    use_replica()
+    assert fetch(client, "marca=porsche")[0] == []
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        payload = json.load(f)
+    payload['datos'][0][[c[0] for c in payload['campos']].index('marca')] = 'PORSCHE'
+    client.post("/stock/", json=payload)
+    assert [car['marca'] for car in fetch(client, "marca=porsche")[0]] == ['PORSCHE']
+
+
+def test_replica_stream_matches_default_response(client, loaded_stock, use_replica):
+    use_replica()
+    expected = client.get("/cars/?tienda=m1&include_total=true")
+    streamed = client.get("/cars/?tienda=m1&include_total=true&format=ndjson")
+    assert [json.loads(line) for line in streamed.text.splitlines()] == expected.json()
+    assert streamed.headers["X-Total-Count"] == expected.headers["X-Total-Count"]
+
+
+def test_replica_folds_case_and_accents(main_module):
+    from datetime import datetime
+
+    row = {field: None for field in main_module.Vehicle.model_fields}
+    row.update(ficha_id=1, modelo_efectivo="Clase C", marca_efectiva="Citroën", marca="Citroën", marca_inv=None,
+               modelo="Clase C", modelo_inv=None, color="Azul Océano", fecha_matriculacion=datetime(2024, 5, 1))
+    replica = main_module.CarsReplica([row], (None, 0))
+    assert replica.match(make="CITROEN").tolist() == [0]
+    assert replica.match(color="oceano", year=2024).tolist() == [0]
+    assert replica.match(model="c.c").tolist() == []
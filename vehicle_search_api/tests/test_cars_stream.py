@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("query", ["", "marca=land&limit=3", "tienda=m1&include_total=true"])
+def test_streamed_formats_match_default_response(client, loaded_stock, query):
+    expected = client.get(f"/cars/?{query}")
+
+    as_array = client.get(f"/cars/?{query}&format=json")
+    assert as_array.headers["content-type"] == "application/json"
+    assert as_array.json() == expected.json()
+
+    ndjson = client.get(f"/cars/?{query}&format=ndjson")
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in ndjson.text.splitlines()] == expected.json()
+    assert ndjson.headers.get("X-Total-Count") == expected.headers.get("X-Total-Count")
+
+
+def test_streamed_rows_are_read_in_batches(main_module, client, loaded_stock, monkeypatch):
+    monkeypatch.setattr(main_module, "CARS_STREAM_BATCH_SIZE", 3)
+    chunks = list(main_module.iter_cars_chunks({}, 100, None, 'json'))
+    assert chunks[0] == b'[' and chunks[-1] == b']'
+    assert len(chunks) == 2 + -(-len(loaded_stock) // 3)
+    assert len(json.loads(b''.join(chunks))) == len(loaded_stock)
+
+
+def test_stream_without_orjson(main_module, client, loaded_stock, monkeypatch):
+    expected = client.get("/cars/?format=json").json()
+    monkeypatch.setattr(main_module, "orjson", None)
+    assert client.get("/cars/?format=json").json() == expected
+
+
+def test_unknown_format_is_rejected(client, loaded_stock):
+    assert client.get("/cars/?format=xml").status_code == 422
@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+@pytest.fixture
+def pooled_engine(main_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(main_module, "pool_metrics", main_module.PoolMetrics())
+    engine = main_module.create_database_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        pool_size=1, max_overflow=1, pool_recycle=1800, pool_pre_ping=True, pool_timeout=0.05)
+    monkeypatch.setattr(main_module, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_pool_stats_report_checkouts_and_idle_connections(main_module, pooled_engine, client):
+    before = client.get("/db/pool/").json()
+    with pooled_engine.connect() as first, pooled_engine.connect() as second:
+        first.execute(text("SELECT 1"))
+        second.execute(text("SELECT 1"))
+        busy = client.get("/db/pool/").json()
+    idle = client.get("/db/pool/").json()
+
+    assert busy["checked_out"] == 2 and busy["overflow"] == 1
+    assert idle["checked_out"] == 0 and idle["idle"] == 1
+    assert idle["connections_created"] == 2
+    assert idle["checkouts"] - before["checkouts"] == 2
+    assert idle["wait_count"] - before["wait_count"] == 2
+    assert idle["wait_seconds_max"] >= idle["wait_seconds_avg"] >= 0
+
+
+def test_pool_exhaustion_is_counted(main_module, pooled_engine):
+    with pooled_engine.connect(), pooled_engine.connect():
+        with pytest.raises(PoolTimeoutError):
+            pooled_engine.connect()
+    stats = main_module.pool_metrics.stats(pooled_engine.pool)
+    assert stats["checkout_timeouts"] == 1
+    assert stats["wait_seconds_max"] >= 0.05
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from sqlalchemy import event
+
+from conftest import TEST_API_KEY
+
+
+class QueryConcurrency:
+    """Slows every query on `engine` by `seconds` and records how many ran at the same time."""
+
+    def __init__(self, engine, seconds):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        event.listen(engine, "before_cursor_execute", self.before)
+        event.listen(engine, "after_cursor_execute", self.after)
+
+    def before(self, *args):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.seconds)
+
+    def after(self, *args):
+        with self.lock:
+            self.running -= 1
+
+
+async def get_concurrently(app, urls):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"X-API-Key": TEST_API_KEY}) as client:
+        return await asyncio.gather(*[client.get(url) for url in urls])
+
+
+def test_cars_queries_overlap(main_module, stock_db, loaded_stock, monkeypatch):
+    monkeypatch.setattr(main_module, "cars_result_cache", main_module.CarsResultCache(0, 0))
+    queries = QueryConcurrency(stock_db, 0.2)
+
+    responses = asyncio.run(get_concurrently(main_module.app, [f"/cars/?limit={n}" for n in range(1, 9)]))
+
+    assert [len(r.json()) for r in responses] == list(range(1, 9))
+    # Served one at a time there would never be more than one query running
+    assert queries.max_running > 1
+
+
+def test_threadpool_size_bounds_concurrent_queries(main_module, stock_db, loaded_stock, monkeypatch):
+    monkeypatch.setattr(main_module, "cars_result_cache", main_module.CarsResultCache(0, 0))
+    monkeypatch.setattr(main_module, "db_thread_limiter", None)
+    monkeypatch.setattr(main_module, "DB_THREADPOOL_SIZE", 2)
+    queries = QueryConcurrency(stock_db, 0.1)
+
+    asyncio.run(get_concurrently(main_module.app, [f"/cars/?limit={n}" for n in range(1, 5)]))
+    assert queries.max_running == 2
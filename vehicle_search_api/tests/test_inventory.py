@@ -0,0 +1,209 @@
+import asyncio
+import io
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import SAMPLE_INVENTORY_XLSX, TEST_API_KEY
+
+SEARCH_DEFAULTS = dict(
+    marca=None, version=None, min_kms=None, max_kms=None, min_precio=None, max_precio=None,
+    min_precio_financiado=None, max_precio_financiado=None, matricula=None, carroceria=None,
+    combustible=None, fecha_matriculacion_desde=None, fecha_matriculacion_hasta=None, color=None,
+    cambio=None, tipo=None, estado=None, tienda=None, limit=1000, cursor=None,
+)
+FACET_DEFAULTS = {name: None for name in SEARCH_DEFAULTS if name not in ("limit", "cursor")}
+
+
+def search(main, **filters):
+    params = dict(SEARCH_DEFAULTS)
+    params.update(filters)
+    return asyncio.run(main.search_inventory_vehicles(**params))
+
+
+def upload(main, content, filename):
+    """Posts a file to /inventory/upload/ and returns the response."""
+    with TestClient(main.app, headers={"X-API-Key": TEST_API_KEY}) as client:
+        return client.post("/inventory/upload/", files={"file": (filename, content)})
+
+
+@pytest.fixture(scope="module")
+def inventory(main_module):
+    with open(SAMPLE_INVENTORY_XLSX, "rb") as f:
+        assert upload(main_module, f.read(), "stock_inventario.xlsx").status_code == 200
+    return main_module.inventory_data
+
+
+@pytest.fixture
+def restore_inventory(main_module, inventory, monkeypatch):
+    for name in ("inventory_data", "inventory_arrays", "inventory_text_index", "inventory_facets",
+                 "inventory_upload_time"):
+        monkeypatch.setattr(main_module, name, getattr(main_module, name))
+
+
+def test_upload_builds_typed_arrays(main_module, inventory):
+    arrays = main_module.inventory_arrays
+    assert arrays['Kms'].dtype == 'float64'
+    assert arrays['Precio'].dtype == 'float64'
+    assert arrays['Precio financiado'].dtype == 'float64'
+    assert arrays['Fecha de Matriculación'].dtype == 'datetime64[ns]'
+    assert len(arrays['Precio']) == len(inventory)
+
+
+def test_numeric_and_date_ranges_match_pandas(main_module, inventory):
+    response = search(main_module, min_precio=15000, max_precio=25000, min_kms=10000,
+                      fecha_matriculacion_desde="2021", fecha_matriculacion_hasta="6/2023")
+
+    precio = pd.to_numeric(inventory['Precio'].astype(str).str.replace(',', '.'), errors='coerce')
+    fecha = pd.to_datetime(inventory['Fecha de Matriculación'], format='%m/%Y', errors='coerce')
+    expected = inventory[
+        (precio >= 15000) & (precio <= 25000) & (inventory['Kms'] >= 10000)
+        & (fecha >= pd.Timestamp(2021, 1, 1)) & (fecha <= pd.Timestamp(2023, 6, 1))
+    ]
+    assert response["total_found"] > 0
+    assert [row['Adid'] for row in response["results"]] == expected['Adid'].tolist()
+
+
+def test_invalid_date_bound_is_ignored(main_module, inventory):
+    response = search(main_module, fecha_matriculacion_desde="not-a-date", limit=5)
+    assert response["total_found"] == 5
+
+
+@pytest.mark.parametrize("filters", [
+    {"marca": "peu"},
+    {"marca": "CITRO", "cambio": "auto"},
+    {"version": "al", "combustible": "dies"},
+    {"matricula": "M", "color": "gris"},
+    {"marca": "Peugeot|Citroen"},
+    {"tipo": "ocasión", "estado": "venta", "carroceria": "zzz"},
+])
+def test_text_filters_match_str_contains(main_module, inventory, filters):
+    columns = {"marca": "Marca", "version": "Versión", "matricula": "Matrícula", "carroceria": "Carroceria",
+               "combustible": "Combustible", "color": "Color", "cambio": "Cambio", "tipo": "Tipo", "estado": "Estado"}
+    expected = pd.Series(True, index=inventory.index)
+    for name, value in filters.items():
+        expected &= inventory[columns[name]].str.contains(value, case=False, na=False)
+
+    response = search(main_module, **filters)
+    assert [row['Adid'] for row in response["results"]] == inventory.loc[expected, 'Adid'].tolist()
+
+
+def test_tienda_is_exact_case_insensitive_match(main_module, inventory):
+    tienda = inventory['Tienda'].iloc[0]
+    response = search(main_module, tienda=tienda.upper())
+    assert response["total_found"] == min(1000, int((inventory['Tienda'] == tienda).sum()))
+    assert search(main_module, tienda=tienda[:5])["total_found"] == 0
+
+
+def test_cursor_pages_through_all_matches_in_adid_order(main_module, inventory):
+    filters = {"marca": "peu"}
+    expected = inventory.loc[inventory['Marca'].str.contains('peu', case=False, na=False), 'Adid'].tolist()
+    assert expected == sorted(expected)
+
+    seen, cursor = [], None
+    while True:
+        response = search(main_module, limit=7, cursor=cursor, **filters)
+        assert response["total_count"] == len(expected)
+        seen.extend(row['Adid'] for row in response["results"])
+        cursor = response["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_upload_orders_rows_by_adid(main_module):
+    df = pd.DataFrame({'Adid': [30, 10, 20], 'Marca': ['C', 'A', 'B']})
+    assert main_module.sort_inventory_by_key(df)['Marca'].tolist() == ['A', 'B', 'C']
+    duplicated = pd.DataFrame({'Adid': [2, 1, 1], 'Marca': ['C', 'A', 'B']})
+    assert main_module.sort_inventory_by_key(duplicated) is duplicated
+
+
+def test_malformed_cursor_is_rejected(main_module, inventory):
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as error:
+        search(main_module, cursor="not-a-cursor")
+    assert error.value.status_code == 400
+
+
+def csv_export(df, sep):
+    return df.to_csv(sep=sep, index=False).encode('utf-8-sig')
+
+
+def parquet_export(df):
+    # Columns mixing numbers and text (e.g. Modelo) are typed as text in a Parquet export
+    typed = df.apply(lambda column: column.astype(str).where(column.notna()) if column.dtype == object else column)
+    return typed.to_parquet(index=False)
+
+
+@pytest.mark.parametrize("filename, export", [
+    ("stock.csv", lambda df: csv_export(df, ';')),
+    ("stock.CSV", lambda df: csv_export(df, ',')),
+    ("stock.parquet", parquet_export),
+])
+def test_csv_and_parquet_uploads_match_excel(main_module, inventory, restore_inventory, filename, export):
+    queries = [{"marca": "peu", "cambio": "auto"}, {"min_precio": 15000, "max_kms": 60000},
+               {"fecha_matriculacion_desde": "2021", "version": "al"}, {"tienda": inventory['Tienda'].iloc[0]},
+               {"version": "1.5"}, {"matricula": "47"}, {}]
+    with open(SAMPLE_INVENTORY_XLSX, "rb") as f:
+        excel_response = upload(main_module, f.read(), "stock_inventario.xlsx").json()
+    expected = [search(main_module, **query)["results"] for query in queries]
+
+    response = upload(main_module, export(inventory), filename).json()
+    assert response["message"] == excel_response["message"] == "Inventory Excel file uploaded successfully"
+    assert response["statistics"] == excel_response["statistics"]
+    # Whole rows, cell types included (e.g. a Modelo of 2008 stays a number)
+    assert [search(main_module, **query)["results"] for query in queries] == expected
+
+
+def excel_export(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("filename, export", [
+    ("empty.csv", lambda df: csv_export(df.head(0), ';')),
+    ("empty.xlsx", lambda df: excel_export(df.head(0))),
+])
+def test_header_only_uploads_are_accepted(main_module, inventory, restore_inventory, filename, export):
+    response = upload(main_module, export(inventory), filename).json()
+    assert response["statistics"]["total_records"] == 0
+    assert response["statistics"]["columns"] == list(inventory.columns)
+
+
+def test_excel_text_cells_keep_surrounding_whitespace(main_module, inventory):
+    # The default openpyxl reader keeps cells verbatim; calamine (opt-in) would trim them
+    expected = pd.read_excel(SAMPLE_INVENTORY_XLSX, engine="openpyxl").sort_values("Adid", kind="stable")
+    expected = main_module.arrow_compatible_inventory(expected)
+    for column in ("Versión", "Matrícula"):
+        assert inventory[column].tolist() == expected[column].tolist()
+
+
+def test_unsupported_upload_format_is_rejected(main_module):
+    assert upload(main_module, b"Adid;Marca", "stock.txt").status_code == 400
+
+
+def test_precomputed_facets_match_value_counts(main_module, inventory):
+    info = asyncio.run(main_module.get_inventory_info())["statistics"]
+    assert info["top_brands"] == inventory['Marca'].value_counts().head(10).to_dict()
+
+    facets = asyncio.run(main_module.get_inventory_facets(**FACET_DEFAULTS))
+    assert facets["total_count"] == len(inventory)
+    for column in main_module.INVENTORY_FACET_COLUMNS:
+        assert facets["facets"][column] == inventory[column].value_counts().to_dict()
+
+
+def test_facets_of_a_filtered_subset(main_module, inventory):
+    filters = dict(FACET_DEFAULTS, marca="peu", max_kms=80000)
+    facets = asyncio.run(main_module.get_inventory_facets(**filters))
+    subset = inventory[inventory['Marca'].str.contains('peu', case=False, na=False) & (inventory['Kms'] <= 80000)]
+
+    assert facets["total_count"] == len(subset)
+    assert facets["facets"]["Cambio"] == subset['Cambio'].value_counts().to_dict()
+    kms = facets["histograms"]["Kms"]
+    assert sum(bucket["count"] for bucket in kms) == subset['Kms'].notna().sum()
+    for bucket in kms:
+        in_bucket = (subset['Kms'] >= bucket["from"]) & (subset['Kms'] < bucket["to"])
+        assert bucket["count"] == in_bucket.sum()
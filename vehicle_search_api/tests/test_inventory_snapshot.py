@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import SAMPLE_INVENTORY_XLSX
+from test_inventory import search, upload
+
+
+@pytest.fixture
+def snapshot_dir(main_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(main_module, "INVENTORY_SNAPSHOT_DIR", str(tmp_path))
+    for name in ("inventory_data", "inventory_arrays", "inventory_text_index", "inventory_facets",
+                 "inventory_upload_time", "inventory_snapshot_version"):
+        monkeypatch.setattr(main_module, name, getattr(main_module, name))
+    return tmp_path
+
+
+def sample_upload(main_module):
+    with open(SAMPLE_INVENTORY_XLSX, "rb") as f:
+        assert upload(main_module, f.read(), "stock_inventario.xlsx").status_code == 200
+
+
+def start_other_worker(main_module):
+    """Forgets the in-process inventory, as a worker that did not receive the upload."""
+    main_module.inventory_data = None
+    main_module.inventory_arrays = {}
+    main_module.inventory_text_index = {}
+    main_module.inventory_facets = None
+    main_module.inventory_upload_time = None
+    main_module.inventory_snapshot_version = None
+
+
+def test_upload_publishes_a_snapshot_other_workers_load(main_module, snapshot_dir):
+    sample_upload(main_module)
+    version = (snapshot_dir / "CURRENT").read_text()
+    assert (snapshot_dir / version).exists()
+    expected = search(main_module, marca="peu", min_precio=15000)
+    uploaded = main_module.inventory_data
+
+    start_other_worker(main_module)
+    assert search(main_module, marca="peu", min_precio=15000) == expected
+    assert main_module.inventory_snapshot_version == version
+    pd.testing.assert_frame_equal(main_module.inventory_data, uploaded)
+    assert asyncio.run(main_module.get_inventory_info())["snapshot_version"] == version
+
+
+def test_restart_serves_the_last_snapshot(main_module, snapshot_dir):
+    sample_upload(main_module)
+    start_other_worker(main_module)
+    info = asyncio.run(main_module.get_inventory_info())
+    assert info["data_loaded"] and info["statistics"]["total_records"] > 0
+
+
+def test_newer_snapshot_replaces_the_loaded_one(main_module, snapshot_dir):
+    sample_upload(main_module)
+    first = main_module.inventory_snapshot_version
+    smaller = main_module.inventory_data.head(10)
+    for _ in range(2):
+        assert upload(main_module, smaller.to_parquet(index=False), "stock.parquet").status_code == 200
+
+    assert search(main_module)["total_found"] == 10
+    snapshots = sorted(name for name in os.listdir(snapshot_dir) if name.endswith(".arrow"))
+    assert first not in snapshots
+    assert len(snapshots) == main_module.INVENTORY_SNAPSHOTS_KEPT
+
+
+def test_mixed_columns_are_stored_as_text(main_module):
+    df = pd.DataFrame({"Modelo": [2008, "Boxer", None], "Kms": [1, 2, 3]})
+    converted = main_module.arrow_compatible_inventory(df)
+    assert converted["Modelo"].tolist()[:2] == ["2008", "Boxer"] and pd.isna(converted["Modelo"].iloc[2])
+    assert converted["Kms"].tolist() == [1, 2, 3]
+
+
+def test_cell_types_do_not_depend_on_snapshots(main_module, snapshot_dir, monkeypatch):
+    sample_upload(main_module)
+    with_snapshots = search(main_module, marca="peu")
+
+    monkeypatch.setattr(main_module, "INVENTORY_SNAPSHOT_DIR", "")
+    sample_upload(main_module)
+    assert search(main_module, marca="peu") == with_snapshots
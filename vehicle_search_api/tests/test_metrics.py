@@ -0,0 +1,96 @@
+import re
+
+from conftest import SAMPLE_INVENTORY_XLSX
+
+SAMPLE_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def scrape(client):
+    """GET /metrics parsed into {(name, frozenset of label pairs): value}."""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, labels, value = SAMPLE_LINE.match(line).groups()
+        pairs = frozenset(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ""))
+        samples[(name, pairs)] = float(value.replace("+Inf", "inf"))
+    return samples
+
+
+def sample(samples, name, **labels):
+    return samples.get((name, frozenset(labels.items())), 0.0)
+
+
+def test_metrics_requires_api_key(main_module, client):
+    assert client.get("/metrics", headers={"X-API-Key": "wrong"}).status_code == 403
+
+
+def test_request_durations_are_recorded_per_route_and_status(main_module, stock_db, client):
+    before = scrape(client)
+    client.get("/cars/?marca=land")
+    client.get("/cars/?limit=0")
+    after = scrape(client)
+    ok = {"method": "GET", "route": "/cars/", "status": "200"}
+    invalid = {"method": "GET", "route": "/cars/", "status": "422"}
+    assert sample(after, "http_request_duration_seconds_count", **ok) == sample(before, "http_request_duration_seconds_count", **ok) + 1
+    assert sample(after, "http_request_duration_seconds_count", **invalid) == sample(before, "http_request_duration_seconds_count", **invalid) + 1
+    assert sample(after, "http_request_duration_seconds_bucket", le="+Inf", **ok) == sample(after, "http_request_duration_seconds_count", **ok)
+
+
+def test_cars_phases_and_rows_are_recorded(main_module, loaded_stock, client, monkeypatch):
+    monkeypatch.setattr(main_module, "cars_result_cache", main_module.CarsResultCache(8, 60))
+    before = scrape(client)
+    returned = len(client.get("/cars/?limit=5").json())
+    client.get("/cars/?limit=5")
+    streamed = client.get("/cars/?limit=7&format=ndjson").text.count("\n")
+    after = scrape(client)
+
+    def delta(name, **labels):
+        return sample(after, name, **labels) - sample(before, name, **labels)
+
+    for phase in ("db_execute", "row_processing", "encoding"):
+        assert delta("cars_phase_duration_seconds_count", phase=phase, source="database") >= 1
+    assert delta("cars_phase_duration_seconds_count", phase="encoding", source="cache") == 1
+    assert delta("cars_phase_duration_seconds_count", phase="db_execute", source="cache") == 0
+    assert delta("cars_rows_returned_sum", source="database") == returned + streamed == 12
+    assert delta("cars_rows_returned_sum", source="cache") == returned
+
+
+def test_payload_bytes_and_inventory_size(main_module, stock_db, client, monkeypatch):
+    for name in ("inventory_data", "inventory_arrays", "inventory_text_index", "inventory_facets",
+                 "inventory_upload_time"):
+        monkeypatch.setattr(main_module, name, getattr(main_module, name))
+    before = scrape(client)
+    with open(SAMPLE_INVENTORY_XLSX, "rb") as f:
+        body = f.read()
+    response = client.post("/inventory/upload/", files={"file": ("stock_inventario.xlsx", body)})
+    assert response.status_code == 200
+    after = scrape(client)
+
+    route = "/inventory/upload/"
+    bytes_in = (sample(after, "http_payload_bytes_sum", route=route, direction="in")
+                - sample(before, "http_payload_bytes_sum", route=route, direction="in"))
+    bytes_out = (sample(after, "http_payload_bytes_sum", route=route, direction="out")
+                 - sample(before, "http_payload_bytes_sum", route=route, direction="out"))
+    assert bytes_in > len(body)  # The multipart body wraps the file
+    assert bytes_out == len(response.content)
+    assert sample(after, "inventory_rows") == response.json()["statistics"]["total_records"]
+    assert sample(after, "inventory_memory_bytes") > 0
+
+
+def test_histogram_rendering(main_module):
+    metric = main_module.PrometheusMetric("example_seconds", "histogram", "Example.", ("path",), (0.1, 1.0))
+    metric.observe(0.05, path='a"b')
+    metric.observe(0.5, path='a"b')
+    assert metric.render() == [
+        "# HELP example_seconds Example.",
+        "# TYPE example_seconds histogram",
+        'example_seconds_bucket{path="a\\"b",le="0.1"} 1',
+        'example_seconds_bucket{path="a\\"b",le="1"} 2',
+        'example_seconds_bucket{path="a\\"b",le="+Inf"} 2',
+        'example_seconds_sum{path="a\\"b"} 0.55',
+        'example_seconds_count{path="a\\"b"} 2',
+    ]
@@ -0,0 +1,172 @@
+import json
+import re
+
+import pytest
+from sqlalchemy import text
+
+from conftest import PAYLOAD_PATH
+
+
+def query_plan(main_module, engine, **filters):
+    with engine.connect() as connection:
+        sql, params = main_module.build_cars_query(connection, **filters)
+        plan = connection.execute(main_module.bind_cars_query("EXPLAIN QUERY PLAN " + sql, params), params)
+        return params, " | ".join(row[-1] for row in plan)
+
+
+def contains(value, needle):
+    return value is not None and needle.lower() in value.lower()
+
+
+def like(value, needle):
+    """LIKE '%needle%' as SQLite evaluates it for ASCII text: case-insensitive, with % and _ wildcards."""
+    pattern = ''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch) for ch in needle)
+    return value is not None and re.search(pattern, value, re.IGNORECASE | re.DOTALL) is not None
+
+
+def test_startup_creates_search_indexes(main_module, stock_db, client):
+    from app.stock_schema import STOCK_SEARCH_INDEXES
+
+    with stock_db.connect() as connection:
+        indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert set(STOCK_SEARCH_INDEXES) <= indexes
+
+
+@pytest.mark.parametrize("filters, index", [
+    ({"year": 2024}, "ix_vehicles_stock_fecha_matriculacion"),
+    ({"transmission": "auto"}, "ix_vehicles_stock_transmision_fecha"),
+    ({"transmission": "manual", "year": 2024}, "ix_vehicles_stock_transmision_fecha"),
+    ({"make": "land"}, "ix_vehicles_stock_marca_inv_fecha"),
+    ({"tienda": "m1", "vo_vn": "new"}, "ix_vehicles_stock_tienda_vo_vn_norm"),
+    ({"vo_vn": "new"}, "ix_vehicles_stock_vo_vn_norm"),
+    ({"vin": "W1KAF0DB3RR231262"}, "ix_vehicles_stock_vin"),
+])
+def test_filters_are_planned_as_index_searches(main_module, stock_db, loaded_stock, filters, index):
+    params, plan = query_plan(main_module, stock_db, **filters)
+    assert "SCAN vehicles_stock" not in plan
+    assert f"SEARCH vehicles_stock USING INDEX {index}" in plan
+
+
+def test_enumerated_filters_resolve_to_matching_values(main_module, stock_db, loaded_stock):
+    params, _ = query_plan(main_module, stock_db, make="land", transmission="AUTO", year=2024)
+    assert params["make_marca"] == ["LAND ROVER"]
+    assert sorted(params["make_marca_inv"]) == ["LAND ROVER", "Land-Rover"]
+    assert params["transmission_tipo_transmision"] == ["AUTOMATIC"]
+    assert params["year_start"].year == 2024 and params["year_end"].year == 2025
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("marca=land", lambda row: contains(row['marca'], 'land') or contains(row['marca_inv'], 'land')),
+    ("marca=porsche", lambda row: False),
+    ("marca=land%25rover", lambda row: like(row['marca'], 'land%rover') or like(row['marca_inv'], 'land%rover')),
+    ("marca=l_nd", lambda row: like(row['marca'], 'l_nd') or like(row['marca_inv'], 'l_nd')),
+    ("tipo_transmision=%25", lambda row: row['tipo_transmision'] is not None),
+    ("tipo_transmision=man", lambda row: contains(row['tipo_transmision'], 'man')),
+    ("year=2024", lambda row: (row['fecha_matriculacion'] or '').startswith('2024')),
+    ("year=9999", lambda row: False),
+    ("year=10000", lambda row: False),
+    ("year=-5", lambda row: False),
+    ("tienda=a1&vo_vn=NEW", lambda row: contains(row['workflow_estado'], 'a1') and contains(row['workflow_estado'], 'new')),
+])
+def test_rewritten_filters_match_substring_semantics(client, loaded_stock, query, expected):
+    response = client.get(f"/cars/?{query}")
+    assert response.status_code == 200
+    assert sorted(car['ficha_id'] for car in response.json()) == sorted(row['ficha_id'] for row in loaded_stock if expected(row))
+
+
+def test_lookup_is_refreshed_after_stock_update(main_module, stock_db, client, loaded_stock):
+    assert client.get("/cars/?marca=porsche").json() == []
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        payload = json.load(f)
+    payload['datos'][0][[c[0] for c in payload['campos']].index('marca')] = 'PORSCHE'
+    client.post("/stock/", json=payload)
+    assert [car['marca'] for car in client.get("/cars/?marca=porsche").json()] == ['PORSCHE']
+
+
+@pytest.mark.parametrize("bump_version", [True, False])
+def test_lookup_finds_values_committed_by_other_processes(main_module, stock_db, client, loaded_stock, bump_version):
+    assert client.get("/cars/?marca=porsche&tipo_transmision=cvt").json() == []
+    # Another worker's push or a sync (which bumps the version), or a direct edit of the table (which does not)
+    with stock_db.begin() as connection:
+        connection.execute(text("UPDATE vehicles_stock SET marca = 'PORSCHE', marca_efectiva = 'PORSCHE', "
+                                "tipo_transmision = 'CVT' WHERE ficha_id = (SELECT MIN(ficha_id) FROM vehicles_stock)"))
+        if bump_version:
+            main_module.bump_stock_version(connection)
+    main_module.cars_result_cache.entries.clear()
+    assert [car['marca'] for car in client.get("/cars/?marca=porsche&tipo_transmision=cvt").json()] == ['PORSCHE']
+
+
+def test_cars_keyset_pages_follow_ficha_id(client, loaded_stock):
+    expected = sorted(row['ficha_id'] for row in loaded_stock if 'land' in (row['marca'] or '').lower()
+                      or 'land' in (row['marca_inv'] or '').lower())
+    seen, cursor = [], None
+    while True:
+        params = {"marca": "land", "limit": 2, "include_total": "true"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/cars/", params=params)
+        assert response.headers["X-Total-Count"] == str(len(expected))
+        seen.extend(car['ficha_id'] for car in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == expected
+    assert client.get("/cars/?cursor=%%%").status_code == 400
+
+
+def test_keyset_page_uses_the_filter_index(main_module, stock_db, loaded_stock):
+    _, plan = query_plan(main_module, stock_db, transmission="manual", after_ficha_id=590105)
+    assert "SEARCH vehicles_stock USING" in plan
+
+
+def legacy_post_processing(row):
+    """The per-row pass /cars/ used to apply to every result before the derived columns."""
+    result = {"marca": row['marca'], "modelo": row['modelo'], "tienda": None, "vo_vn": None}
+    if row['modelo_inv'] is not None and str(row['modelo_inv']).strip() != "":
+        result["modelo"] = row['modelo_inv']
+    if not result["modelo"] or not str(result["modelo"]).strip():
+        result["modelo"] = row['descripcion']
+    if row['marca_inv'] is not None and str(row['marca_inv']).strip() != "":
+        result["marca"] = row['marca_inv']
+    parts = (row['workflow_estado'] or '').split()
+    if len(parts) >= 3:
+        result["tienda"], result["vo_vn"] = parts[1], parts[2]
+    return result
+
+
+def test_derived_columns_match_legacy_post_processing(client, loaded_stock):
+    cars = {car['ficha_id']: car for car in client.get("/cars/").json()}
+    for row in loaded_stock:
+        expected = legacy_post_processing(row)
+        car = cars[row['ficha_id']]
+        assert (car['marca'], car['modelo']) == (expected['marca'], expected['modelo'])
+        assert (car['tienda'], car['vo_vn']) == (expected['tienda'], expected['vo_vn'])
+
+
+def test_existing_rows_are_backfilled(main_module, stock_db):
+    with stock_db.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO vehicles_stock (ficha_id, marca, marca_inv, modelo, modelo_inv, descripcion, workflow_estado) "
+            "VALUES (1, 'LAND ROVER', ' ', '', NULL, 'Evoque P300e', 'Stock m1 vo'), "
+            "(2, 'Smart', 'SMART', 'fortwo', 'ForTwo EQ', NULL, 'Stock A1')"))
+    main_module.ensure_stock_derived_columns()
+    with stock_db.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT marca_efectiva, modelo_efectivo, tienda, vo_vn, tienda_norm, vo_vn_norm "
+            "FROM vehicles_stock ORDER BY ficha_id")).all()
+    assert [tuple(row) for row in rows] == [('LAND ROVER', 'Evoque P300e', 'm1', 'vo', 'M1', 'VO'),
+                                            ('SMART', 'ForTwo EQ', 'A1', None, 'A1', None)]
+
+
+def test_tienda_and_vo_vn_are_exact_matches(client, loaded_stock):
+    assert client.get("/cars/?tienda=M").json() == []
+    assert len(client.get("/cars/?tienda=m1").json()) == sum('M1' in row['workflow_estado'].upper() for row in loaded_stock)
+
+
+def test_tienda_and_vo_vn_are_returned_as_pushed(client, loaded_stock):
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        payload = json.load(f)
+    payload['datos'][0][[c[0] for c in payload['campos']].index('workflow_estado')] = 'Stock m1 Vo'
+    client.post("/stock/", json=payload)
+    cars = client.get("/cars/?tienda=M1&vo_vn=vo").json()
+    assert [(car['ficha_id'], car['tienda'], car['vo_vn']) for car in cars] == [(payload['datos'][0][0], 'm1', 'Vo')]
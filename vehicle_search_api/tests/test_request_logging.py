@@ -0,0 +1,77 @@
+import json
+import logging
+
+import pytest
+
+from conftest import PAYLOAD_PATH, SAMPLE_INVENTORY_XLSX
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def request_logs(main_module):
+    handler = Collect()
+    main_module.logger.addHandler(handler)
+    yield lambda: [record.fields for record in handler.records if record.getMessage() == "request"]
+    main_module.logger.removeHandler(handler)
+
+
+def payload():
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("path", ["/stock/", "/stock/stream/"])
+def test_stock_pushes_log_payload_metadata(main_module, stock_db, client, request_logs, monkeypatch, path):
+    monkeypatch.setattr(main_module, "REQUEST_LOG_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(main_module, "LOG_VALUE_MAX_CHARS", 80)
+    body = json.dumps(payload()).encode()
+    assert client.post(path, content=body, headers={"Content-Type": "application/json"}).status_code == 200
+
+    [fields] = request_logs()
+    assert fields["method"] == "POST" and fields["path"] == path and fields["status"] == 200
+    assert fields["bytes_in"] == len(body) and fields["bytes_out"] > 0
+    assert fields["payload_rows"] == len(payload()["datos"])
+    assert fields["payload_columns"].startswith('["ficha_id",') and len(fields["payload_columns"]) == 83
+    assert len(fields["payload_preview"]) == main_module.REQUEST_LOG_PREVIEW_ROWS
+    assert all(len(row) <= 83 for row in fields["payload_preview"])
+
+
+def test_ordinary_requests_are_sampled(main_module, stock_db, client, request_logs, monkeypatch):
+    monkeypatch.setattr(main_module, "REQUEST_LOG_SAMPLE_RATE", 0.0)
+    client.get("/cars/?marca=land")
+    assert request_logs() == []
+    monkeypatch.setattr(main_module, "REQUEST_LOG_SAMPLE_RATE", 1.0)
+    response = client.get("/cars/?marca=land")
+    [fields] = request_logs()
+    assert fields["path"] == "/cars/" and fields["status"] == 200 and fields["bytes_out"] == len(response.content)
+    assert fields["duration_ms"] >= 0 and "payload_rows" not in fields
+
+
+def test_inventory_uploads_log_payload_metadata(main_module, client, request_logs, monkeypatch):
+    monkeypatch.setattr(main_module, "REQUEST_LOG_SAMPLE_RATE", 0.0)
+    for name in ("inventory_data", "inventory_arrays", "inventory_text_index", "inventory_facets",
+                 "inventory_upload_time"):
+        monkeypatch.setattr(main_module, name, getattr(main_module, name))
+    with open(SAMPLE_INVENTORY_XLSX, "rb") as f:
+        response = client.post("/inventory/upload/", files={"file": ("stock_inventario.xlsx", f)})
+    assert response.status_code == 200
+    [fields] = request_logs()
+    assert fields["filename"] == "stock_inventario.xlsx"
+    assert fields["payload_rows"] == response.json()["statistics"]["total_records"]
+
+
+def test_structured_formatter_writes_json_lines(main_module):
+    record = logging.LogRecord("vehicle_search_api", logging.INFO, __file__, 1, "request", None, None)
+    record.fields = {"path": "/cars/", "status": 200}
+    entry = json.loads(main_module.StructuredFormatter(json_lines=True).format(record))
+    assert entry["message"] == "request" and entry["path"] == "/cars/" and entry["status"] == 200
+    text = main_module.StructuredFormatter(json_lines=False).format(record)
+    assert text.endswith('INFO request path="/cars/" status=200')
@@ -0,0 +1,239 @@
+import json
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from conftest import PAYLOAD_PATH
+
+
+@pytest.fixture(scope="module")
+def payload():
+    with open(PAYLOAD_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def chunked(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+def stock_rows(engine):
+    with engine.connect() as connection:
+        return [dict(row) for row in connection.execute(
+            text("SELECT * FROM vehicles_stock ORDER BY ficha_id")).mappings()]
+
+
+def stock_tables(engine):
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_stream_parser_emits_campos_then_rows(main_module, payload, chunk_size):
+    parser = main_module.StockPayloadStreamParser()
+    events = []
+    for chunk in chunked(json.dumps(payload).encode(), chunk_size):
+        events.extend(parser.feed(chunk))
+    events.extend(parser.feed(b'', final=True))
+
+    assert events[0] == ('campos', payload['campos'])
+    assert [value for kind, value in events[1:]] == payload['datos']
+
+
+@pytest.mark.parametrize("body", [b'{"campos": ["vin"], "datos": [["A"]', b'{"campos": [], "datos": {}}', b'[1]'])
+def test_stream_parser_rejects_malformed_bodies(main_module, body):
+    parser = main_module.StockPayloadStreamParser()
+    with pytest.raises(main_module.StockPayloadError):
+        parser.feed(body, final=True)
+
+
+def test_stream_endpoint_matches_buffered_endpoint(main_module, stock_db, client, payload, monkeypatch):
+    response = client.post("/stock/", json=payload)
+    assert response.json() == {"message": "Stock updated successfully", "records_added": len(payload['datos'])}
+    buffered = stock_rows(stock_db)
+    assert buffered[0]['marca'] == 'MERCEDES-BENZ'
+
+    monkeypatch.setattr(main_module, "STOCK_INSERT_BATCH_SIZE", 3)
+    response = client.post("/stock/stream/", content=chunked(json.dumps(payload).encode(), 100))
+    assert response.status_code == 200
+    assert response.json() == {"message": "Stock updated successfully", "records_added": len(payload['datos'])}
+    assert stock_rows(stock_db) == buffered
+
+
+def test_stream_endpoint_rolls_back_on_malformed_body(stock_db, client, payload):
+    client.post("/stock/", json=payload)
+    body = json.dumps(payload).encode()[:-200]
+    response = client.post("/stock/stream/", content=chunked(body, 64))
+    assert response.status_code == 400
+    assert len(stock_rows(stock_db)) == len(payload['datos'])
+
+
+def test_stream_endpoint_without_rows_keeps_stock(stock_db, client, payload):
+    client.post("/stock/", json=payload)
+    response = client.post("/stock/stream/", content=b'{"campos": ["vin"], "datos": []}')
+    assert response.json() == {"message": "No data provided to update. Stock remains unchanged."}
+    assert len(stock_rows(stock_db)) == len(payload['datos'])
+
+
+@pytest.mark.parametrize("body", [
+    b'{"campos": ["vin", "marca"], "datos": [["A", "B"], ["C"',
+    b'{"campos": ["vin"], "datos": []}',
+    b'{"datos": [["A"]]}',
+])
+def test_stream_endpoint_leaves_the_schema_alone_without_rows_to_load(stock_db, client, body):
+    def schema():
+        return stock_tables(stock_db), [column['name'] for column in inspect(stock_db).get_columns('vehicles_stock')]
+
+    before = schema()
+    response = client.post("/stock/stream/?mode=diff", content=body)
+    assert response.status_code in (200, 400)
+    assert schema() == before
+
+
+def test_diff_mode_applies_only_changes(stock_db, client, payload):
+    client.post("/stock/", json=payload)
+    replaced = stock_rows(stock_db)
+
+    changed = json.loads(json.dumps(payload))
+    vanished_id = changed['datos'].pop()[0]
+    changed['datos'][0][changed['campos'].index(['color', 'varchar(100)', 'YES', '', None, ''])] = 'Rojo'
+    new_row = list(changed['datos'][1])
+    new_row[0] = 999999
+    changed['datos'].append(new_row)
+
+    response = client.post("/stock/?mode=diff", json=changed)
+    assert response.status_code == 200
+    # The first diff push has no stored hashes yet, so every kept row is rewritten once
+    assert response.json()["records_deleted"] == 1
+    assert response.json()["records_added"] == 1
+
+    response = client.post("/stock/stream/?mode=diff", content=json.dumps(changed).encode())
+    assert response.json() == {"message": "Stock updated successfully", "records_added": 0,
+                               "records_updated": 0, "records_deleted": 0,
+                               "records_unchanged": len(changed['datos'])}
+
+    changed['datos'][2][changed['campos'].index(['kms', 'bigint', 'YES', '', None, ''])] = 1234
+    response = client.post("/stock/?mode=diff", json=changed)
+    assert response.json()["records_updated"] == 1
+    assert response.json()["records_unchanged"] == len(changed['datos']) - 1
+
+    rows = {row['ficha_id']: row for row in stock_rows(stock_db)}
+    assert vanished_id not in rows
+    assert rows[999999]['marca'] == replaced[1]['marca']
+    assert rows[changed['datos'][0][0]]['color'] == 'Rojo'
+    assert rows[changed['datos'][2][0]]['kms'] == 1234
+
+    # A diff push leaves the same content as a full replace of the same payload
+    client.post("/stock/", json=changed)
+    replaced_again = {row['ficha_id']: row for row in stock_rows(stock_db)}
+    assert replaced_again == rows
+
+
+def test_diff_mode_deletes_rows_without_ficha_id(stock_db, client, payload):
+    client.post("/stock/", json=payload)
+    with stock_db.begin() as connection:
+        connection.execute(text("UPDATE vehicles_stock SET ficha_id = NULL WHERE ficha_id IN (:a, :b)"),
+                           {"a": payload['datos'][0][0], "b": payload['datos'][1][0]})
+
+    response = client.post("/stock/?mode=diff", json=payload)
+    assert response.status_code == 200
+    assert response.json()["records_deleted"] == 2
+    assert response.json()["records_added"] == 2
+    rows = stock_rows(stock_db)
+    assert [row['ficha_id'] for row in rows] == sorted(row[0] for row in payload['datos'])
+
+
+def test_diff_mode_rejects_duplicated_keys(stock_db, client, payload):
+    client.post("/stock/", json=payload)
+    duplicated = dict(payload, datos=payload['datos'] + payload['datos'][:1])
+    response = client.post("/stock/?mode=diff", json=duplicated)
+    assert response.status_code == 422
+    assert len(stock_rows(stock_db)) == len(payload['datos'])
+
+
+def test_swap_mode_matches_replace_and_keeps_indexes(main_module, stock_db, client, payload, monkeypatch):
+    with stock_db.begin() as connection:
+        connection.execute(text("CREATE INDEX ix_vehicles_stock_marca ON vehicles_stock (marca)"))
+    client.post("/stock/", json=payload)
+    replaced = stock_rows(stock_db)
+
+    main_module.get_vehicles_stock_table(refresh=True)
+    monkeypatch.setitem(main_module.MULTI_ROW_INSERT_MAX_PARAMS, 'sqlite', 100)
+    response = client.post("/stock/?mode=swap", json=payload)
+    assert response.json() == {"message": "Stock updated successfully", "records_added": len(payload['datos'])}
+    assert stock_rows(stock_db) == replaced
+
+    monkeypatch.setattr(main_module, "STOCK_LOAD_MODE", "swap")
+    response = client.post("/stock/stream/", content=json.dumps(payload).encode())
+    assert response.status_code == 200
+    assert stock_rows(stock_db) == replaced
+
+    with stock_db.connect() as connection:
+        indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert stock_tables(stock_db) == {'vehicles_stock', 'vehicles_stock_version'}
+    assert 'ix_vehicles_stock_marca' in indexes
+
+
+def test_concurrent_swap_loads_get_their_own_staging_tables(main_module, stock_db):
+    table = main_module.prepare_stock_load('swap')
+    # Committed before the swap, as MySQL does implicitly for CREATE TABLE
+    with stock_db.begin() as connection:
+        loaders = [main_module.StockLoader(connection, table, 'swap') for _ in range(2)]
+        for loader in loaders:
+            loader.start()
+    staging = {loader.staging_name for loader in loaders}
+    assert len(staging) == 2 and staging <= stock_tables(stock_db)
+
+    for loader in loaders:
+        loader.discard()
+    assert stock_tables(stock_db) == {'vehicles_stock', 'vehicles_stock_version'}
+
+
+def test_unknown_mode_is_rejected(stock_db, client, payload):
+    assert client.post("/stock/?mode=merge", json=payload).status_code == 422
+    assert client.post("/stock/stream/?mode=merge", content=json.dumps(payload).encode()).status_code == 422
+
+
+@pytest.mark.parametrize("url", ["/stock/", "/stock/stream/"])
+def test_database_errors_while_preparing_the_load_are_reported(main_module, stock_db, client, payload, monkeypatch, url):
+    def prepare_stock_load(mode):
+        raise OperationalError("ALTER TABLE vehicles_stock", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(main_module, "prepare_stock_load", prepare_stock_load)
+    response = client.post(url, content=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    assert response.status_code == 500
+    assert response.json()["detail"].startswith("Database transaction failed: (builtins.Exception) database is locked")
+
+
+def test_column_converter_matches_per_cell_conversion(main_module, payload):
+    fields = [main_module.stock_field_name(c) for c in payload['campos']]
+    odd_rows = [
+        ['1,5', '', None, '2024-01-05', 'not a number', True, 7, '3.000', '0001-01-01 00:00:00'],
+        [12.9, 'x', '', '2024-12-16 10:20:30', 3, '12,25', None],
+        ['nan'],
+    ]
+    odd_fields = ['ficha_id', 'marca', 'modelo', 'fecha_matriculacion', 'kms', 'pvp_api', 'workflow_id',
+                  'grossvalue', 'fecha_matriculacion_JAWA']
+
+    for rows, names in ((payload['datos'], fields), (odd_rows, odd_fields)):
+        expected = [main_module.convert_stock_row(row, names) for row in rows]
+        assert main_module.StockColumnConverter(names).convert(rows) == expected
+
+
+@pytest.mark.parametrize("query", ["/cars/?marca=land", "/cars/?format=ndjson&include_total=true"])
+def test_cars_recover_after_table_is_replaced_without_derived_columns(main_module, stock_db, client, payload, query):
+    assert client.post("/stock/", json=payload).status_code == 200
+    expected = client.get(query)
+    # A sync replaces vehicles_stock with the source columns only, behind the cached metadata
+    columns = list(main_module.VEHICLE_STOCK_SCHEMA)
+    with stock_db.begin() as connection:
+        connection.execute(text(f"CREATE TABLE vehicles_stock_sync AS SELECT {', '.join(columns)} FROM vehicles_stock"))
+        connection.execute(text("DROP TABLE vehicles_stock"))
+        connection.execute(text("ALTER TABLE vehicles_stock_sync RENAME TO vehicles_stock"))
+
+    for _ in range(2):
+        response = client.get(query)
+        assert response.status_code == 200, response.text
+        assert response.content == expected.content
+    assert client.post("/stock/", json=payload).status_code == 200